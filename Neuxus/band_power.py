@@ -0,0 +1,142 @@
+import numpy as np
+from neuxus.node import Node
+from collections import deque
+from scipy.signal import get_window
+
+
+# (name, [fmin, fmax], left electrodes, right electrodes) of cwl_lisboa_eeg_bands.ipynb
+DEFAULT_BANDS = [
+    ('slow', [0.8, 4], ['F3', 'C3', 'P3'], ['F4', 'C4', 'P4']),
+    ('theta', [5, 8], ['F3', 'AF3', 'FC1'], ['F4', 'AF4', 'FC2']),
+    ('alpha', [8, 13], ['P3', 'P7', 'O1'], ['P4', 'P8', 'O2']),
+    ('smr', [12, 15], ['C3'], ['C4']),
+    ('beta2', [13, 24], ['F3', 'C3', 'P3'], ['F4', 'C4', 'P4']),
+]
+
+
+class BandPower(Node):
+    """Left/right band powers and asymmetry ratios for neurofeedback.
+
+    The PSD is the Welch average of the periodograms of the last n_segments
+    segments of n_fft samples (hop n_fft - n_overlap, mean of each segment
+    removed, Hamming window, density scaling as psd_array_welch). The
+    periodograms of the segments completed between two outputs are computed
+    with one FFT for all the channels used by the bands and kept in a
+    running sum, so that the PSD is updated by segment and shared by all
+    bands and electrode groups.
+
+    For each band the output has the power of the left and right groups
+    (mean over the electrodes and the frequencies fmin to fmax of the PSD)
+    and their ratio (left - right) / right * 100, as in the notebook, sent
+    at `rate` Hz (in data time) from the last sample of the first segment.
+    Each output has the PSD of the segments complete at its sample, so the
+    outputs do not depend on the chunk sizes.
+    """
+
+    def __init__(self, input_port, bands=DEFAULT_BANDS, n_fft=256, n_overlap=128, n_segments=8, rate=4.):
+        Node.__init__(self, input_port)
+        self.sfreq = self.input.sampling_frequency
+        self.n_fft = n_fft
+        self.hop = n_fft - n_overlap
+        self.rate = rate
+
+        # Channels used by any band
+        channels = list(self.input.channels)
+        electrodes = []
+        for _, _, left, right in bands:
+            electrodes += [e for e in left + right if e not in electrodes]
+        missing = [e for e in electrodes if e not in channels]
+        if missing:
+            raise ValueError('Channels %s not found in the input' % missing)
+        self.picks = [channels.index(e) for e in electrodes]
+
+        # Frequency bins of the bands and electrodes of the groups
+        freqs = np.fft.rfftfreq(n_fft, 1 / self.sfreq)
+        self.band_bins = np.zeros((len(freqs), len(bands)))
+        self.groups = []
+        self.feature_names = []
+        for b, (name, (fmin, fmax), left, right) in enumerate(bands):
+            in_band = (freqs >= fmin) & (freqs <= fmax)
+            if not in_band.any():
+                raise ValueError('No frequency bin in the band %s with n_fft=%d' % (name, n_fft))
+            self.band_bins[in_band, b] = 1 / in_band.sum()
+            self.groups.append(([electrodes.index(e) for e in left], [electrodes.index(e) for e in right]))
+            self.feature_names += [name + '_left', name + '_right', name + '_ratio']
+
+        # Density scaling of the periodograms, one-sided
+        self.window = get_window('hamming', n_fft)
+        self.scale = np.full(len(freqs), 2 / (self.sfreq * (self.window ** 2).sum()))
+        self.scale[0] /= 2
+        if n_fft % 2 == 0:
+            self.scale[-1] /= 2
+
+        self.periodograms = deque()
+        self.n_segments = n_segments
+        self.psd_sum = np.zeros((len(electrodes), len(freqs)))
+        # Samples of the segments that are not complete yet
+        self._pending = np.empty((0, len(electrodes)))
+        # Samples received and index of the next output sample
+        self.n_times = 0
+        self._next_output = 0.
+
+        self.output.set_parameters(
+            data_type='signal',
+            channels=self.feature_names,
+            sampling_frequency=rate,
+            meta=self.input.meta,
+            epoching_frequency=None
+        )
+
+    def _add_segments(self, samples):
+        # Periodograms of all the complete segments, one FFT for all of them
+        n_new = (len(samples) - self.n_fft) // self.hop + 1
+        if n_new <= 0:
+            return samples
+        starts = np.arange(n_new) * self.hop
+        segments = samples[starts[:, None] + np.arange(self.n_fft)]  # (segments, n_fft, channels)
+        # Mean of each segment removed, as psd_array_welch (remove_dc)
+        segments = segments - segments.mean(axis=1, keepdims=True)
+        spectra = np.fft.rfft(segments * self.window[None, :, None], axis=1)
+        periodograms = (np.abs(spectra) ** 2).transpose(0, 2, 1) * self.scale
+        for periodogram in periodograms[-self.n_segments:]:
+            self.periodograms.append(periodogram)
+            self.psd_sum += periodogram
+            if len(self.periodograms) > self.n_segments:
+                self.psd_sum -= self.periodograms.popleft()
+        return samples[n_new * self.hop:]
+
+    def features(self):
+        """Band powers and ratios of the current PSD."""
+        band_power = (self.psd_sum / len(self.periodograms)) @ self.band_bins  # (channels, bands)
+        features = []
+        for b, (left, right) in enumerate(self.groups):
+            left_power = band_power[left, b].mean()
+            right_power = band_power[right, b].mean()
+            features += [left_power, right_power, (left_power - right_power) / right_power * 100]
+        return np.array(features)
+
+    def update(self):
+        for input_chunk in self.input:
+            values = input_chunk.values[:, self.picks]
+            timestamps = input_chunk.index.values
+            first = self.n_times
+            self.n_times += len(values)
+            rows, output_timestamps = [], []
+            # Samples of the chunk added up to each output sample
+            start = 0
+            while True:
+                if not self.periodograms:
+                    # First output at the last sample of the first segment
+                    self._next_output = first + start + self.n_fft - len(self._pending) - 1
+                output = int(np.floor(self._next_output))
+                if output >= self.n_times:
+                    self._pending = self._add_segments(np.concatenate((self._pending, values[start:])))
+                    break
+                stop = output - first + 1
+                self._pending = self._add_segments(np.concatenate((self._pending, values[start:stop])))
+                start = stop
+                rows.append(self.features())
+                output_timestamps.append(timestamps[output - first])
+                self._next_output += self.sfreq / self.rate
+            if rows:
+                self.output.set(np.array(rows), output_timestamps, self.feature_names)
@@ -0,0 +1,175 @@
+"""
+Batch reprocessing of recordings with the NeuXus file pipelines.
+
+Every recording matching the glob is run through the chosen pipelines of
+save_pipeline_MM.py (Reader -> GA -> DownSample, then PA or CWL) and saved
+to output_dir/<GA|GA_PA|GA_CWL>/Neuxus_<...>_<basename>_raw.fif. The
+(recording, pipeline) jobs are run by a pool of worker processes, each
+limited to --threads BLAS/numexpr/numba threads, in place of the global
+NUMEXPR_MAX_THREADS=18 of the pipeline scripts.
+
+Each output is keyed by the hash of the content of the recording (and of
+the PA weights) and the pipeline parameters, stored in
+output_dir/batch_manifest.json: on a rerun, the jobs whose key did not
+change and whose output exists are skipped. The GA, DownSample and CWL
+stages are read from the stage cache (--cache-dir, see stage_cache.py), so
+the pipelines of a recording and the reruns with other PA or CWL
+parameters do not compute the shared stages again.
+
+python batch.py "C:/Vision/eeg/raw/GA_CWL/P*_mrion.vhdr" --output-dir Post_corrections/Neuxus --pipelines ga ga_cwl --jobs 4 --threads 2
+"""
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+
+from stage_cache import input_files, content_hash
+
+
+PIPELINES = {
+    'ga': ('GA', 'Neuxus_GA_%s_raw.fif'),
+    'ga_pa': ('GA_PA', 'Neuxus_GA_PA_%s_raw.fif'),
+    'ga_cwl': ('GA_CWL', 'Neuxus_GA_CWL_%s_raw.fif'),
+}
+
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'NUMEXPR_NUM_THREADS', 'NUMEXPR_MAX_THREADS', 'NUMBA_NUM_THREADS']
+
+
+def pipeline_parameters(pipeline, args):
+    # Parameters an output depends on
+    parameters = {'start_marker': args.start_marker, 'tr': args.tr, 'decimation': args.decimation}
+    if pipeline == 'ga_pa':
+        parameters['pa_weights'] = args.pa_weights
+    if pipeline == 'ga_cwl':
+        parameters.update(time_delay=args.time_delay, window_duration=args.window_duration,
+                          overlap=args.overlap, cwl_mode=args.cwl_mode)
+    return parameters
+
+
+def run_job(job):
+    """Run one pipeline on one recording (in a worker process)."""
+    start = time.perf_counter()
+    try:
+        from neuxus.nodes import correct
+        from save import Save
+        from stage_cache import StageCache, stage_reader
+
+        parameters = job['parameters']
+        os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+        # Cached stages of the recording in the chunks of the RDA blocks (100 samples)
+        cache = StageCache(job['cache_dir'], max_bytes=job['cache_size'])
+        stages = [('ga', {'start_marker': parameters['start_marker'], 'tr': parameters['tr']}),
+                  ('downsample', {'factor': parameters['decimation']})]
+        if job['pipeline'] == 'ga_cwl':
+            stages.append(('cwl', {'time_delay': parameters['time_delay'], 'window_duration': parameters['window_duration'],
+                                   'overlap': parameters['overlap'], 'mode': parameters['cwl_mode']}))
+        signal = stage_reader(cache, job['input'], stages, chunk_size=100, block_size=5000)
+        nodes = [signal]
+        if job['pipeline'] == 'ga_pa':
+            signal_pa = correct.PA(signal.output, weights_path=parameters['pa_weights'])
+            nodes += [signal_pa, Save(signal_pa.output, marker_input_port=signal_pa.marker_output,
+                                      filename=job['output'], overwrite=True, flush_interval=10)]
+        else:
+            nodes.append(Save(signal.output, filename=job['output'], overwrite=True, flush_interval=10))
+
+        ports = []
+        for node in nodes:
+            ports += [port for port in [node.output, getattr(node, 'marker_output', None)] if port is not None]
+        # Same loop as the NeuXus runner, until the end of the recording
+        while True:
+            finished = signal.finished
+            for port in ports:
+                port.clear()
+            for node in nodes:
+                node.update()
+            if finished:
+                break
+        for node in nodes:
+            node.terminate()
+    except Exception as error:
+        return job, time.perf_counter() - start, repr(error)
+    return job, time.perf_counter() - start, None
+
+
+def _set_thread_limits(threads):
+    # Inherited by the spawned workers, before they import numpy
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+
+
+def _write_manifest(path, manifest):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pattern", type=str, help="Glob of the recordings (.vhdr, .gdf, .set, .xdf)")
+    parser.add_argument("--output-dir", type=str, required=True)
+    parser.add_argument("--pipelines", type=str, nargs='+', default=['ga', 'ga_cwl'], choices=sorted(PIPELINES))
+    parser.add_argument("--jobs", type=int, default=max(os.cpu_count() // 2, 1), help="Worker processes")
+    parser.add_argument("--threads", type=int, default=1, help="Threads per worker (BLAS, numexpr, numba)")
+    parser.add_argument("--force", action='store_true', help="Rerun the jobs that are up to date")
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help="Stage cache (default output_dir/stage_cache)")
+    parser.add_argument("--cache-size", type=float, default=50e9, help="Bytes of the stage cache")
+    parser.add_argument("--start-marker", type=str, default='Response/R128')
+    parser.add_argument("--tr", type=float, default=0.8)
+    parser.add_argument("--decimation", type=int, default=20)
+    parser.add_argument("--pa-weights", type=str, default=None)
+    parser.add_argument("--time-delay", type=float, default=21e-3)
+    parser.add_argument("--window-duration", type=float, default=4.)
+    parser.add_argument("--overlap", type=float, default=0.5)
+    parser.add_argument("--cwl-mode", type=str, default='window', choices=['window', 'incremental'])
+    args = parser.parse_args()
+    if 'ga_pa' in args.pipelines and args.pa_weights is None:
+        parser.error("--pa-weights is required by the ga_pa pipeline")
+
+    manifest_path = os.path.join(args.output_dir, 'batch_manifest.json')
+    manifest = {'hashes': {}, 'outputs': {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    jobs = []
+    skipped = 0
+    for path in sorted(glob.glob(args.pattern, recursive=True)):
+        basename = os.path.splitext(os.path.basename(path))[0]
+        recording_hash = content_hash(input_files(path), manifest['hashes'])
+        for pipeline in args.pipelines:
+            parameters = pipeline_parameters(pipeline, args)
+            hashed = dict(parameters, input=recording_hash, pipeline=pipeline)
+            if pipeline == 'ga_pa':
+                hashed['pa_weights'] = content_hash([args.pa_weights], manifest['hashes'])
+            key = hashlib.sha256(json.dumps(hashed, sort_keys=True).encode()).hexdigest()
+            directory, name = PIPELINES[pipeline]
+            output = os.path.join(args.output_dir, directory, name % basename)
+            if not args.force and manifest['outputs'].get(output) == key and os.path.exists(output):
+                skipped += 1
+                continue
+            jobs.append({'input': path, 'pipeline': pipeline, 'output': output, 'key': key, 'parameters': parameters,
+                         'cache_dir': args.cache_dir or os.path.join(args.output_dir, 'stage_cache'),
+                         'cache_size': args.cache_size})
+    os.makedirs(args.output_dir, exist_ok=True)
+    _write_manifest(manifest_path, manifest)
+    print("%d jobs to run, %d up to date" % (len(jobs), skipped))
+
+    _set_thread_limits(args.threads)
+    failed = 0
+    # spawn: fresh workers that import numpy with the thread limits, one job each
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(min(args.jobs, max(len(jobs), 1)), maxtasksperchild=1) as pool:
+        for job, elapsed, error in pool.imap_unordered(run_job, jobs):
+            if error is None:
+                manifest['outputs'][job['output']] = job['key']
+                _write_manifest(manifest_path, manifest)
+                print("%-8s %s -> %s (%.0f s)" % (job['pipeline'], job['input'], job['output'], elapsed))
+            else:
+                failed += 1
+                print("%-8s %s FAILED: %s" % (job['pipeline'], job['input'], error))
+    print("%d done, %d failed, %d up to date" % (len(jobs) - failed, failed, skipped))
@@ -0,0 +1,87 @@
+"""
+Benchmark of the CBA correction (cba.py) over max_lag and n_jobs.
+
+Compares the per-channel regression of regression.ipynb (a least squares
+fit of every channel on the full design matrix with a constant, as sm.OLS
+does) with cba_data, for max_lag 10 and 100 and 1 to 8 jobs, on a synthetic
+10 minutes, 100 Hz recording (32 EEG + ECG + 4 CWL channels) or on the
+start of a real recording given with --file.
+
+python bench_cba.py
+python bench_cba.py --file P05_eyes_closed_mrion.vhdr --max-lags 10 100 --jobs 1 2 4 8
+"""
+import argparse
+from timeit import default_timer as timer
+import numpy as np
+
+from cba import cba_data
+
+
+def create_lag_signals(original_array, max_lag):
+    positive_lags_combined = np.zeros((max_lag, len(original_array)))
+    negative_lags_combined = np.zeros((max_lag, len(original_array)))
+    for lag in range(1, max_lag + 1):
+        positive_lags_combined[lag - 1, lag:] = original_array[:-lag]
+        negative_lags_combined[lag - 1, :-lag] = original_array[lag:]
+    negative_lags_combined = np.flipud(negative_lags_combined)
+    return np.vstack([negative_lags_combined, original_array, positive_lags_combined])
+
+
+# Former implementation (without statsmodels), kept here as the reference of the benchmark
+def cba_data_legacy(data, pick_indices, cwl_indices, max_lag=10):
+    lags_signals_to_regress = np.vstack([create_lag_signals(signal, max_lag) for signal in data[cwl_indices]]).T
+    X = np.hstack((np.ones((data.shape[1], 1)), lags_signals_to_regress))
+    corrected_data = data.copy()
+    for index in pick_indices:
+        signal = data[index, :]
+        coefficients = np.linalg.lstsq(X, signal, rcond=None)[0][1:]
+        corrected_data[index] = signal - np.dot(lags_signals_to_regress, coefficients)
+    return corrected_data
+
+
+def synthetic_data(duration, sfreq, n_eeg=33, n_cwl=4, seed=0):
+    rng = np.random.default_rng(seed)
+    n_times = int(duration * sfreq)
+    cwl_data = np.cumsum(rng.standard_normal((n_cwl, n_times)), axis=1)
+    mixing = rng.standard_normal((n_eeg, n_cwl))
+    eeg_data = mixing @ np.roll(cwl_data, 2, axis=1) + rng.standard_normal((n_eeg, n_times))
+    return np.vstack((eeg_data, cwl_data)) * 1e-6, np.arange(n_eeg), np.arange(n_eeg, n_eeg + n_cwl)
+
+
+def file_data(filename, duration, sfreq):
+    import mne
+    raw = mne.io.read_raw(filename, preload=True, verbose=False)
+    raw.crop(0, duration).resample(sfreq, verbose=False)
+    cwl_indices = mne.pick_channels(raw.ch_names, ['CWL1', 'CWL2', 'CWL3', 'CWL4'])
+    pick_indices = np.setdiff1d(np.arange(len(raw.ch_names)), cwl_indices)
+    return raw.get_data(), pick_indices, cwl_indices
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default=None)
+    parser.add_argument("--duration", type=float, default=600., help="seconds")
+    parser.add_argument("--sfreq", type=float, default=100.)
+    parser.add_argument("--max-lags", type=int, nargs='+', default=[10, 100])
+    parser.add_argument("--jobs", type=int, nargs='+', default=list(range(1, 9)))
+    parser.add_argument("--no-legacy", action='store_true', help="skip the per-channel reference")
+    args = parser.parse_args()
+
+    if args.file:
+        data, pick_indices, cwl_indices = file_data(args.file, args.duration, args.sfreq)
+    else:
+        data, pick_indices, cwl_indices = synthetic_data(args.duration, args.sfreq)
+    print("%d channels, %d CWL channels, %d samples" % (len(pick_indices), len(cwl_indices), data.shape[1]))
+
+    for max_lag in args.max_lags:
+        reference = None
+        if not args.no_legacy:
+            start = timer()
+            reference = cba_data_legacy(data, pick_indices, cwl_indices, max_lag)
+            print("max_lag %3d  %-18s %8.3f s" % (max_lag, 'per-channel lstsq', timer() - start))
+        for n_jobs in args.jobs:
+            start = timer()
+            corrected = cba_data(data, pick_indices, cwl_indices, max_lag=max_lag, n_jobs=n_jobs)
+            elapsed = timer() - start
+            error = '' if reference is None else "  max abs difference %.3g" % np.abs(corrected - reference).max()
+            print("max_lag %3d  n_jobs %-10d %8.3f s%s" % (max_lag, n_jobs, elapsed, error))
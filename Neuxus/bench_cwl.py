@@ -0,0 +1,88 @@
+"""
+Benchmark of the offline CWL correction (_correct_data).
+
+Compares the former per-channel, per-window lstsq loop with the batched
+implementation of cwl_node.py, on a synthetic 10 minutes, 36 channels,
+250 Hz recording (33 EEG + 4 CWL channels with the 21 ms delays) or on the
+start of a real recording given with --file.
+
+python bench_cwl.py
+python bench_cwl.py --file P05_eyes_closed_mrion.vhdr
+"""
+import argparse
+from timeit import default_timer as timer
+import numpy as np
+
+from cwl_node import delay_data, _correct_data
+
+
+# Former implementation, kept here as the reference of the benchmark
+def _correct_data_legacy(eeg_data, cwl_data, window_size, overlap):
+    hanning_window = np.hanning(window_size)
+    n_channels, n_times = eeg_data.shape
+    eeg_corrected = np.zeros_like(eeg_data)
+    weight_sum = np.zeros_like(eeg_data)
+    step = int(window_size * (1 - overlap))
+    starts = np.arange(0, n_times, step)
+    for ch in range(n_channels):
+        for start in starts:
+            end = min(start + window_size, n_times)
+            actual_window_size = end - start
+            eeg_segment = eeg_data[ch, start:end]
+            cwl_segment = cwl_data[:, start:end]
+            coeffs = np.linalg.lstsq(cwl_segment.T, eeg_segment.T, rcond=None)[0]
+            correction = np.dot(coeffs.T, cwl_segment)
+            corrected_segment = eeg_segment - correction
+            corrected_segment *= hanning_window[:actual_window_size]
+            eeg_corrected[ch, start:end] += corrected_segment
+            weight_sum[ch, start:end] += hanning_window[:actual_window_size]
+    weight_sum[weight_sum == 0] = 1
+    eeg_corrected /= weight_sum
+    return eeg_corrected
+
+
+def synthetic_data(duration, sfreq, n_eeg=33, n_cwl=4, seed=0):
+    rng = np.random.default_rng(seed)
+    n_times = int(duration * sfreq)
+    cwl_data = np.cumsum(rng.standard_normal((n_cwl, n_times)), axis=1)
+    mixing = rng.standard_normal((n_eeg, n_cwl))
+    eeg_data = mixing @ cwl_data + rng.standard_normal((n_eeg, n_times))
+    return eeg_data * 1e-6, cwl_data * 1e-6
+
+
+def file_data(filename, duration, sfreq):
+    import mne
+    raw = mne.io.read_raw(filename, preload=True, verbose=False)
+    raw.crop(0, duration).resample(sfreq, verbose=False)
+    cwl_picks = mne.pick_channels(raw.ch_names, ['CWL1', 'CWL2', 'CWL3', 'CWL4'])
+    eeg_picks = np.setdiff1d(np.arange(len(raw.ch_names)), cwl_picks)
+    return raw.get_data(picks=eeg_picks), raw.get_data(picks=cwl_picks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=str, default=None)
+    parser.add_argument("--duration", type=float, default=600., help="seconds")
+    parser.add_argument("--sfreq", type=float, default=250.)
+    parser.add_argument("--time-delay", type=float, default=21e-3)
+    parser.add_argument("--window-duration", type=float, default=4.)
+    parser.add_argument("--overlap", type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.file:
+        eeg_data, cwl_data = file_data(args.file, args.duration, args.sfreq)
+    else:
+        eeg_data, cwl_data = synthetic_data(args.duration, args.sfreq)
+    cwl_data = delay_data(cwl_data, args.time_delay, args.sfreq)
+    window_size = int(np.ceil(args.window_duration * args.sfreq))
+    print("%d EEG channels, %d regressors, %d samples"
+          % (eeg_data.shape[0], cwl_data.shape[0], eeg_data.shape[1]))
+
+    results = {}
+    for name, function in [('per-channel lstsq', _correct_data_legacy), ('batched', _correct_data)]:
+        start = timer()
+        results[name] = function(eeg_data, cwl_data, window_size, args.overlap)
+        print("%-20s %8.3f s" % (name, timer() - start))
+
+    error = np.abs(results['batched'] - results['per-channel lstsq']).max()
+    print("max abs difference %.3g (signal max %.3g)" % (error, np.abs(eeg_data).max()))
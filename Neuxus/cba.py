@@ -0,0 +1,146 @@
+"""
+CBA (carbon-wire loop based artefact) correction of regression.ipynb without
+statsmodels.
+
+The EEG channels are regressed on a constant and the lagged CWL signals
+(lags -max_lag to +max_lag, zeros out of the recording) over the whole
+recording, as cba() of the notebook does channel by channel with sm.OLS.
+Here the design matrix is factorized once and all the channels are solved
+together: the recording is split in time segments, the R factor of the QR
+decomposition of [1, X, Y] is computed for every segment, and the stacked
+segment factors are factorized again (TSQR), which gives the least squares
+solution of all channels without building the whole design matrix.
+
+With n_jobs > 1 the segments are processed by a process pool. The data are
+put once in shared memory (multiprocessing.shared_memory, Python >= 3.8)
+and only segment bounds and coefficients are sent to the workers. On
+Windows the calling script must be protected by if __name__ == "__main__".
+"""
+import numpy as np
+import mne
+
+
+def lag_design(cwl, start, stop, max_lag):
+    """Lagged CWL signals of the samples start to stop, (stop - start) x
+    (n_cwl * (2 * max_lag + 1)), in the column order of create_lag_signals
+    of the notebook: for every CWL channel the lags +max_lag (future
+    samples) to -max_lag, samples out of the recording are zeros."""
+    n_cwl, n_times = cwl.shape
+    n_lags = 2 * max_lag + 1
+    design = np.zeros((stop - start, n_cwl, n_lags))
+    for k in range(n_lags):
+        lag = max_lag - k
+        # Column k holds cwl[:, i + lag] for sample i
+        first = max(start, -lag)
+        last = min(stop, n_times - lag)
+        if last > first:
+            design[first - start:last - start, :, k] = cwl[:, first + lag:last + lag].T
+    return design.reshape(stop - start, n_cwl * n_lags)
+
+
+def _segment_r(data, pick_indices, cwl_indices, max_lag, start, stop):
+    # R factor of [1, X, Y] on the segment
+    x = lag_design(data[cwl_indices], start, stop, max_lag)
+    xy = np.hstack((np.ones((stop - start, 1)), x, data[pick_indices, start:stop].T))
+    return np.linalg.qr(xy, mode='r')
+
+
+def _segment_residuals(data, pick_indices, cwl_indices, max_lag, coeffs, start, stop):
+    # Residuals of the picks on the segment, without the constant
+    x = lag_design(data[cwl_indices], start, stop, max_lag)
+    return data[pick_indices, start:stop] - (x @ coeffs).T
+
+
+def _solve(r_factors, n_regressors):
+    # Coefficients from the stacked R factors of [1, X, Y]
+    r = np.linalg.qr(np.vstack(r_factors), mode='r')
+    r_x = r[:n_regressors, :n_regressors]
+    qty = r[:n_regressors, n_regressors:]
+    diag = np.abs(np.diag(r_x))
+    if diag.min() > diag.max() * len(diag) * np.finfo(r.dtype).eps:
+        coeffs = np.linalg.solve(np.triu(r_x), qty)
+    else:
+        # Rank deficient design: minimum norm solution as with sm.OLS (pinv)
+        coeffs = np.linalg.lstsq(np.triu(r_x), qty, rcond=None)[0]
+    # Without the constant
+    return coeffs[1:]
+
+
+# Shared memory of the pool workers, set by _init_worker
+_shared = {}
+
+
+def _init_worker(data_name, out_name, shape, out_shape, pick_indices, cwl_indices, max_lag):
+    from multiprocessing import shared_memory
+    data_memory = shared_memory.SharedMemory(name=data_name)
+    out_memory = shared_memory.SharedMemory(name=out_name)
+    _shared['memory'] = (data_memory, out_memory)
+    _shared['data'] = np.ndarray(shape, dtype=np.float64, buffer=data_memory.buf)
+    _shared['out'] = np.ndarray(out_shape, dtype=np.float64, buffer=out_memory.buf)
+    _shared['args'] = (pick_indices, cwl_indices, max_lag)
+
+
+def _worker_r(bounds):
+    return _segment_r(_shared['data'], *_shared['args'], *bounds)
+
+
+def _worker_residuals(task):
+    coeffs, start, stop = task
+    _shared['out'][:, start:stop] = _segment_residuals(_shared['data'], *_shared['args'], coeffs, start, stop)
+
+
+def cba_data(data, pick_indices, cwl_indices, max_lag=10, n_jobs=1, segment_size=None):
+    """Corrected copy of data (channels x samples), the channels of
+    pick_indices are regressed on the lags of the channels of cwl_indices.
+    segment_size (samples) is the length of the time segments, by default
+    the recording is split in one segment per job, with segments of at most
+    60000 samples."""
+    pick_indices = np.asarray(pick_indices)
+    cwl_indices = np.asarray(cwl_indices)
+    n_times = data.shape[1]
+    n_regressors = 1 + len(cwl_indices) * (2 * max_lag + 1)
+    if segment_size is None:
+        segment_size = min(int(np.ceil(n_times / n_jobs)), 60000)
+    # Segments shorter than the number of regressors give no full R factor
+    segment_size = max(segment_size, n_regressors + len(pick_indices))
+    bounds = [(start, min(start + segment_size, n_times)) for start in range(0, n_times, segment_size)]
+
+    corrected_data = data.copy()
+    if n_jobs == 1 or len(bounds) == 1:
+        r_factors = [_segment_r(data, pick_indices, cwl_indices, max_lag, start, stop) for start, stop in bounds]
+        coeffs = _solve(r_factors, n_regressors)
+        for start, stop in bounds:
+            corrected_data[pick_indices, start:stop] = _segment_residuals(data, pick_indices, cwl_indices, max_lag, coeffs, start, stop)
+        return corrected_data
+
+    import multiprocessing
+    from multiprocessing import shared_memory
+    data_memory = shared_memory.SharedMemory(create=True, size=data.size * 8)
+    out_memory = shared_memory.SharedMemory(create=True, size=len(pick_indices) * n_times * 8)
+    try:
+        shared_data = np.ndarray(data.shape, dtype=np.float64, buffer=data_memory.buf)
+        shared_data[:] = data
+        out_shape = (len(pick_indices), n_times)
+        initargs = (data_memory.name, out_memory.name, data.shape, out_shape, pick_indices, cwl_indices, max_lag)
+        with multiprocessing.Pool(n_jobs, initializer=_init_worker, initargs=initargs) as pool:
+            coeffs = _solve(pool.map(_worker_r, bounds), n_regressors)
+            pool.map(_worker_residuals, [(coeffs, start, stop) for start, stop in bounds])
+        corrected_data[pick_indices] = np.ndarray(out_shape, dtype=np.float64, buffer=out_memory.buf)
+        del shared_data
+    finally:
+        data_memory.close()
+        data_memory.unlink()
+        out_memory.close()
+        out_memory.unlink()
+    return corrected_data
+
+
+def cba(raw, picks=['eeg', 'ecg'], cwl_ch_names=['CWL1', 'CWL2', 'CWL3', 'CWL4'], max_lag=10, n_jobs=1, segment_size=None, verbose=None):
+    pick_indices = mne._fiff.pick._picks_to_idx(raw.info, picks=picks)
+    cwl_indices = mne._fiff.pick._picks_to_idx(raw.info, picks=cwl_ch_names)
+
+    corrected_data = cba_data(raw.get_data(), pick_indices, cwl_indices, max_lag=max_lag, n_jobs=n_jobs, segment_size=segment_size)
+
+    raw_corrected = mne.io.RawArray(data=corrected_data, info=raw.info, verbose=verbose)
+    raw_corrected.set_annotations(raw.annotations)
+    return(raw_corrected)
@@ -0,0 +1,141 @@
+import numpy as np
+
+from lag_embedding import lag_rows
+
+
+def _products(x, y, block_size=4096):
+    # x.T @ x and x.T @ y accumulated in float64, block by block when the
+    # rows are float32
+    if x.dtype == np.float64 and y.dtype == np.float64:
+        return x.T @ x, x.T @ y
+    xtx = np.zeros((x.shape[1], x.shape[1]))
+    xty = np.zeros((x.shape[1], y.shape[1]))
+    for start in range(0, len(x), block_size):
+        x_block = x[start:start + block_size].astype(np.float64)
+        xtx += x_block.T @ x_block
+        xty += x_block.T @ y[start:start + block_size].astype(np.float64)
+    return xtx, xty
+
+
+class SlidingCWL():
+    """Incremental CWL regression on a sliding window.
+
+    Keeps the sufficient statistics XtX and XtY of the regression of the EEG
+    on the lagged CWL signals, updated as samples enter and leave the window
+    (or with an exponential forgetting factor), and solves one small
+    normal-equation system shared by all EEG channels per chunk, so that the
+    cost of a chunk is proportional to its size and not to the window size.
+
+    A row of the regression is added to the statistics once the samples of
+    all its lags are known, i.e. sample_shift samples after it was received.
+    The last samples of a chunk are corrected with the undelayed CWL sample
+    in place of the missing future lags, as delay_data does at the end of the
+    window.
+
+    The chunks are returned uncorrected until the statistics hold a full
+    window, or corrected with coeffs (e.g. the coefficients of a previous
+    run) if they are given. With regressors (columns of lag_rows, see
+    cwl_lags.LagSelection) only these lags are regressors.
+
+    dtype is the dtype of the samples and regressor rows held (np.float32
+    halves the memory of the window); the statistics and the coefficients
+    are float64.
+    """
+
+    def __init__(self, n_eeg, n_cwl, sample_shift, window_size, forgetting=None, coeffs=None,
+                 regressors=None, dtype=np.float64):
+        self.n_eeg = n_eeg
+        self.n_cwl = n_cwl
+        self.sample_shift = sample_shift
+        self.window_size = window_size
+        self.forgetting = forgetting
+        self.regressors = regressors
+        self.dtype = dtype
+        n_regressors = (2 * sample_shift + 1) * n_cwl if regressors is None else len(regressors)
+
+        self.xtx = np.zeros((n_regressors, n_regressors))
+        self.xty = np.zeros((n_regressors, n_eeg))
+        self.coeffs = coeffs
+        # Number of rows in the statistics
+        self.n_rows = 0
+        # Number of samples received
+        self.n_times = 0
+
+        # Last 2 * sample_shift CWL samples and EEG samples of the rows
+        # that are not complete yet
+        self._cwl = np.empty((0, n_cwl), dtype=dtype)
+        self._eeg = np.empty((0, n_eeg), dtype=dtype)
+
+        # Rows of the window, to remove them from the statistics
+        if forgetting is None:
+            self._window_x = np.zeros((window_size, n_regressors), dtype=dtype)
+            self._window_y = np.zeros((window_size, n_eeg), dtype=dtype)
+            self._window_pos = 0
+
+    @property
+    def ready(self):
+        return self.n_rows >= self.window_size
+
+    def _add_rows(self, x, y):
+        if self.forgetting is not None:
+            weights = self.forgetting ** np.arange(len(x) - 1, -1, -1)
+            decay = self.forgetting ** len(x)
+            self.xtx = decay * self.xtx + (x * weights[:, None]).T @ x
+            self.xty = decay * self.xty + (x * weights[:, None]).T @ y
+            self.n_rows += len(x)
+            return
+
+        for start in range(0, len(x), self.window_size):
+            self._add_window_rows(x[start:start + self.window_size], y[start:start + self.window_size])
+
+    def _add_window_rows(self, x, y):
+        # Positions of the rows in the circular window
+        positions = (self._window_pos + np.arange(len(x))) % self.window_size
+        if self.n_rows >= self.window_size:
+            old_x = self._window_x[positions]
+            old_y = self._window_y[positions]
+            old_xtx, old_xty = _products(old_x, old_y)
+            self.xtx -= old_xtx
+            self.xty -= old_xty
+        xtx, xty = _products(x, y)
+        self.xtx += xtx
+        self.xty += xty
+        self._window_x[positions] = x
+        self._window_y[positions] = y
+        self.n_rows = min(self.n_rows + len(x), self.window_size)
+
+        self._window_pos += len(x)
+        if self._window_pos >= self.window_size:
+            # Recompute the statistics once per window to avoid the drift of
+            # the successive additions and subtractions
+            self._window_pos %= self.window_size
+            if self.n_rows == self.window_size:
+                self.xtx, self.xty = _products(self._window_x, self._window_y)
+
+    def update(self, eeg, cwl):
+        """Add a chunk (samples x channels) and return its corrected EEG."""
+        n = len(eeg)
+        first = self.n_times
+        self.n_times += n
+        s = self.sample_shift
+
+        cwl_offset = first - len(self._cwl)
+        cwl = np.concatenate((self._cwl, cwl.astype(self.dtype, copy=False)))
+        eeg_pending = np.concatenate((self._eeg, eeg.astype(self.dtype, copy=False)))
+        pending_first = first - len(self._eeg)
+
+        # Rows whose lags are all known
+        complete = max(self.n_times - s, pending_first)
+        if complete > pending_first:
+            x = lag_rows(cwl, pending_first, complete, cwl_offset, s, self.regressors)
+            self._add_rows(x, eeg_pending[:complete - pending_first])
+
+        self._cwl = cwl[max(len(cwl) - 2 * s, 0):]
+        self._eeg = eeg_pending[complete - pending_first:]
+
+        if self.ready:
+            self.coeffs = np.linalg.lstsq(self.xtx, self.xty, rcond=None)[0]
+        elif self.coeffs is None:
+            return eeg
+        x = lag_rows(cwl, first, self.n_times, cwl_offset, s, self.regressors)
+        return eeg - x @ self.coeffs
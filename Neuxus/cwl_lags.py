@@ -0,0 +1,102 @@
+import numpy as np
+
+from lag_embedding import LagEmbedding
+
+
+class LagSelection():
+    """Minimal set of CWL lags for the regression of the EEG, selected on a
+    calibration segment (eeg and cwl are samples x channels).
+
+    Forward selection on the normal equations of all the lags within
+    +/- sample_shift: the lag of a CWL channel whose cross-correlation with
+    the EEG residuals, after the projection on the lags already selected,
+    removes the most residual variance (summed over the EEG channels) is
+    added, until all the lags are in or the remaining ones are collinear with
+    the selected ones (the part of their norm left after the projection is
+    below collinearity, which bounds the condition number of the selected
+    lags). The selection is the shortest prefix of this order whose residual
+    variance exceeds the residual variance of all the lags by at most
+    tolerance of the variance removed by all the lags. If the lags remove no
+    variance (e.g. flat EEG at the start of the stream), all the lags are
+    kept, as without selection.
+
+    regressors are the selected columns of lag_rows (k * n_cwl + c for the
+    sample t + sample_shift - k of the CWL channel c), sorted, and coeffs
+    their coefficients on the calibration segment. residual_variance[n] is
+    the residual variance (per sample and EEG channel) of the first n lags
+    of the order.
+    """
+
+    def __init__(self, eeg, cwl, sample_shift, tolerance=1e-3, collinearity=1e-8):
+        self.sample_shift = sample_shift
+        self.n_cwl = cwl.shape[1]
+        self.tolerance = tolerance
+        # Normal equations of all the lags, without the lag matrix
+        lags = LagEmbedding(cwl.T, sample_shift)
+        gram = lags.gram(0, len(cwl))
+        cross = lags.cross(eeg.T, 0, len(cwl))
+        self.n_lags = len(gram)
+
+        # gram and cross of the lags projected out of the selected ones
+        residual_gram = gram.copy()
+        residual_cross = cross.copy()
+        norms = np.diag(gram).copy()
+        residual_sum = [float((eeg ** 2).sum())]
+        self.order = []
+        candidates = np.ones(self.n_lags, dtype=bool)
+        for _ in range(self.n_lags):
+            diag = np.diag(residual_gram)
+            valid = candidates & (diag > collinearity * norms)
+            if not valid.any():
+                break
+            gains = np.where(valid, (residual_cross ** 2).sum(axis=1) / np.where(valid, diag, 1), -1)
+            best = int(np.argmax(gains))
+            self.order.append(best)
+            residual_sum.append(residual_sum[-1] - gains[best])
+            # Project the lags out of the selected one
+            column = residual_gram[:, best].copy()
+            residual_gram -= np.outer(column, column) / column[best]
+            residual_cross -= np.outer(column, residual_cross[best]) / column[best]
+            candidates[best] = False
+        self.residual_variance = np.array(residual_sum) / eeg.size
+
+        removed = self.residual_variance[0] - self.residual_variance[-1]
+        if removed > 0:
+            excess = self.residual_variance - self.residual_variance[-1]
+            n_selected = int(np.argmax(excess <= tolerance * removed))
+            self.regressors = np.sort(np.array(self.order[:n_selected], dtype=int))
+        else:
+            self.regressors = np.arange(self.n_lags)
+        self.coeffs = np.linalg.lstsq(gram[np.ix_(self.regressors, self.regressors)],
+                                      cross[self.regressors], rcond=None)[0]
+
+    def lags(self):
+        """Selected delays (samples, positive when the CWL sample is before
+        the EEG sample) of each CWL channel."""
+        delays = self.regressors // self.n_cwl - self.sample_shift
+        channels = self.regressors % self.n_cwl
+        return [sorted(delays[channels == c].tolist()) for c in range(self.n_cwl)]
+
+    def expand(self, coeffs):
+        """Coefficients of all the lags, zero for the lags not selected."""
+        full = np.zeros((self.n_lags, coeffs.shape[1]))
+        full[self.regressors] = coeffs
+        return full
+
+    def report(self, sfreq=None):
+        """Residual variance against the number of lags, and the selected lags
+        of each channel (in ms with sfreq)."""
+        n_selected = len(self.regressors)
+        removed = self.residual_variance[0] - self.residual_variance[-1]
+        counts = [n for n in 2 ** np.arange(int(np.log2(len(self.order) or 1)) + 1) if n < len(self.order)]
+        counts = sorted(set(counts + [0, min(n_selected, len(self.order)), len(self.order)]))
+        lines = ['%d lags of %d selected (tolerance %g)' % (n_selected, self.n_lags, self.tolerance),
+                 'lags  residual variance  loss (% of the variance removed by all lags)']
+        for n in counts:
+            loss = 100 * (self.residual_variance[n] - self.residual_variance[-1]) / removed if removed > 0 else 0
+            lines.append('%4d  %17.6g  %6.2f%s' % (n, self.residual_variance[n], loss, ' *' if n == n_selected else ''))
+        for c, delays in enumerate(self.lags()):
+            if sfreq is not None:
+                delays = ['%.1f' % (1e3 * d / sfreq) for d in delays]
+            lines.append('CWL %d: %s%s' % (c, ', '.join(str(d) for d in delays), ' ms' if sfreq is not None else ''))
+        return '\n'.join(lines)
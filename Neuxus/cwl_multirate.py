@@ -0,0 +1,155 @@
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+from lag_embedding import lag_rows
+from ring_buffer import RingBuffer
+
+
+def fit_coefficients(eeg, cwl, sample_shift):
+    """Regression coefficients ((2 * sample_shift + 1) * n_cwl, n_eeg) of eeg
+    on the lagged cwl (samples x channels), on the rows whose lags are all
+    in the data."""
+    rows = slice(sample_shift, len(cwl) - sample_shift)
+    x = lag_rows(cwl, rows.start, rows.stop, 0, sample_shift)
+    return np.linalg.lstsq(x, eeg[rows], rcond=None)[0]
+
+
+class MultirateCWL():
+    """CWL regression fitted at a decimated rate and applied at the full rate.
+
+    The EEG and CWL signals are low-passed by a linear-phase FIR filter
+    (cutoff 0.8 of the decimated Nyquist frequency, delay of
+    `5 * decimation` samples) and the coefficients are fitted on the last
+    window_duration of the decimated samples every refit_interval seconds
+    of samples, in a background thread if background is set. The lags are
+    the lags of CWL after DownSample(decimation): every decimation samples
+    up to time_delay.
+
+    The fits are done at fixed samples, and their coefficients correct the
+    samples from the next one (from refit_interval later with background,
+    waiting for the thread if it is not done by then), so the output only
+    depends on the samples, not on the chunk sizes or the fitting time.
+
+    The correction of a full rate sample is the product of the coefficients
+    with the filtered CWL signals at these lags, so the correction is
+    band-limited to the decimated band and the EEG above it is not modified.
+    It needs the future lags and the filter delay: the corrected samples are
+    returned 5 * decimation + sample_shift * decimation samples after they
+    are received. The samples are returned uncorrected until the first fit,
+    or corrected with coeffs (e.g. the coefficients of a previous run) if
+    they are given.
+    """
+
+    def __init__(self, n_eeg, n_cwl, sfreq, decimation, time_delay, window_duration,
+                 refit_interval=1., background=True, coeffs=None):
+        self.n_eeg = n_eeg
+        self.n_cwl = n_cwl
+        self.decimation = decimation
+        # Lags at the decimated rate, as CWL after DownSample
+        self.sample_shift = int(np.ceil(time_delay * sfreq / decimation))
+        self.window_size = int(window_duration * sfreq / decimation)
+        self.refit_size = max(int(refit_interval * sfreq / decimation), 1)
+        self.background = background
+
+        self.filter = signal.firwin(10 * decimation + 1, 0.8 / decimation)
+        self.filter_delay = 5 * decimation
+        # Number of samples received between a sample and its correction
+        self.delay = self.filter_delay + self.sample_shift * decimation
+        self._lags = self.filter_delay + (self.sample_shift - np.arange(2 * self.sample_shift + 1)) * decimation
+
+        self.coeffs = coeffs
+        # Number of samples received and returned
+        self.n_times = 0
+        self.n_out = 0
+        # Last len(filter) - 1 EEG samples, for the filtered EEG at the decimated samples
+        self._eeg_history = None
+        self._cwl_zi = None
+        # EEG samples not returned yet and filtered CWL samples from _cwl_offset
+        self._eeg = np.empty((0, n_eeg))
+        self._cwl_filtered = np.empty((0, n_cwl))
+        self._cwl_offset = 0
+        # Filtered and decimated EEG and CWL
+        self.decimated = RingBuffer(n_eeg + n_cwl, self.window_size)
+        # Number of decimated samples at the next fit
+        self._next_fit = self.window_size
+        # Fits not applied yet: (first sample they correct, coefficients or future)
+        self._fits = deque()
+
+        self._executor = ThreadPoolExecutor(max_workers=1) if background else None
+
+    def _filter(self, eeg, cwl):
+        if self._eeg_history is None:
+            # Start from the steady state of the first sample
+            self._eeg_history = np.repeat(eeg[:1], len(self.filter) - 1, axis=0)
+            self._cwl_zi = signal.lfilter_zi(self.filter, 1)[:, None] * cwl[:1]
+        cwl_filtered, self._cwl_zi = signal.lfilter(self.filter, 1, cwl, axis=0, zi=self._cwl_zi)
+
+        # Filtered EEG at the decimated samples only
+        first = (-self.n_times) % self.decimation
+        history = np.concatenate((self._eeg_history, eeg))
+        windows = sliding_window_view(history, len(self.filter), axis=0)[first::self.decimation]
+        eeg_decimated = windows @ self.filter[::-1]
+        self._eeg_history = history[len(history) - len(self.filter) + 1:]
+        return cwl_filtered, eeg_decimated, cwl_filtered[first::self.decimation]
+
+    def _refit(self):
+        # Fit on the window ending at the last sample received
+        values, _ = self.decimated.last()
+        eeg, cwl = values[:, :self.n_eeg].copy(), values[:, self.n_eeg:].copy()
+        if self._executor is None:
+            self._fits.append((self.n_times, fit_coefficients(eeg, cwl, self.sample_shift)))
+        else:
+            self._fits.append((self.n_times + self.refit_size * self.decimation,
+                               self._executor.submit(fit_coefficients, eeg, cwl, self.sample_shift)))
+        self._next_fit += self.refit_size
+
+    def _receive(self, eeg, cwl):
+        cwl_filtered, eeg_decimated, cwl_decimated = self._filter(eeg, cwl)
+        # Sample numbers of the decimated samples as their timestamps
+        first = self.n_times + (-self.n_times) % self.decimation
+        self.decimated.append(np.hstack((eeg_decimated, cwl_decimated)),
+                              first + self.decimation * np.arange(len(eeg_decimated)))
+        self.n_times += len(eeg)
+        self._eeg = np.concatenate((self._eeg, eeg))
+        self._cwl_filtered = np.concatenate((self._cwl_filtered, cwl_filtered))
+
+    def update(self, eeg, cwl):
+        """Corrected EEG of the samples that have their lags, in order."""
+        start = 0
+        while start < len(eeg):
+            # Samples up to the decimated sample of the next fit
+            stop = min(len(eeg), start + (self._next_fit - 1) * self.decimation + 1 - self.n_times)
+            self._receive(eeg[start:stop], cwl[start:stop])
+            if self.decimated.n_total == self._next_fit:
+                self._refit()
+            start = stop
+
+        stop = self.n_times - self.delay
+        if stop <= self.n_out:
+            return np.empty((0, self.n_eeg))
+        n = stop - self.n_out
+        corrected = self._eeg[:n].copy()
+        position = self.n_out
+        while position < stop:
+            # Coefficients of the fits that correct the samples from position
+            while self._fits and self._fits[0][0] <= position:
+                fit = self._fits.popleft()[1]
+                self.coeffs = fit if self._executor is None else fit.result()
+            end = min(stop, self._fits[0][0]) if self._fits else stop
+            if self.coeffs is not None:
+                # Filtered CWL at the lags of the samples, one product per coefficients
+                times = np.arange(position, end)
+                indices = np.maximum(times[:, None] + self._lags[None, :] - self._cwl_offset, 0)
+                corrected[position - self.n_out:end - self.n_out] -= self._cwl_filtered[indices].reshape(end - position, -1) @ self.coeffs
+            position = end
+
+        self.n_out = stop
+        self._eeg = self._eeg[n:]
+        # Keep the filtered CWL of the first lag of the next sample
+        offset = max(stop + self._lags[-1], 0)
+        self._cwl_filtered = self._cwl_filtered[offset - self._cwl_offset:]
+        self._cwl_offset = offset
+        return corrected
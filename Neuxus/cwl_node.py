@@ -5,83 +5,262 @@ import pandas as pd
 
 from neuxus.chunks import Port
 
+import logging
+import os
 import numpy as np
 import mne
-from scipy import signal
+from scipy import signal, linalg
 
+from cwl_incremental import SlidingCWL
+from cwl_lags import LagSelection
+from cwl_multirate import MultirateCWL
+from lag_embedding import LagEmbedding, lag_rows
+from ring_buffer import RingBuffer
 
 
 def delay_data(data, time_delay, sfreq):
+    # Lagged copies of data for every integer shift within +/- time_delay,
+    # out of range samples are the undelayed samples
     sample_shift = int(np.ceil(time_delay * sfreq))
-    sample_shifts = np.arange(-sample_shift, sample_shift+1, 1)
+    return LagEmbedding(data, sample_shift).segment(0, data.shape[1])
 
-    delayed_signals = []
-    for shift in sample_shifts:
-        delayed_signal = np.roll(data, shift, axis=1)
-        if shift > 0:
-            delayed_signal[:, :shift] = data[:, :shift]  # Zero out the initial part to avoid wrap-around
-        elif shift < 0:
-            delayed_signal[:, shift:] = data[:, shift:]  # Zero out the end part to avoid wrap-around
-        delayed_signals.append(delayed_signal)
 
-    delay_signals = np.concatenate(delayed_signals, axis=0)
-    return delay_signals
+def _solve_window(cwl_segment, eeg_segment):
+    # Regression coefficients of all the EEG channels (columns of eeg_segment)
+    # on the regressors (columns of cwl_segment), with one factorization of
+    # the regressor matrix shared by all the channels
+    n_times, n_regressors = cwl_segment.shape
+    if n_times >= n_regressors:
+        q, r = np.linalg.qr(cwl_segment)
+        diag = np.abs(np.diag(r))
+        if diag.min() > diag.max() * n_times * np.finfo(r.dtype).eps:
+            return linalg.solve_triangular(r, q.T @ eeg_segment)
+    # Rank deficient or short window: minimum norm solution
+    return np.linalg.lstsq(cwl_segment, eeg_segment, rcond=None)[0]
 
 
-def _correct_data(eeg_data, cwl_data, window_size, overlap):
-    hanning_window = np.hanning(window_size)
+# cwl_data is either the lag matrix of the CWL signals or their LagEmbedding.
+# method 'qr' factorizes the lag matrix of each window, method 'gram' solves
+# the normal equations computed from the LagEmbedding without materializing
+# the lag matrix
+def _correct_data(eeg_data, cwl_data, window_size, overlap, method='qr'):
+    # In the dtype of eeg_data
+    hanning_window = np.hanning(window_size).astype(eeg_data.dtype, copy=False)
     
     n_channels, n_times = eeg_data.shape
     eeg_corrected = np.zeros_like(eeg_data)
-    weight_sum = np.zeros_like(eeg_data)
+    # The weights are the same for all the channels
+    weight_sum = np.zeros(n_times)
     step = int(window_size * (1 - overlap))
     starts = np.arange(0, n_times, step)
 
-    for ch in range(n_channels):
-        for start in starts:
-            end = min(start + window_size, n_times)
-            actual_window_size = end - start
-            
-            eeg_segment = eeg_data[ch, start:end] #* hanning_window[:actual_window_size]
-            cwl_segment = cwl_data[:, start:end] #* hanning_window[:actual_window_size]
+    for start in starts:
+        end = min(start + window_size, n_times)
+        actual_window_size = end - start
+
+        eeg_segment = eeg_data[:, start:end]
 
-            # Regression
-            coeffs = np.linalg.lstsq(cwl_segment.T, eeg_segment.T, )[0]
+        # Regression of all the channels at once
+        if method == 'gram':
+            gram = cwl_data.gram(start, end)
+            coeffs = np.linalg.lstsq(gram, cwl_data.cross(eeg_segment, start, end), rcond=None)[0]
+            correction = cwl_data.apply(coeffs, start, end)
+        else:
+            if isinstance(cwl_data, LagEmbedding):
+                cwl_segment = cwl_data.segment(start, end)
+            else:
+                cwl_segment = cwl_data[:, start:end]
+            coeffs = _solve_window(cwl_segment.T, eeg_segment.T)
             correction = np.dot(coeffs.T, cwl_segment)
-            corrected_segment = eeg_segment - correction
+        corrected_segment = eeg_segment - correction
 
-            # Apply Hanning window to the corrected segment
-            corrected_segment *= hanning_window[:actual_window_size]
+        # Apply Hanning window to the corrected segment and overlap-add
+        eeg_corrected[:, start:end] += corrected_segment * hanning_window[:actual_window_size]
+        weight_sum[start:end] += hanning_window[:actual_window_size]
 
-            eeg_corrected[ch, start:end] += corrected_segment
-            weight_sum[ch, start:end] += hanning_window[:actual_window_size]
-            
     # Normalize the corrected signal by the weight sum
     weight_sum[weight_sum == 0] = 1 # Avoid division by zero
     eeg_corrected /= weight_sum
     return eeg_corrected
 
 
-def cwl_correction_raw(raw, eeg_picks, cwl_picks, time_delay=21e-3, window_duration=4, overlap=0.5):
-    # Get data
+def cwl_correction_data(data, eeg_picks, cwl_picks, sfreq, time_delay=21e-3, window_duration=4, overlap=0.5, method='qr',
+                        regressors=None):
+    # Corrected EEG channels of data (channels x samples), with the lags
+    # regressors only if given (see cwl_lags.LagSelection)
+    cwl_data = LagEmbedding(data[cwl_picks], int(np.ceil(time_delay * sfreq)), regressors=regressors)
+    window_size = int(np.ceil((window_duration * sfreq)))
+    return _correct_data(data[eeg_picks], cwl_data, window_size, overlap, method=method)
+
+
+def cwl_correction_raw(raw, eeg_picks, cwl_picks, time_delay=21e-3, window_duration=4, overlap=0.5, method='qr',
+                       regressors=None, prune_lags=None):
+    # With regressors, only these lags are used. With prune_lags, the lags
+    # are selected on the first window with this tolerance (cwl_lags.LagSelection)
+    # One copy of the data, corrected in place
     sfreq = raw.info['sfreq']
-    eeg_data = raw.get_data(picks=eeg_picks)
-    cwl_data = raw.get_data(picks=cwl_picks)
-    # Create delayed versions of the CWL data
-    cwl_data = delay_data(cwl_data, time_delay, sfreq)
+    data = raw.get_data()
+    sample_shift = int(np.ceil(time_delay * sfreq))
     # compute Hanning window
     window_size = int(np.ceil((window_duration * sfreq)))
-    eeg_corrected = _correct_data(eeg_data, cwl_data, window_size, overlap)
+    if prune_lags is not None:
+        selection = LagSelection(data[eeg_picks, :window_size].T, data[cwl_picks, :window_size].T,
+                                 sample_shift, tolerance=prune_lags)
+        mne.utils.logger.info(selection.report(sfreq))
+        regressors = selection.regressors
+    # Delayed versions of the CWL data, only materialized window by window
+    cwl_data = LagEmbedding(data[cwl_picks], sample_shift, regressors=regressors)
+    data[eeg_picks] = _correct_data(data[eeg_picks], cwl_data, window_size, overlap, method=method)
     # Create new MNE Raw object
-    data = raw.get_data()
-    data[eeg_picks] = eeg_corrected
     raw_corrected = mne.io.RawArray(data, raw.info)
     return raw_corrected
 
 
+def cwl_correction_memmap(data, eeg_picks, cwl_picks, sfreq, out, time_delay=21e-3, window_duration=4, overlap=0.5,
+                          regressors=None):
+    """CWL correction of data (channels x samples) written into out, window by window.
+
+    data and out are typically float32 memory maps (out may be data itself,
+    e.g. the _data of a Raw preloaded to a file, or read_brainvision_memmap).
+    Only the samples of one window are read at a time, the regression is
+    done in float64 and the overlap-add is kept over one window only, so the
+    memory use depends on the window size and not on the recording length.
+    Same result as cwl_correction_data (method 'qr'), with the lags
+    regressors only if given, also when out is data and CWL channels are
+    corrected as EEG channels.
+    """
+    n_channels, n_times = data.shape
+    eeg_picks = np.asarray(eeg_picks)
+    cwl_picks = np.asarray(cwl_picks)
+    sample_shift = int(np.ceil(time_delay * sfreq))
+    window_size = int(np.ceil((window_duration * sfreq)))
+    step = int(window_size * (1 - overlap))
+    hanning_window = np.hanning(window_size)
+    # Channels copied as they are when out is not data
+    others = np.setdiff1d(np.arange(n_channels), eeg_picks) if out is not data else []
+    # When out is data, the CWL channels also in eeg_picks are corrected
+    # before the next windows read their lags: their original samples before
+    # the next window are kept
+    shared = np.isin(cwl_picks, eeg_picks) if out is data else np.zeros(len(cwl_picks), dtype=bool)
+    kept = np.zeros((int(shared.sum()), 0))
+
+    # Overlap-add of the samples start to start + window_size
+    eeg_corrected = np.zeros((len(eeg_picks), window_size))
+    weight_sum = np.zeros(window_size)
+    for start in range(0, n_times, step):
+        end = min(start + window_size, n_times)
+        # CWL samples of the window and its lags
+        low, high = max(start - sample_shift, 0), min(end + sample_shift, n_times)
+        cwl_data = np.asarray(data[cwl_picks, low:high], dtype=np.float64)
+        if kept.shape[1]:
+            cwl_data[shared, :start - low] = kept[:, kept.shape[1] - (start - low):]
+        cwl_segment = lag_rows(cwl_data.T, start, end, low, sample_shift, regressors)
+        eeg_segment = np.asarray(data[eeg_picks, start:end], dtype=np.float64)
+        coeffs = _solve_window(cwl_segment, eeg_segment.T)
+        corrected_segment = eeg_segment - np.dot(cwl_segment, coeffs).T
+        eeg_corrected[:, :end - start] += corrected_segment * hanning_window[:end - start]
+        weight_sum[:end - start] += hanning_window[:end - start]
+
+        # The samples before the next window are complete
+        done = min(step, end - start)
+        weights = np.where(weight_sum[:done] == 0, 1, weight_sum[:done])
+        if shared.any():
+            kept = np.hstack((kept, np.asarray(data[cwl_picks[shared], start:start + done], dtype=np.float64)))
+            kept = kept[:, max(kept.shape[1] - sample_shift, 0):]
+        out[eeg_picks, start:start + done] = eeg_corrected[:, :done] / weights
+        if len(others):
+            out[others, start:start + done] = data[others, start:start + done]
+        eeg_corrected[:, :-done] = eeg_corrected[:, done:]
+        eeg_corrected[:, -done:] = 0
+        weight_sum[:-done] = weight_sum[done:]
+        weight_sum[-done:] = 0
+    return out
+
+
+def _read_vhdr(vhdr):
+    # Lines of a BrainVision header (or marker file) and its keys
+    with open(vhdr, encoding='utf-8', errors='replace') as f:
+        lines = f.read().splitlines()
+    keys = {}
+    for line in lines:
+        if '=' in line and not line.startswith(';'):
+            # The channel names come before the [Coordinates] with the same keys
+            keys.setdefault(*line.split('=', 1))
+    return lines, keys
+
+
+def read_brainvision_memmap(vhdr, mode='r'):
+    """Data (channels x samples memory map), sampling frequency and channel
+    names of a BrainVision set with IEEE_FLOAT_32 multiplexed data, in the
+    units of the file (multiply by the channel resolutions for microvolts)."""
+    _, keys = _read_vhdr(vhdr)
+    if keys.get('BinaryFormat') != 'IEEE_FLOAT_32' or keys.get('DataOrientation') != 'MULTIPLEXED':
+        raise ValueError('Only IEEE_FLOAT_32 MULTIPLEXED BrainVision data can be memory mapped')
+    n_channels = int(keys['NumberOfChannels'])
+    ch_names = [keys['Ch%d' % (c + 1)].split(',')[0].replace('\\1', ',') for c in range(n_channels)]
+    data = np.memmap(os.path.join(os.path.dirname(vhdr), keys['DataFile']), dtype='<f4', mode=mode)
+    return data.reshape(-1, n_channels).T, 1e6 / float(keys['SamplingInterval']), ch_names
+
+
+def cwl_correction_brainvision(vhdr, out_vhdr, cwl_ch_names=['CWL1', 'CWL2', 'CWL3', 'CWL4'], eeg_ch_names=None,
+                               time_delay=21e-3, window_duration=4, overlap=0.5, regressors=None):
+    """CWL correction of a BrainVision set into a new set (out_vhdr, its .eeg
+    and .vmrk), with memory maps of the input and output data. eeg_ch_names
+    are the corrected channels, all the channels but the CWL by default."""
+    data, sfreq, ch_names = read_brainvision_memmap(vhdr)
+    cwl_picks = [ch_names.index(name) for name in cwl_ch_names]
+    if eeg_ch_names is None:
+        eeg_ch_names = [name for name in ch_names if name not in cwl_ch_names]
+    eeg_picks = [ch_names.index(name) for name in eeg_ch_names]
+
+    # Header and markers of the input, renamed
+    base = os.path.splitext(os.path.basename(out_vhdr))[0]
+    lines, keys = _read_vhdr(vhdr)
+    renamed = {'DataFile': base + '.eeg', 'MarkerFile': base + '.vmrk'}
+    with open(out_vhdr, 'w', encoding='utf-8') as f:
+        for line in lines:
+            key = line.split('=', 1)[0]
+            f.write(('%s=%s' % (key, renamed[key]) if key in renamed else line) + '\n')
+    marker_lines, _ = _read_vhdr(os.path.join(os.path.dirname(vhdr), keys['MarkerFile']))
+    with open(os.path.join(os.path.dirname(out_vhdr), renamed['MarkerFile']), 'w', encoding='utf-8') as f:
+        for line in marker_lines:
+            f.write(('DataFile=' + renamed['DataFile'] if line.startswith('DataFile=') else line) + '\n')
+
+    out = np.memmap(os.path.join(os.path.dirname(out_vhdr), renamed['DataFile']), dtype='<f4', mode='w+',
+                    shape=data.shape[::-1]).T
+    cwl_correction_memmap(data, eeg_picks, cwl_picks, sfreq, out, time_delay=time_delay,
+                          window_duration=window_duration, overlap=overlap, regressors=regressors)
+    out.base.flush()
+
+
 class CWL(Node):
-    def __init__(self, input_port, time_delay, window_duration, overlap=0.5):
+    # mode 'window' re-solves the regression on the whole window for every chunk,
+    # mode 'incremental' updates the regression statistics with the chunk samples
+    # only (sliding window, or exponential forgetting if forgetting is set),
+    # mode 'multirate' fits the regression on the signals decimated by
+    # `decimation` every refit_interval seconds (in a background thread if
+    # background is set) and corrects the full rate samples, see MultirateCWL.
+    # Chunks longer than max_chunk_size samples (the window in mode 'window')
+    # are corrected as consecutive chunks of max_chunk_size samples, as they
+    # would be online (offline.FastReader sends large chunks).
+    # With coefficients (a cwl_store.CoefficientStore), the chunks received
+    # before the first fit are corrected with the coefficients saved by the
+    # previous run with the same channels, time_delay and mode, and the
+    # coefficients fitted on the last samples are saved on terminate.
+    # With prune_lags (modes 'window' and 'incremental'), the lags are
+    # selected on the first window with this tolerance (cwl_lags.LagSelection,
+    # its report is logged) and only these lags are used afterwards.
+    # dtype is the dtype of the samples (input chunks are converted to it),
+    # buffers and output chunks: with np.float32 the window is regressed in
+    # float32 (mode 'window') and the regression statistics of the mode
+    # 'incremental' are accumulated in float64 (validate_float32.py bounds
+    # the deviation from np.float64)
+    def __init__(self, input_port, time_delay, window_duration, overlap=0.5, mode='window', forgetting=None,
+                 decimation=20, refit_interval=1., background=True, max_chunk_size=None, coefficients=None,
+                 prune_lags=None, dtype=np.float64):
         Node.__init__(self, input_port)
+        assert mode in ['window', 'incremental', 'multirate']
+        assert prune_lags is None or mode != 'multirate'
         self.channels = self.input.channels
         self.sfreq = self.input.sampling_frequency
 
@@ -89,16 +268,47 @@ class CWL(Node):
         self.time_delay = time_delay
         self.window_duration = window_duration
         self.overlap = overlap
+        self.mode = mode
+        if max_chunk_size is None and mode == 'window':
+            max_chunk_size = int(self.sfreq * window_duration)
+        self.max_chunk_size = max_chunk_size
         # Find picks
         self.cwl_picks = [32, 33, 34, 35]
         self.eeg_picks = np.arange(0,33)
+        self.sample_shift = int(np.ceil(time_delay * self.sfreq))
+        self.forgetting = forgetting
+        self.dtype = dtype
+        self.prune_lags = prune_lags
+        self.lag_selection = None
+        self.regressors = None
+
+        # Coefficients of the previous run
+        self.coefficients = coefficients
+        self.warm_coeffs = None
+        if coefficients is not None:
+            lags = 'decimation %d' % decimation if mode == 'multirate' else 'full'
+            self._key = coefficients.key(self.channels, self.eeg_picks, self.cwl_picks, self.sfreq, time_delay, lags)
+            self.warm_coeffs = coefficients.load(self._key)
+
+        if mode == 'incremental' and prune_lags is None:
+            self.engine = SlidingCWL(len(self.eeg_picks), len(self.cwl_picks),
+                                     sample_shift=self.sample_shift,
+                                     window_size=int(self.sfreq * window_duration),
+                                     forgetting=forgetting, coeffs=self.warm_coeffs, dtype=dtype)
+        if mode == 'multirate':
+            self.engine = MultirateCWL(len(self.eeg_picks), len(self.cwl_picks), self.sfreq, decimation,
+                                       time_delay, window_duration, refit_interval, background,
+                                       coeffs=self.warm_coeffs)
+            # Samples waiting for their correction
+            self._values = np.empty((0, len(self.channels)), dtype=dtype)
+            self._timestamps = np.empty(0)
 
         # Create MNE info object
         self.info = mne.create_info(self.channels, self.sfreq, ch_types=['eeg'] * len(self.channels))
 
-        # Create buffer
-        self.buffer = np.empty((len(self.channels), 0))
-        self.timestamps = np.empty(0)
+        # Create buffer of the last window_duration
+        if mode == 'window' or prune_lags is not None:
+            self.buffer = RingBuffer(len(self.channels), int(self.sfreq * window_duration), dtype=dtype)
 
         # Set output parameters
         self.output.set_parameters(
@@ -110,21 +320,117 @@ class CWL(Node):
         )
 
     def update(self):
+        if self.mode == 'incremental':
+            self._update_incremental()
+            return
+        if self.mode == 'multirate':
+            self._update_multirate()
+            return
+        for input_chunk in self._chunks():
+            self.buffer.append(input_chunk.values, input_chunk.index.values)
+            if self.buffer.n_total < self.sfreq * self.window_duration:
+                self._warm_up(input_chunk)
+                continue
+
+            # Correct the window in place of a RawArray round trip, the
+            # regression does not depend on the scaling of the data
+            values, timestamps = self.buffer.last()
+            if self.prune_lags is not None and self.lag_selection is None:
+                self._select_lags(values)
+            data = values.T
+            eeg_corrected = cwl_correction_data(data, self.eeg_picks, self.cwl_picks, self.sfreq, time_delay=self.time_delay, window_duration=self.window_duration, overlap=self.overlap, regressors=self.regressors)
+            n = min(len(input_chunk), len(values))
+            output_chunk = values[-n:].copy()
+            output_chunk[:, self.eeg_picks] = eeg_corrected[:, -n:].T
+            self.output.set(output_chunk, timestamps[-n:].copy())
+
+    def _warm_up(self, input_chunk):
+        # Chunk received before the buffer is full (its samples are the last
+        # of the buffer): no correction, or the correction with the
+        # coefficients of the previous run
+        if self.warm_coeffs is None:
+            self.output.set_from_df(input_chunk)
+            return
+        values, timestamps = self.buffer.last()
+        n = len(input_chunk)
+        output_chunk = values[-n:].copy()
+        output_chunk[:, self.eeg_picks] -= lag_rows(values[:, self.cwl_picks], len(values) - n, len(values), 0, self.sample_shift) @ self.warm_coeffs
+        self.output.set(output_chunk, timestamps[-n:].copy())
+
+    def _select_lags(self, values):
+        self.lag_selection = LagSelection(values[:, self.eeg_picks], values[:, self.cwl_picks],
+                                          self.sample_shift, tolerance=self.prune_lags)
+        self.regressors = self.lag_selection.regressors
+        logging.info('%s lags\n%s' % (self._id, self.lag_selection.report(self.sfreq)))
+
+    def _chunks(self):
+        # Input chunks in dtype, split in chunks of max_chunk_size samples at most
         for input_chunk in self.input:
-            input_chunk_values = input_chunk.values
-            self.buffer = np.hstack((self.buffer, input_chunk_values.T))
-            self.timestamps = np.hstack((self.timestamps, input_chunk.index.values))
-            if self.buffer.shape[1] < self.sfreq * self.window_duration:
-                # If the buffer is not full, no correction
-                self.output.set_from_df(input_chunk)
+            if (input_chunk.dtypes != self.dtype).any():
+                input_chunk = input_chunk.astype(self.dtype)
+            if self.max_chunk_size is None or len(input_chunk) <= self.max_chunk_size:
+                yield input_chunk
                 continue
-            elif self.buffer.shape[1] > self.sfreq * self.window_duration:
-                # If the buffer is too full, keep only the last window_duration
-                self.buffer = self.buffer[:, -int(self.sfreq * self.window_duration):]
-                self.timestamps = self.timestamps[-int(self.sfreq * self.window_duration):]
-
-            raw = mne.io.RawArray(self.buffer * 1e-6, self.info)
-            raw_corrected = cwl_correction_raw(raw, self.eeg_picks, self.cwl_picks, time_delay=self.time_delay, window_duration=self.window_duration, overlap=self.overlap)
-            output_chunk = raw_corrected.to_data_frame()
-            output_chunk = output_chunk.drop('time', axis=1)
-            self.output.set(output_chunk.values[-len(input_chunk):, :], self.timestamps[-len(input_chunk):])
\ No newline at end of file
+            for first in range(0, len(input_chunk), self.max_chunk_size):
+                yield input_chunk.iloc[first:first + self.max_chunk_size]
+
+    def _update_incremental(self):
+        for input_chunk in self._chunks():
+            values = input_chunk.values
+            if self.prune_lags is not None and self.lag_selection is None:
+                # Select the lags on the first window, then start the
+                # regression with the samples of the window before the chunk
+                self.buffer.append(values, input_chunk.index.values)
+                if self.buffer.n_total < self.sfreq * self.window_duration:
+                    self._warm_up(input_chunk)
+                    continue
+                window, _ = self.buffer.last()
+                self._select_lags(window)
+                self.engine = SlidingCWL(len(self.eeg_picks), len(self.cwl_picks),
+                                         sample_shift=self.sample_shift,
+                                         window_size=int(self.sfreq * self.window_duration),
+                                         forgetting=self.forgetting, coeffs=self.lag_selection.coeffs,
+                                         regressors=self.regressors, dtype=self.dtype)
+                history = window[:len(window) - len(values)]
+                self.engine.update(history[:, self.eeg_picks], history[:, self.cwl_picks])
+            corrected = values.copy()
+            corrected[:, self.eeg_picks] = self.engine.update(values[:, self.eeg_picks], values[:, self.cwl_picks])
+            self.output.set(corrected, input_chunk.index.values)
+
+    def _update_multirate(self):
+        for input_chunk in self._chunks():
+            values = input_chunk.values
+            self._values = np.concatenate((self._values, values))
+            self._timestamps = np.concatenate((self._timestamps, input_chunk.index.values))
+            eeg_corrected = self.engine.update(values[:, self.eeg_picks], values[:, self.cwl_picks])
+            n = len(eeg_corrected)
+            if n:
+                corrected = self._values[:n].copy()
+                corrected[:, self.eeg_picks] = eeg_corrected
+                self.output.set(corrected, self._timestamps[:n])
+                self._values = self._values[n:]
+                self._timestamps = self._timestamps[n:]
+
+    def fitted_coefficients(self):
+        # Coefficients fitted on the last samples, None before the first fit
+        if self.mode == 'window':
+            if self.buffer.n_total < self.sfreq * self.window_duration:
+                return None
+            values, _ = self.buffer.last()
+            cwl_rows = lag_rows(values[:, self.cwl_picks], 0, len(values), 0, self.sample_shift, self.regressors)
+            coeffs = _solve_window(cwl_rows, values[:, self.eeg_picks])
+        elif self.prune_lags is not None and self.lag_selection is None or self.engine.coeffs is self.warm_coeffs:
+            return None
+        else:
+            coeffs = self.engine.coeffs
+        # The coefficients of all the lags are saved
+        if self.lag_selection is not None:
+            coeffs = self.lag_selection.expand(coeffs)
+        return coeffs
+
+    def terminate(self):
+        if self.coefficients is not None:
+            coeffs = self.fitted_coefficients()
+            if coeffs is not None:
+                self.coefficients.save(self._key, coeffs)
+        return super().terminate()
@@ -0,0 +1,138 @@
+"""
+Numba backend of the CWL node, from the CWLCorrection of CWL/cwl.ipynb.
+
+The kernels compute the same correction as cwl_correction_data of
+cwl_node.py (lags -time_delay to +time_delay holding the undelayed sample
+out of the window, Hanning overlap-add of the window regressions, no
+intercept) on the samples x channels buffer of the node, without copying it.
+
+The kernels are compiled for float32 and float64 buffers when the module is
+imported and cached on disk (cache=True), so that only the first import on
+a machine pays the compilation; warmup() runs them once to start the
+thread pool before the first chunk of a scan.
+"""
+import numpy as np
+from numba import njit, prange
+from neuxus.node import Node
+
+from ring_buffer import RingBuffer
+
+
+_SIGNATURES = [
+    'void(%s[:, ::1], int64[::1], int64[::1], int64, int64, int64, float64[::1], %s[:, ::1])' % (dtype, dtype)
+    for dtype in ['float32', 'float64']
+]
+
+
+@njit(_SIGNATURES, cache=True, parallel=True)
+def correct_window(values, eeg_picks, cwl_picks, sample_shift, window_size, step, hanning, out):
+    """Corrected EEG channels of values (samples x channels) written in out
+    (samples x EEG channels), the regressions are accumulated in float64."""
+    n_times = values.shape[0]
+    n_eeg = len(eeg_picks)
+    n_cwl = len(cwl_picks)
+    n_regressors = (2 * sample_shift + 1) * n_cwl
+
+    # Lag matrix, column k * n_cwl + c is the CWL channel c shifted by k - sample_shift
+    x = np.empty((n_times, n_regressors))
+    for t in prange(n_times):
+        for k in range(2 * sample_shift + 1):
+            # int64 index (the prange index is unsigned)
+            source = np.int64(t) + sample_shift - k
+            if source < 0 or source >= n_times:
+                source = np.int64(t)
+            for c in range(n_cwl):
+                x[t, k * n_cwl + c] = values[source, cwl_picks[c]]
+    y = np.empty((n_times, n_eeg))
+    for t in prange(n_times):
+        for ch in range(n_eeg):
+            y[t, ch] = values[t, eeg_picks[ch]]
+
+    corrected = np.zeros((n_times, n_eeg))
+    weight_sum = np.zeros(n_times)
+    for start in range(0, n_times, step):
+        end = min(start + window_size, n_times)
+        x_segment = np.ascontiguousarray(x[start:end])
+        y_segment = np.ascontiguousarray(y[start:end])
+        # One system for all the channels
+        coeffs = np.linalg.lstsq(x_segment.T @ x_segment, x_segment.T @ y_segment)[0]
+        correction = x_segment @ coeffs
+        for ch in prange(n_eeg):
+            for t in range(end - start):
+                corrected[start + t, ch] += (y_segment[t, ch] - correction[t, ch]) * hanning[t]
+        for t in range(end - start):
+            weight_sum[start + t] += hanning[t]
+
+    for t in prange(n_times):
+        weight = weight_sum[t] if weight_sum[t] != 0 else 1.
+        for ch in range(n_eeg):
+            out[t, ch] = corrected[t, ch] / weight
+
+
+def cwl_correction_values(values, eeg_picks, cwl_picks, sfreq, time_delay=21e-3, window_duration=4, overlap=0.5, out=None):
+    # Corrected EEG channels of values (samples x channels), written in out if given
+    window_size = int(np.ceil((window_duration * sfreq)))
+    if out is None:
+        out = np.empty((len(values), len(eeg_picks)), dtype=values.dtype)
+    correct_window(np.ascontiguousarray(values), np.asarray(eeg_picks, dtype=np.int64),
+                   np.asarray(cwl_picks, dtype=np.int64), int(np.ceil(time_delay * sfreq)),
+                   window_size, int(window_size * (1 - overlap)), np.hanning(window_size), out)
+    return out
+
+
+def warmup(n_channels=36, n_times=100):
+    # Run the kernels once for both dtypes (loads them from the cache and starts the threads)
+    for dtype in [np.float32, np.float64]:
+        values = np.random.default_rng(0).standard_normal((n_times, n_channels)).astype(dtype)
+        cwl_correction_values(values, np.arange(n_channels - 4), np.arange(n_channels - 4, n_channels), 100.,
+                              time_delay=0.02, window_duration=n_times / 200.)
+
+
+class NumbaCWL(Node):
+    # Same node as cwl_node.CWL in mode 'window', with the numba kernels.
+    # dtype np.float32 keeps the buffer and the correction in float32
+    def __init__(self, input_port, time_delay, window_duration, overlap=0.5, dtype=np.float64):
+        Node.__init__(self, input_port)
+        self.channels = self.input.channels
+        self.sfreq = self.input.sampling_frequency
+
+        # CWL parameters
+        self.time_delay = time_delay
+        self.window_duration = window_duration
+        self.overlap = overlap
+        # Find picks
+        self.cwl_picks = np.array([32, 33, 34, 35], dtype=np.int64)
+        self.eeg_picks = np.arange(0, 33, dtype=np.int64)
+
+        # Create buffer of the last window_duration and of its correction
+        self.buffer = RingBuffer(len(self.channels), int(self.sfreq * window_duration), dtype=dtype)
+        self._corrected = np.empty((self.buffer.capacity, len(self.eeg_picks)), dtype=dtype)
+
+        # Compile or load the kernels now rather than on the first chunk
+        warmup(len(self.channels))
+
+        # Set output parameters
+        self.output.set_parameters(
+            data_type=self.input.data_type,
+            channels=self.input.channels,
+            sampling_frequency=self.sfreq,
+            meta=self.input.meta,
+            epoching_frequency=self.input.epoching_frequency
+        )
+
+    def update(self):
+        for input_chunk in self.input:
+            self.buffer.append(input_chunk.values, input_chunk.index.values)
+            if self.buffer.n_total < self.sfreq * self.window_duration:
+                # If the buffer is not full, no correction
+                self.output.set_from_df(input_chunk)
+                continue
+
+            values, timestamps = self.buffer.last()
+            eeg_corrected = cwl_correction_values(values, self.eeg_picks, self.cwl_picks, self.sfreq,
+                                                  time_delay=self.time_delay, window_duration=self.window_duration,
+                                                  overlap=self.overlap, out=self._corrected[:len(values)])
+            n = min(len(input_chunk), len(values))
+            output_chunk = values[-n:].copy()
+            output_chunk[:, self.eeg_picks] = eeg_corrected[-n:]
+            self.output.set(output_chunk, timestamps[-n:].copy())
@@ -0,0 +1,69 @@
+"""
+On-disk store of the CWL regression coefficients, to warm-start the CWL node.
+
+The coefficients fitted at the end of a run are saved in the directory of
+the subject and session, keyed by what they depend on: the channel layout
+(channels, EEG and CWL picks), the sampling frequency, time_delay and the
+lags of the mode (the full rate lags of the modes 'window' and
+'incremental', the decimated lags of the mode 'multirate'). The next run
+with the same key corrects its first chunks with them instead of waiting
+for a full window of samples. A run of a new session starts from the last
+coefficients saved for the subject.
+
+    store = CoefficientStore('C:/Vision/eeg/cwl', subject='P02', session='1')
+    signal_cwl = CWL(signal_ds.output, time_delay=21e-3, window_duration=4, coefficients=store)
+"""
+import hashlib
+import json
+import os
+import uuid
+import numpy as np
+
+
+class CoefficientStore():
+
+    def __init__(self, directory, subject='default', session='default'):
+        self.subject_directory = os.path.join(directory, str(subject))
+        self.directory = os.path.join(self.subject_directory, str(session))
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(channels, eeg_picks, cwl_picks, sfreq, time_delay, lags='full'):
+        """Key of the coefficients of a channel layout, time_delay and lags."""
+        description = json.dumps({'channels': list(channels),
+                                  'eeg_picks': [int(p) for p in eeg_picks],
+                                  'cwl_picks': [int(p) for p in cwl_picks],
+                                  'sfreq': float(sfreq),
+                                  'time_delay': float(time_delay),
+                                  'lags': lags}, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _candidates(self, key):
+        # The file of the session, then the files of the other sessions of
+        # the subject, most recent first
+        path = os.path.join(self.directory, key + '.npy')
+        if os.path.exists(path):
+            return [path]
+        others = []
+        for entry in os.scandir(self.subject_directory):
+            other = os.path.join(entry.path, key + '.npy')
+            if entry.is_dir() and os.path.exists(other):
+                others.append((os.stat(other).st_mtime, other))
+        return [other for (_, other) in sorted(others, reverse=True)]
+
+    def load(self, key):
+        """Coefficients (regressors x EEG channels) of key, None if none were saved."""
+        for path in self._candidates(key):
+            try:
+                return np.load(path)
+            except (OSError, ValueError):
+                # Being replaced or truncated, try the next one
+                continue
+        return None
+
+    def save(self, key, coeffs):
+        path = os.path.join(self.directory, key + '.npy')
+        tmp = path + '.tmp-' + uuid.uuid4().hex + '.npy'
+        np.save(tmp, np.asarray(coeffs, dtype=np.float64))
+        # Atomic: a run starting meanwhile loads the previous coefficients
+        os.replace(tmp, path)
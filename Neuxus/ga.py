@@ -0,0 +1,178 @@
+import logging
+import numpy as np
+from neuxus.node import Node
+from collections import deque
+
+import mne
+
+from ring_buffer import RingBuffer
+
+
+def _template_windows(n_epochs, half_window_size):
+    # First and last (excluded) epochs of the template of every epoch, as in
+    # GradientArtefactCorrection of the gradient_correction notebook
+    t = np.arange(n_epochs)
+    indice_min = t - half_window_size
+    indice_max = t + half_window_size + 1
+    start = t < half_window_size
+    indice_min[start] = 0
+    indice_max[start] = 2 * half_window_size + 1
+    end = t > n_epochs - half_window_size
+    indice_max[end] = n_epochs
+    indice_min[end] = n_epochs - 2 * half_window_size - 1
+    return np.clip(indice_min, 0, n_epochs), np.clip(indice_max, 0, n_epochs)
+
+
+class GradientArtefactCorrection():
+    """Sliding average template subtraction of the MRI gradient artefact.
+
+    Same correction as the GradientArtefactCorrection of the notebooks, but
+    the TR epochs are stacked once into a (channel, TR, sample) array and the
+    template of every TR is obtained by a running sum over the epochs, one
+    epoch added and one removed per TR, instead of re-averaging the whole
+    window of epochs for every TR.
+    """
+
+    def fit_transform(self, raw, event_name, half_window_size=10):
+        tr_events, event_id = mne.events_from_annotations(raw, event_id='auto', regexp=event_name, use_rounding=True, chunk_duration=None, verbose=False)
+
+        tr = np.diff(tr_events[:, 0])
+        tr = np.mean(tr).astype(int)
+        corrected = self.transform_data(raw.get_data(), tr_events[:, 0] - raw.first_samp, tr, half_window_size)
+
+        raw_corrected = mne.io.RawArray(corrected, raw.info)
+        raw_corrected.set_annotations(raw.annotations)
+        return(raw_corrected)
+
+    def transform_data(self, data, starts, tr, half_window_size=10):
+        """Correct data (channels x samples) in place, starts are the first
+        samples of the TRs and tr their length in samples."""
+        n_times = data.shape[1]
+        # Epochs from 0 to tr included, the ones that do not fit are dropped
+        starts = starts[(starts >= 0) & (starts + tr + 1 <= n_times)]
+        epochs = data[:, starts[:, None] + np.arange(tr + 1)]
+        # Detrended epochs are the epochs minus their mean
+        means = epochs.mean(axis=2)
+
+        indice_min, indice_max = _template_windows(len(starts), half_window_size)
+        window_sum = np.zeros((data.shape[0], tr + 1))
+        window_means = np.zeros(data.shape[0])
+        low, high = 0, 0
+        for t, start in enumerate(starts):
+            # Slide the running sums to the window of epoch t, the start of
+            # the window moves back by one epoch where the end is clamped
+            while high < indice_max[t]:
+                window_sum += epochs[:, high]
+                window_means += means[:, high]
+                high += 1
+            while low > indice_min[t]:
+                low -= 1
+                window_sum += epochs[:, low]
+                window_means += means[:, low]
+            while low < indice_min[t]:
+                window_sum -= epochs[:, low]
+                window_means -= means[:, low]
+                low += 1
+            template = (window_sum - window_means[:, None]) / (high - low)
+            data[:, start:start + tr + 1] = epochs[:, t] - template
+        return data
+
+
+class SlidingGA(Node):
+    """Online gradient artefact correction by average template subtraction.
+
+    A volume is the tr seconds following a start_marker. Once a volume is
+    complete, it is added to a deque of the last n_volumes mean-removed
+    volumes, whose running sum gives the template in O(channels x samples)
+    per volume, and the corrected volume is sent, one TR after its marker.
+    Samples out of any volume (before the first marker, or received before
+    their marker) are sent uncorrected, also while a marker ahead of the
+    samples is waiting for its first sample. Markers older than the buffer
+    are dropped (logged).
+    """
+
+    def __init__(self, input_port, marker_input_port, start_marker='R128', tr=0.8, n_volumes=21):
+        Node.__init__(self, input_port)
+        self.channels = self.input.channels
+        self.sfreq = self.input.sampling_frequency
+        self.marker_input = marker_input_port
+        self.start_marker = start_marker
+        self.n_volumes = n_volumes
+        self.volume_size = int(round(tr * self.sfreq))
+
+        self.buffer = RingBuffer(len(self.channels), 4 * self.volume_size)
+        self.volumes = deque()
+        self.volume_sum = np.zeros((self.volume_size, len(self.channels)))
+        # Timestamps of the markers whose first sample is not received yet
+        self._marker_timestamps = []
+        # First samples of the volumes that are not complete yet
+        self._volume_starts = []
+        # Index of the next sample to send
+        self._next = 0
+
+        self.output.set_parameters(
+            data_type=self.input.data_type,
+            channels=self.input.channels,
+            sampling_frequency=self.sfreq,
+            meta=self.input.meta,
+            epoching_frequency=self.input.epoching_frequency
+        )
+
+    def _samples(self, start, stop):
+        # Values and timestamps of the samples start to stop (indices since the first sample)
+        values, timestamps = self.buffer.last(self.buffer.n_total - start)
+        return values[:stop - start], timestamps[:stop - start]
+
+    def _send(self, stop, template=None):
+        start = max(self._next, self.buffer.n_total - len(self.buffer))
+        if stop <= start:
+            return
+        values, timestamps = self._samples(start, stop)
+        if template is not None:
+            values = values - template[-(stop - start):]
+        self.output.set(values.copy(), timestamps.copy(), self.channels)
+        self._next = stop
+
+    def _add_volume(self, start):
+        volume, timestamps = self._samples(start, start + self.volume_size)
+        volume = volume - volume.mean(axis=0)
+        self.volumes.append(volume)
+        self.volume_sum += volume
+        if len(self.volumes) > self.n_volumes:
+            self.volume_sum -= self.volumes.popleft()
+        return self.volume_sum / len(self.volumes)
+
+    def update(self):
+        for input_chunk in self.input:
+            self.buffer.append(input_chunk.values, input_chunk.index.values)
+        for marker in self.marker_input:
+            values = marker.select_dtypes(include=['object']).values
+            for timestamp, value in zip(marker.index.values, values):
+                if self.start_marker in value:
+                    self._marker_timestamps.append(timestamp)
+
+        # First sample of the markers
+        values, timestamps = self.buffer.last()
+        while self._marker_timestamps and len(timestamps) and timestamps[-1] >= self._marker_timestamps[0]:
+            timestamp = self._marker_timestamps.pop(0)
+            if timestamp < timestamps[0]:
+                logging.warning('%s marker at %.3f s dropped, older than the buffer' % (self._id, timestamp))
+                continue
+            index = np.searchsorted(timestamps, timestamp)
+            self._volume_starts.append(self.buffer.n_total - len(timestamps) + index)
+
+        # Complete volumes
+        while self._volume_starts and self._volume_starts[0] + self.volume_size <= self.buffer.n_total:
+            start = self._volume_starts.pop(0)
+            if start < self.buffer.n_total - len(self.buffer):
+                # Already out of the buffer (chunk longer than 3 volumes)
+                continue
+            template = self._add_volume(start)
+            self._send(start)
+            self._send(start + self.volume_size, template)
+
+        # The pending markers are after the last sample received
+        if self._volume_starts:
+            self._send(self._volume_starts[0])
+        else:
+            self._send(self.buffer.n_total)
@@ -0,0 +1,235 @@
+"""
+Latency and throughput instrumentation of the nodes of a NeuXus pipeline.
+
+Instrumentation wraps the update method of node instances (any Node
+subclass, CWL and Save included) and records, for every update:
+- its wall time,
+- the sizes of the input and output chunks,
+- the lag of the output, the time between the last input sample and the
+  last output sample received or sent by the node,
+- its backlog, the duration of the samples received by the node that it did
+  not send yet.
+
+The values are added to log-spaced histograms that are only written by the
+pipeline thread, so without any lock, and a background thread exports the
+statistics of the last interval to the sinks (FileSink, LslSink). Nodes that
+are not instrumented are not modified, so the instrumentation has no cost
+when it is not enabled.
+
+At the end of a pipeline script:
+
+    from instrument import Instrumentation, FileSink
+    instrumentation = Instrumentation(sinks=[FileSink('latency.jsonl')], interval=10).start()
+"""
+import atexit
+import json
+import math
+import threading
+import time
+import numpy as np
+from neuxus.node import Node
+
+
+class Histogram():
+    """Histogram of positive values with bins_per_decade log-spaced bins
+    from low to high, plus one bin below low and one above high (up to the
+    largest value added, so that the bounds are finite)."""
+
+    def __init__(self, low, high, bins_per_decade=10):
+        self.low = low
+        self.bins_per_decade = bins_per_decade
+        self.n_bins = int(np.ceil(np.log10(high / low) * bins_per_decade)) + 2
+        # Upper edges of the bins
+        self.edges = np.append(low * 10 ** (np.arange(self.n_bins - 1) / bins_per_decade), np.inf)
+        self._log_low = math.log10(low)
+        self.counts = np.zeros(self.n_bins, dtype=np.int64)
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, value):
+        if value < self.low:
+            index = 0
+        else:
+            index = min(int((math.log10(value) - self._log_low) * self.bins_per_decade) + 1, self.n_bins - 1)
+        self.counts[index] += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        return self.counts.copy(), self.total
+
+    def summary(self, counts, total):
+        """Count, mean and upper bounds of the percentiles 50, 95 and 99 and
+        of the maximum of the values counted in counts (from snapshots)."""
+        n = int(counts.sum())
+        if n == 0:
+            return {'count': 0}
+        cumulative = np.cumsum(counts)
+        summary = {'count': n, 'mean': total / n}
+        for name, q in [('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1.)]:
+            summary[name] = float(min(self.edges[np.searchsorted(cumulative, q * n)], self.max))
+        return summary
+
+
+class NodeStats():
+    """Histograms of one node, the durations are in seconds and the chunk
+    sizes in samples."""
+
+    def __init__(self, name):
+        self.name = name
+        self.histograms = {
+            'update': Histogram(1e-6, 10.),
+            'input_chunk': Histogram(1, 1e6),
+            'output_chunk': Histogram(1, 1e6),
+            'lag': Histogram(1e-4, 100.),
+            'backlog': Histogram(1e-4, 100.),
+        }
+        self.n_updates = 0
+        self.n_input = 0
+        self.n_output = 0
+        self.last_input = -np.inf
+        self.last_output = -np.inf
+
+    def snapshot(self):
+        return {key: histogram.snapshot() for key, histogram in self.histograms.items()}
+
+
+def _receive(port, histogram):
+    # Number of samples of the chunks of port and timestamp of the last one
+    n, last = 0, None
+    if port is None:
+        return n, last
+    for chunk in port:
+        histogram.add(len(chunk))
+        n += len(chunk)
+        if len(chunk):
+            last = chunk.index[-1]
+    return n, last
+
+
+def instrument(node, stats=None):
+    """Wrap the update method of node (instance only) and return its NodeStats."""
+    if stats is None:
+        stats = NodeStats(node._id)
+    update = node.update
+    histograms = stats.histograms
+    input_port = node.input
+    output_port = node.output
+
+    def instrumented_update():
+        n_input, last_input = _receive(input_port, histograms['input_chunk'])
+        start = time.perf_counter()
+        update()
+        histograms['update'].add(time.perf_counter() - start)
+        n_output, last_output = _receive(output_port, histograms['output_chunk'])
+
+        stats.n_updates += 1
+        stats.n_input += n_input
+        stats.n_output += n_output
+        if last_input is not None:
+            stats.last_input = max(stats.last_input, last_input)
+        if last_output is not None:
+            stats.last_output = max(stats.last_output, last_output)
+            if stats.last_input > -np.inf:
+                histograms['lag'].add(max(stats.last_input - stats.last_output, 0.))
+        if input_port is not None and output_port is not None:
+            input_sfreq = input_port.sampling_frequency
+            output_sfreq = output_port.sampling_frequency
+            if input_sfreq and output_sfreq:
+                histograms['backlog'].add(max(stats.n_input / input_sfreq - stats.n_output / output_sfreq, 0.))
+
+    node.update = instrumented_update
+    return stats
+
+
+class FileSink():
+    # One JSON line per node and per export
+    def __init__(self, filename):
+        self.file = open(filename, 'a')
+
+    def export(self, records):
+        for record in records:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class LslSink():
+    # String LSL stream, one JSON sample per node and per export
+    def __init__(self, name='NeuXus-Instrumentation'):
+        from pylsl import StreamInfo, StreamOutlet
+        info = StreamInfo(name, 'Instrumentation', 1, 0, 'string', name)
+        self.outlet = StreamOutlet(info)
+
+    def export(self, records):
+        for record in records:
+            self.outlet.push_sample([json.dumps(record)])
+
+    def close(self):
+        pass
+
+
+class Instrumentation():
+    """Instrument nodes (all the nodes created so far by default) and export
+    their statistics over the last interval seconds to the sinks."""
+
+    def __init__(self, nodes=None, sinks=(), interval=10.):
+        if nodes is None:
+            nodes = list(Node.get_instances())
+        self.stats = [instrument(node) for node in nodes]
+        self.sinks = list(sinks)
+        self.interval = interval
+        self._previous = {stats.name: stats.snapshot() for stats in self.stats}
+        self._previous_updates = {stats.name: 0 for stats in self.stats}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def records(self):
+        """Statistics of every node since the previous call, durations in ms."""
+        records = []
+        for stats in self.stats:
+            snapshot = stats.snapshot()
+            previous = self._previous[stats.name]
+            record = {'time': time.time(), 'node': stats.name,
+                      'updates': stats.n_updates - self._previous_updates[stats.name],
+                      'input_samples': stats.n_input, 'output_samples': stats.n_output}
+            for key, histogram in stats.histograms.items():
+                counts, total = snapshot[key]
+                summary = histogram.summary(counts - previous[key][0], total - previous[key][1])
+                if key in ['update', 'lag', 'backlog']:
+                    summary = {name: value * 1e3 if name != 'count' else value for name, value in summary.items()}
+                    key = key + '_ms'
+                record[key] = summary
+            self._previous[stats.name] = snapshot
+            self._previous_updates[stats.name] = stats.n_updates
+            records.append(record)
+        return records
+
+    def export(self):
+        records = self.records()
+        for sink in self.sinks:
+            sink.export(records)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        # The NeuXus runner ends with exit()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.export()
+        for sink in self.sinks:
+            sink.close()
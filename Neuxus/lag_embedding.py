@@ -0,0 +1,162 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def lag_rows(cwl, start, stop, offset, sample_shift, regressors=None):
+    """Lagged CWL regressors of the samples start to stop.
+
+    cwl holds the CWL samples offset to offset + len(cwl) (samples x channels).
+    As in delay_data, a lagged sample that is out of the available data is
+    replaced by the undelayed sample. Returns (stop - start) x (n_shifts * n_cwl),
+    ordered shift by shift like delay_data: column k * n_cwl + c is the
+    sample t + sample_shift - k of channel c. With regressors (column
+    indices, e.g. of a cwl_lags.LagSelection) only these columns are returned.
+    """
+    sample_shifts = np.arange(-sample_shift, sample_shift + 1)
+    times = np.arange(start, stop)
+    if regressors is not None:
+        regressors = np.asarray(regressors)
+        channels = regressors % cwl.shape[1]
+        indices = times[:, None] - sample_shifts[regressors // cwl.shape[1]][None, :]
+        out_of_range = (indices < offset) | (indices >= offset + len(cwl))
+        indices = np.where(out_of_range, times[:, None], indices) - offset
+        return cwl[indices, channels[None, :]]
+    indices = times[:, None] - sample_shifts[None, :]
+    out_of_range = (indices < offset) | (indices >= offset + len(cwl))
+    indices = np.where(out_of_range, times[:, None], indices) - offset
+    # (times, shifts, channels) -> (times, shifts * channels)
+    return cwl[indices].reshape(len(times), -1)
+
+
+class LagEmbedding():
+    """Lagged versions of signals (channels x samples) for the shifts
+    -sample_shift to sample_shift, without one copy of the signals per shift.
+
+    view is a read-only (n_shifts, n_channels, n_times) stride view over an
+    edge-padded copy of the data, so the memory use is O(samples) whatever the
+    number of lags. With pad='hold' (default) the lagged samples that fall out
+    of the data are the undelayed samples, exactly as in delay_data; with
+    pad='edge' they are the first/last samples, which is what view holds.
+    The two only differ on the first and last sample_shift samples, which are
+    patched by segment, gram, cross and apply.
+
+    With regressors (indices of the rows of the lag matrix, e.g. of a
+    cwl_lags.LagSelection) the lag matrix only has these rows; gram, cross
+    and apply then use the materialized rows, which are few.
+
+    segment materializes the lag matrix of a range of samples only. gram,
+    cross and apply compute XXt, XYt and the regression prediction of a
+    range of samples without materializing the lag matrix; gram is built from
+    the cross-products of the signals for each lag difference.
+    """
+
+    def __init__(self, data, sample_shift, pad='hold', regressors=None):
+        assert pad in ['hold', 'edge']
+        self.data = data
+        self.sample_shift = sample_shift
+        self.pad = pad
+        self.n_channels, self.n_times = data.shape
+        self.n_shifts = 2 * sample_shift + 1
+        self.regressors = None if regressors is None else np.asarray(regressors)
+        self.n_regressors = self.n_shifts * self.n_channels if regressors is None else len(regressors)
+
+        self._padded = np.pad(data, ((0, 0), (sample_shift, sample_shift)), mode='edge')
+        # windows[c, j, t] = padded[c, j + t], the shift s = k - sample_shift
+        # reads padded[c, t + 2 * sample_shift - k]
+        windows = sliding_window_view(self._padded, self.n_times, axis=1)
+        self.view = windows[:, ::-1, :].transpose(1, 0, 2)
+
+    def _boundaries(self, start, stop):
+        # Ranges of samples where the hold padding differs from the view
+        s = self.sample_shift
+        if self.pad == 'edge' or s == 0:
+            return []
+        if self.n_times <= 2 * s:
+            return [(start, stop)]
+        ranges = []
+        for low, high in [(0, s), (self.n_times - s, self.n_times)]:
+            low, high = max(low, start), min(high, stop)
+            if low < high:
+                ranges.append((low, high))
+        return ranges
+
+    def _view_rows(self, start, stop):
+        if self.regressors is not None:
+            return self.view[self.regressors // self.n_channels, self.regressors % self.n_channels, start:stop]
+        return self.view[:, :, start:stop].reshape(self.n_regressors, stop - start)
+
+    def _hold_correction(self, low, high):
+        # Difference between the exact hold rows and the view rows
+        exact = lag_rows(self.data.T, low, high, 0, self.sample_shift, self.regressors).T
+        return exact - self._view_rows(low, high)
+
+    def segment(self, start, stop):
+        """Lag matrix (n_shifts * n_channels, stop - start) of samples start to stop."""
+        rows = self._view_rows(start, stop)
+        if not rows.flags.writeable:
+            rows = rows.copy()
+        for low, high in self._boundaries(start, stop):
+            rows[:, low - start:high - start] += self._hold_correction(low, high)
+        return rows
+
+    def gram(self, start, stop):
+        """X Xt of the lag matrix X of samples start to stop."""
+        if self.regressors is not None:
+            rows = self.segment(start, stop)
+            return rows @ rows.T
+        s2 = 2 * self.sample_shift
+        gram = np.zeros((self.n_shifts, self.n_channels, self.n_shifts, self.n_channels))
+
+        # Interior samples, where the hold padding is the same as the view
+        if self.pad == 'hold':
+            low, high = max(start, self.sample_shift), min(stop, self.n_times - self.sample_shift)
+        else:
+            low, high = start, stop
+        if low < high:
+            for d in range(-s2, s2 + 1):
+                # gram[k1, c1, k1 - d, c2] is the sum of p[c1, u] * p[c2, u + d]
+                # over the samples u of the shift k1
+                k1 = np.arange(max(0, d), min(s2, s2 + d) + 1)
+                u_low = low + s2 - k1[-1]
+                u_high = high + s2 - k1[0]
+                for c1 in range(self.n_channels):
+                    products = self._padded[c1, u_low:u_high] * self._padded[:, u_low + d:u_high + d]
+                    cumsum = np.zeros((self.n_channels, u_high - u_low + 1))
+                    np.cumsum(products, axis=1, out=cumsum[:, 1:])
+                    first = low + s2 - k1 - u_low
+                    gram[k1, c1, k1 - d, :] = (cumsum[:, first + high - low] - cumsum[:, first]).T
+            ranges = [(start, low), (high, stop)]
+        else:
+            ranges = [(start, stop)]
+
+        # Boundary samples, from their exact rows
+        gram = gram.reshape(self.n_regressors, self.n_regressors)
+        for b_low, b_high in ranges:
+            if b_low < b_high:
+                rows = lag_rows(self.data.T, b_low, b_high, 0, self.sample_shift)
+                gram += rows.T @ rows
+        return gram
+
+    def cross(self, y, start, stop):
+        """X Yt, y holds the samples start to stop (channels x samples)."""
+        if self.regressors is not None:
+            return self.segment(start, stop) @ y.T
+        out = np.empty((self.n_shifts, self.n_channels, len(y)))
+        for k in range(self.n_shifts):
+            out[k] = self.view[k, :, start:stop] @ y.T
+        out = out.reshape(self.n_regressors, len(y))
+        for low, high in self._boundaries(start, stop):
+            out += self._hold_correction(low, high) @ y[:, low - start:high - start].T
+        return out
+
+    def apply(self, coeffs, start, stop):
+        """coeffst X of samples start to stop, coeffs is (n_regressors, n_outputs)."""
+        if self.regressors is not None:
+            return coeffs.T @ self.segment(start, stop)
+        blocks = coeffs.reshape(self.n_shifts, self.n_channels, -1)
+        out = np.zeros((coeffs.shape[1], stop - start))
+        for k in range(self.n_shifts):
+            out += blocks[k].T @ self.view[k, :, start:stop]
+        for low, high in self._boundaries(start, stop):
+            out[:, low - start:high - start] += coeffs.T @ self._hold_correction(low, high)
+        return out
@@ -3,13 +3,19 @@ os.environ['NUMEXPR_MAX_THREADS'] = '18'
 
 from neuxus.nodes import correct, io, filter, read
 from cwl_node import CWL
+from cwl_store import CoefficientStore
 from save import Save
+from ga import SlidingGA
+from band_power import BandPower
 
 # Read from LSL
 signal = io.LslReceive('name', 'BrainAmpSeries-Dev_1', 'signal')
 
 # GA
 signal_ga = correct.GA(signal.output, start_marker='Response/R128', tr=0.8)  # 'Response/R128' is the marker of the start of every MRI volume (in case the data is read from a Brain Vision file; in case it's streamed by Brain Vision Recorder, it is 'R128')
+# Alternative with a running sum template, updated once per volume
+#markers = io.LslReceive('name', 'BrainAmpSeries-Dev_1-Markers', 'marker')
+#signal_ga = SlidingGA(signal.output, markers.output, start_marker='R128', tr=0.8, n_volumes=21)
 #signal_save_ga = Save(signal_ga.output, marker_input_port=signal_ga.marker_output, filename='P05_eyes_closed_mrion-GA-raw.fif')
 
 # Down-sample
@@ -18,6 +24,26 @@ signal_ds = filter.DownSample(signal_ga.output, 20)
 # CWL
 #signal_pa_cwl = CWL(signal_pa.output, time_delay=21e-3, window_duration=4, overlap=0.5)
 signal_cwl = CWL(signal_ds.output, time_delay=21e-3, window_duration=4, overlap=0.5)
+# Alternative with the regression statistics updated with the chunk samples only
+#signal_cwl = CWL(signal_ds.output, time_delay=21e-3, window_duration=4, mode='incremental')
+# Alternative at the full rate (no DownSample): fitted at 250 Hz every second, applied at 5 kHz
+#signal_cwl = CWL(signal_ga.output, time_delay=21e-3, window_duration=4, mode='multirate', decimation=20, refit_interval=1)
+# Corrected from the first chunk with the coefficients of the previous run of the subject
+#signal_cwl = CWL(signal_ds.output, time_delay=21e-3, window_duration=4, overlap=0.5,
+#                 coefficients=CoefficientStore('cwl_coefficients', subject='P05', session='1'))
+# With the lags selected on the first window (lag count against residual variance in the log)
+#signal_cwl = CWL(signal_ds.output, time_delay=21e-3, window_duration=4, overlap=0.5, prune_lags=1e-3)
 
 # Send to LSL
 signal_lsl = io.LslSend(signal_cwl.output, 'BrainAmpSeries-Dev_1', type='EEG')
+
+# Neurofeedback features, band powers and left/right ratios at 4 Hz
+#signal_bands = BandPower(signal_cwl.output, n_fft=256, n_overlap=128, n_segments=8, rate=4)
+#signal_bands_lsl = io.LslSend(signal_bands.output, 'Feedback', type='Feedback')
+
+# Instrumentation of the nodes (update time, chunk sizes, lag, backlog), the
+# nodes are not modified when it is disabled
+instrumentation = False
+if instrumentation:
+    from instrument import Instrumentation, FileSink
+    stats = Instrumentation(sinks=[FileSink('neuxus_pipeline-latency.jsonl')], interval=10).start()
@@ -0,0 +1,126 @@
+"""
+As fast as possible execution of the file pipelines (read.Reader -> ... -> Save).
+
+read.Reader sends the samples at the pace of the recording, in chunks of
+the samples elapsed since the previous update. FastReader sends the samples
+without waiting, in chunks of chunk_size samples, block_size samples per
+update: every node receives the chunks it would receive from a Reader that
+sends chunk_size samples per chunk, so the outputs are the same, but the
+recording is processed as fast as the nodes consume it. This holds for
+nodes whose output only depends on their input samples (the fits of the CWL
+mode 'multirate' in a background thread are applied at fixed samples), see
+test_offline.py.
+
+This script runs a pipeline script with read.Reader replaced by FastReader,
+until the end of the recordings (and of the stage_cache.StageReader nodes),
+then terminates the nodes (Save writes its file):
+
+python offline.py save_pipeline.py --chunk-size 100 --block-size 5000
+"""
+import argparse
+import os
+import sys
+import time
+from neuxus.node import Node
+from neuxus.chunks import Port
+from neuxus.nodes import read
+
+# read.Reader is replaced while the pipeline script runs
+_Reader = read.Reader
+
+
+class FastReader(Node):
+    """Same output as read.Reader (file formats, DataFrames, markers) with
+    chunks of chunk_size samples, block_size samples per update (a multiple
+    of chunk_size, one read of the file per update), without waiting."""
+
+    def __init__(self, file, chunk_size=100, block_size=None, min_chunk_size=4):
+        # Registered as a Node (the pipelines update Node.get_instances()),
+        # the file is read as read.Reader does
+        _Reader.__init__(self, file, min_chunk_size)
+        self.chunk_size = chunk_size
+        self.block_size = block_size or chunk_size
+        if self._file_extension in ['.gdf', '.set', '.vhdr']:
+            self._n_times = self._raw.n_times
+        else:
+            self._n_times = len(self._df)
+        # Next sample to send
+        self._index = 0
+
+    @property
+    def finished(self):
+        return self._index >= self._n_times
+
+    def update(self):
+        if self.finished:
+            return
+        start_index = self._index
+        end_index = min(start_index + self.block_size, self._n_times)
+        # As read.Reader
+        if self._file_extension in ['.gdf', '.set', '.vhdr']:
+            df = self._raw.to_data_frame(start=start_index, stop=end_index)
+            df['time'] = df['time'] / 1000
+            df = df.set_index('time')
+            df.columns = self._channels
+        elif self._file_extension == '.xdf':
+            df = self._df.iloc[start_index:end_index, :]
+        for first in range(0, len(df), self.chunk_size):
+            self.output.set_from_df(df.iloc[first:first + self.chunk_size])
+        t = end_index / self._sampling_frequency
+        while self._events and t + self._start_record > self._events[0][0]:
+            self.marker_output.set([self._events[0][1]], [self._events[0][0]])
+            self._events = self._events[1:]
+        self._index = end_index
+        # Time of the last sample sent, as read.Reader
+        self._last_t = t
+
+
+def run(pipeline, chunk_size=100, block_size=None):
+    """Run the pipeline script with FastReader in place of read.Reader until
+    the end of its recordings, terminate its nodes, return the elapsed time."""
+    sys.path.append(os.path.dirname(os.path.realpath(pipeline)))
+    readers = []
+
+    def fast_reader(file, min_chunk_size=4):
+        readers.append(FastReader(file, chunk_size, block_size, min_chunk_size))
+        return readers[-1]
+
+    read.Reader = fast_reader
+    try:
+        start = time.perf_counter()
+        # The nodes are only weakly referenced by Node.get_instances(), the
+        # namespace of the script keeps them
+        namespace = {'__name__': '__pipeline__', '__file__': pipeline}
+        exec(compile(open(pipeline).read(), pipeline, 'exec'), namespace)
+    finally:
+        read.Reader = _Reader
+    # The outputs of cached stages (stage_cache.StageReader) are read as files
+    readers += [node for node in Node.get_instances() if hasattr(node, 'finished') and node not in readers]
+    # Same loop as the NeuXus runner, one more update to empty the ports
+    while True:
+        done = all(r.finished for r in readers)
+        for port in Port.get_instances():
+            port.clear()
+        for node in Node.get_instances():
+            node.update()
+        if done:
+            break
+    for node in Node.get_instances():
+        node.terminate()
+    return time.perf_counter() - start, readers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pipeline", type=str, help="Pipeline script reading files with read.Reader")
+    parser.add_argument("--chunk-size", type=int, default=100,
+                        help="Samples per chunk, as sent online (100 = one RDA block at 5 kHz)")
+    parser.add_argument("--block-size", type=int, default=None,
+                        help="Samples read per update, a multiple of --chunk-size")
+    args = parser.parse_args()
+    if args.block_size is not None and args.block_size % args.chunk_size:
+        parser.error("--block-size must be a multiple of --chunk-size")
+
+    elapsed, readers = run(args.pipeline, args.chunk_size, args.block_size)
+    duration = sum(r._n_times / r._sampling_frequency for r in readers)
+    print("%.1f s of recording processed in %.1f s (%.1fx real time)" % (duration, elapsed, duration / max(elapsed, 1e-9)))
@@ -2,11 +2,20 @@ import os
 os.environ['NUMEXPR_MAX_THREADS'] = '18'
 
 from neuxus.nodes import correct, io, filter, read
-from cwl_node import CWL
 from save import Save
 
+# CWL backend, 'numpy' (cwl_node.py) or 'numba' (cwl_numba.py, compiled at startup)
+cwl_backend = 'numpy'
+if cwl_backend == 'numba':
+    from cwl_numba import NumbaCWL as CWL
+else:
+    from cwl_node import CWL
+
 # Read from Recview
 signal = io.LslReceive('name', 'RDA2LSL', 'signal')
+# On the computer of the bridge (RDA_lsl.py --shared-memory rda), without LSL
+#from shm_receive import SharedMemoryReceive
+#signal = SharedMemoryReceive('rda')
 
 # CWL
 signal_cwl = CWL(signal.output, time_delay=21e-3, window_duration=4, overlap=0.5)
@@ -20,3 +29,10 @@ signal_cwl = CWL(signal.output, time_delay=21e-3, window_duration=4, overlap=0.5
 # Send to LSL
 signal_lsl = io.LslSend(signal_cwl.output, 'BrainAmpSeries-Dev_1', type='EEG')
 #signal_pa_lsl = io.LslSend(signal_cwl.output, 'cwl', type='EEG')
+
+# Instrumentation of the nodes (update time, chunk sizes, lag, backlog), the
+# nodes are not modified when it is disabled
+instrumentation = False
+if instrumentation:
+    from instrument import Instrumentation, FileSink
+    stats = Instrumentation(sinks=[FileSink('recview_pipeline-latency.jsonl')], interval=10).start()
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class RingBuffer():
+    """Preallocated buffer of samples x channels with their timestamps.
+
+    With grow=False it keeps the last `capacity` samples. The storage holds
+    twice the capacity: samples are written after the previous ones and the
+    last `capacity` samples are moved back to the start when the end of the
+    storage is reached (once every `capacity` samples), so that last() is
+    always a contiguous view and appending does not allocate.
+
+    With grow=True it keeps every sample and doubles its storage when it is
+    full (amortized O(1) per sample).
+    """
+
+    def __init__(self, n_channels, capacity, grow=False, dtype=np.float64):
+        self.n_channels = n_channels
+        self.capacity = capacity
+        self.grow = grow
+        size = capacity if grow else 2 * capacity
+        self._values = np.empty((size, n_channels), dtype=dtype)
+        self._timestamps = np.empty(size)
+        # The samples held are _values[_start:_end]
+        self._start = 0
+        self._end = 0
+        # Number of samples appended since the creation of the buffer
+        self.n_total = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def _reserve(self, n):
+        if self._end + n <= len(self._values):
+            return
+        if self.grow:
+            size = max(2 * len(self._values), self._end + n)
+            values = np.empty((size, self.n_channels), dtype=self._values.dtype)
+            timestamps = np.empty(size)
+            values[:self._end] = self._values[:self._end]
+            timestamps[:self._end] = self._timestamps[:self._end]
+            self._values = values
+            self._timestamps = timestamps
+        else:
+            # Move the samples that are still needed to the start
+            keep = min(len(self), self.capacity - n)
+            self._values[:keep] = self._values[self._end - keep:self._end]
+            self._timestamps[:keep] = self._timestamps[self._end - keep:self._end]
+            self._start = 0
+            self._end = keep
+
+    def append(self, values, timestamps):
+        """Append a chunk (samples x channels) and its timestamps."""
+        n = len(values)
+        self.n_total += n
+        if not self.grow and n > self.capacity:
+            values = values[-self.capacity:]
+            timestamps = timestamps[-self.capacity:]
+            n = self.capacity
+        self._reserve(n)
+        self._values[self._end:self._end + n] = values
+        self._timestamps[self._end:self._end + n] = timestamps
+        self._end += n
+        if not self.grow:
+            self._start = max(self._start, self._end - self.capacity)
+
+    def last(self, n=None):
+        """Views (no copy) of the values and timestamps of the last n samples,
+        or of all the samples held if n is None."""
+        if n is None:
+            n = len(self)
+        n = min(n, len(self))
+        return self._values[self._end - n:self._end], self._timestamps[self._end - n:self._end]
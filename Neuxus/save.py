@@ -7,9 +7,27 @@ from neuxus.chunks import Port
 
 import numpy as np
 import mne
+import os
+import sys
+import time
+import threading
+import queue
+
+from ring_buffer import RingBuffer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RDA'))
+from rda_writer import BrainVisionWriter, BrainVisionToFif
+
 
 class Save(Node):
-    def __init__(self, input_port, marker_input_port=None, filename='test-raw.fif', overwrite=False):
+    # With flush_interval (seconds), the samples and markers are flushed every
+    # flush_interval (or flush_interval of samples, when the data comes faster
+    # than real time as with offline.FastReader) to a float32 BrainVision
+    # store next to filename by a background thread, and converted to filename
+    # on terminate, instead of being held in memory until terminate.
+    # dtype is the dtype of the samples held in memory (without flush_interval)
+    def __init__(self, input_port, marker_input_port=None, filename='test-raw.fif', overwrite=False, flush_interval=None,
+                 dtype=np.float64):
         Node.__init__(self, input_port)
         self.channels = self.input.channels
         self.sfreq = self.input.sampling_frequency
@@ -19,9 +37,21 @@ class Save(Node):
         self.filename = filename
         # Create MNE info object
         self.info = mne.create_info(self.channels, self.sfreq, ch_types=['eeg'] * len(self.channels))
-        # Create buffer
-        self.buffer = np.empty((len(self.channels), 0))
-        self.timestamps = np.empty(0)
+        self.flush_interval = flush_interval
+        if flush_interval is None:
+            # Create buffer, growing by doubling
+            self.buffer = RingBuffer(len(self.channels), int(60 * self.sfreq), grow=True, dtype=dtype)
+        else:
+            # Samples are in microvolts
+            self.writer = BrainVisionWriter(os.path.splitext(filename)[0] + '.vhdr', self.channels, self.sfreq)
+            self._pending = []
+            self._n_pending = 0
+            self._flushed_markers = 0
+            self._first_timestamp = None
+            self._last_flush = time.time()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
 
         # Set output parameters
         self.output.set_parameters(
@@ -36,9 +66,13 @@ class Save(Node):
 
     def update(self):
         for input_chunk in self.input:
-            input_chunk_values = input_chunk.values
-            self.buffer = np.hstack((self.buffer, input_chunk_values.T))
-            self.timestamps = np.hstack((self.timestamps, input_chunk.index.values))
+            if self.flush_interval is None:
+                self.buffer.append(input_chunk.values, input_chunk.index.values)
+            else:
+                if self._first_timestamp is None:
+                    self._first_timestamp = input_chunk.index.values[0]
+                self._pending.append(input_chunk.values.astype(np.float32))
+                self._n_pending += len(input_chunk)
         if self.marker_input is not None:
             for marker in self.marker_input:
                 marker_values = marker.select_dtypes(include=['object']).values
@@ -46,14 +80,56 @@ class Save(Node):
                 for timestamp, value in zip(marker_timestamps, marker_values):
                     self.marker_timestmaps.append(timestamp)
                     self.marker_values.append(value)
-                
+        if self.flush_interval is not None and (time.time() - self._last_flush >= self.flush_interval
+                                                or self._n_pending >= self.flush_interval * self.sfreq):
+            self._flush()
+
+    def _flush(self):
+        # Hand the pending samples and markers to the writing thread
+        self._last_flush = time.time()
+        if self._first_timestamp is None:
+            return
+        block = np.concatenate(self._pending) if self._pending else None
+        markers = []
+        for timestamp, value in zip(self.marker_timestmaps[self._flushed_markers:], self.marker_values[self._flushed_markers:]):
+            position = int(round((timestamp - self._first_timestamp) * self.sfreq))
+            markers.append(('/'.join(str(v) for v in value), position))
+        self._flushed_markers = len(self.marker_values)
+        self._pending = []
+        self._n_pending = 0
+        self._queue.put((block, markers))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            block, markers = item
+            if block is not None:
+                self.writer.Write(block)
+            for description, position in markers:
+                self.writer.WriteMarker('Comment', description, position)
+
+    def _terminate_stream(self):
+        self._flush()
+        self._queue.put(None)
+        self._thread.join()
+        self.writer.Close()
+        BrainVisionToFif(self.writer.vhdr, self.filename, overwrite=self.overwrite, ignoreMarkerTypes=True)
+        for store_file in [self.writer.vhdr, self.writer.vmrk, self.writer.eeg]:
+            os.remove(store_file)
 
     def terminate(self):
-        raw = mne.io.RawArray(self.buffer * 1e-6, self.info)
+        if self.flush_interval is not None:
+            self._terminate_stream()
+            return super().terminate()
+
+        values, timestamps = self.buffer.last()
+        raw = mne.io.RawArray(values.T * 1e-6, self.info)
         
         annotations = raw.annotations
         for timestamp, value in zip(self.marker_timestmaps, self.marker_values):
-           timestamp = timestamp - self.timestamps[0]
+           timestamp = timestamp - timestamps[0]
            annotations += mne.Annotations(onset=timestamp, duration=0, description=value)
         raw.set_annotations(annotations)
 
@@ -1,17 +1,22 @@
+import os
 from neuxus.nodes import correct, io, filter, read
 from cwl_node import CWL
 from save import Save
+from stage_cache import StageCache, stage_reader
 
 
-# Read from file
+# Read from file (run by `python offline.py save_pipeline.py`, the cached stages are sent as fast as possible)
 data_path = r'C:\Users\victor.ferat\Documents\Soraya\EEG-MRI\P05_eyes_closed_mrion.vhdr'
-signal = read.Reader(data_path)
 
-# GA
-signal_ga = correct.GA(signal.output, start_marker='Response/R128', tr=0.8)  # 'Response/R128' is the marker of the start of every MRI volume (in case the data is read from a Brain Vision file; in case it's streamed by Brain Vision Recorder, it is 'R128')
-
-# Down-sample
-signal_ds = filter.DownSample(signal_ga.output, 20)
+# GA and Down-sample, computed by the first run and read from the cache by the next ones
+# ('Response/R128' is the marker of the start of every MRI volume in case the data is read from a Brain Vision file; in case it's streamed by Brain Vision Recorder, it is 'R128')
+cache = StageCache(os.path.join(os.path.dirname(data_path), 'stage_cache'), max_bytes=50e9)
+signal_ds = stage_reader(cache, data_path, [('ga', {'start_marker': 'Response/R128', 'tr': 0.8}),
+                                            ('downsample', {'factor': 20})])
+# Without the cache
+#signal = read.Reader(data_path)
+#signal_ga = correct.GA(signal.output, start_marker='Response/R128', tr=0.8)
+#signal_ds = filter.DownSample(signal_ga.output, 20)
 
 # CWL
 signal_cwl = CWL(signal_ds.output, time_delay=21e-3, window_duration=4, overlap=0.5)
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import numpy as np
+import pylsl
+from neuxus.node import Node
+from neuxus.chunks import Port
+
+# The ring is written by the RDA bridge (RDA/shm_ring.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RDA'))
+from shm_ring import SharedRingReader
+
+
+class SharedMemoryReceive(Node):
+    """Receive the signal and the markers of the RDA bridge from its shared
+    memory ring (RDA_lsl.py --shared-memory name), on the same computer.
+
+    Same output as io.LslReceive('name', 'RDA2LSL', 'signal') with sync
+    'local' (float32 samples in microvolts, timestamps in time() clock) and
+    the markers on marker_output as io.RdaReceive, without the LSL
+    serialization and network stack. The samples overwritten before they were
+    read (the pipeline is more than the ring duration late) are counted in
+    overruns. If the bridge recreates the ring the node attaches to the new
+    one. Requires Python 3.8 or later.
+    """
+
+    def __init__(self, name, timeout=10.0):
+        Node.__init__(self, None)
+        self.name = name
+        self._timeout = timeout
+        self.offset = time.time() - pylsl.local_clock()
+        self.ring = None
+        self._connect()
+        self.channels = self.ring.channelNames
+
+        self.output.set_parameters(
+            data_type='signal',
+            channels=self.channels,
+            sampling_frequency=self.ring.sfreq,
+            meta={'name': name, 'type': 'EEG', 'frequency': self.ring.sfreq})
+
+        self.marker_output = Port()
+        self.marker_output.set_parameters(
+            data_type='marker',
+            channels=['Markers'],
+            sampling_frequency=0,
+            meta='')
+
+        Node.log_instance(self, {
+            'marker output': self.marker_output.id,
+            'channels': self.channels,
+            'sampling frequency': self.ring.sfreq})
+
+    def _connect(self):
+        # Wait for the bridge to create the ring (at the Start message of the Recorder)
+        deadline = time.time() + self._timeout
+        while True:
+            try:
+                self.ring = SharedRingReader(self.name)
+                return
+            except (FileNotFoundError, RuntimeError):
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    @property
+    def overruns(self):
+        return self.ring.overruns
+
+    def update(self):
+        data, timestamps, markers = self.ring.Read()
+        if len(data):
+            self.output.set(data, timestamps + self.offset, self.channels)
+        if markers:
+            self.marker_output.set([description for (_, description) in markers],
+                                   [timestamp + self.offset for (timestamp, _) in markers])
+        if self.ring.closed:
+            # Attach to the ring of the next connection of the bridge, same channels
+            overruns = self.ring.overruns
+            self.ring.Close()
+            try:
+                self.ring = SharedRingReader(self.name)
+                self.ring.overruns = overruns
+            except (FileNotFoundError, RuntimeError):
+                self.ring = _ClosedRing(overruns, self.channels)
+
+
+class _ClosedRing():
+    # Ring of a bridge that stopped, until it starts again
+    def __init__(self, overruns, channels):
+        self.overruns = overruns
+        self.channels = channels
+        self.closed = True
+
+    def Read(self):
+        return np.empty((0, len(self.channels)), dtype=np.float32), np.empty(0), []
+
+    def Close(self):
+        pass
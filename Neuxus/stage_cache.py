@@ -0,0 +1,337 @@
+"""
+Disk cache of the outputs of the correction stages of the file pipelines
+(GA, down-sampling, CWL).
+
+A stage is the node of the pipelines (correct.GA, filter.DownSample, the
+CWL node) fed with the chunks of the recording as offline.FastReader sends
+them (chunk_size samples), or with the cached output of the previous stage.
+An entry is the output of a stage as its chunks (values and timestamps,
+the values of the Ports) and the markers of the recording, keyed by the
+stage name, its parameters (with the defaults of the stage for the ones not
+given) and the key of its input: the content digest of the recording and
+chunk_size for the first stage, the key of the previous stage for the next
+ones, so that a chain of stages (GA -> downsample -> CWL) is reused by all
+the pipeline variants, batch.py and the notebooks that share its first
+stages.
+
+StageReader sends the chunks of an entry as they were sent by the stage,
+so the nodes after it receive the same chunks as in the pipeline without
+cache, and get_raw gives the entry as Save writes it (for the notebooks).
+The data of an entry is a .npy file loaded as a copy-on-write memory map
+(loading does not read the data). The cache is bounded to max_bytes: the
+least recently used entries are evicted when a new entry is stored.
+
+    cache = StageCache('C:/Vision/eeg/cache', max_bytes=50e9)
+    stages = [('ga', {'start_marker': 'Response/R128', 'tr': 0.8}),
+              ('downsample', {'factor': 20})]
+    # In a pipeline script, in place of Reader -> GA -> DownSample
+    signal_ds = stage_reader(cache, 'P02_eyes_closed_mrion.vhdr', stages)
+    # In a notebook
+    raw_ga_ds = correct_file(cache, 'P02_eyes_closed_mrion.vhdr', stages)
+"""
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+import mne
+from neuxus.node import Node
+from neuxus.chunks import Port
+
+
+def input_files(path):
+    # Files read for a recording (the .eeg and .vmrk of a .vhdr)
+    files = [path]
+    if path.lower().endswith('.vhdr'):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if line.startswith(('DataFile=', 'MarkerFile=')):
+                    files.append(os.path.join(os.path.dirname(path), line.split('=', 1)[1].strip()))
+    return files
+
+
+def content_hash(paths, memo=None):
+    """sha256 of the content of the files, memo maps a path to its size,
+    mtime and hash so that unchanged files are not read again."""
+    if memo is None:
+        memo = {}
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        entry = memo.get(os.path.abspath(path))
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            file_digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    file_digest.update(block)
+            entry = [stat.st_size, stat.st_mtime_ns, file_digest.hexdigest()]
+            memo[os.path.abspath(path)] = entry
+        digest.update(entry[2].encode())
+    return digest.hexdigest()
+
+
+class StageCache():
+
+    def __init__(self, directory, max_bytes=20e9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # Digests of the recordings, persisted to avoid reading them again
+        self._hashes_path = os.path.join(directory, 'hashes.json')
+        self._hashes = {}
+        if os.path.exists(self._hashes_path):
+            with open(self._hashes_path) as f:
+                self._hashes = json.load(f)
+
+    def file_key(self, path):
+        """Key of a recording, the digest of its content."""
+        key = content_hash(input_files(path), self._hashes)
+        with open(self._hashes_path + '.tmp', 'w') as f:
+            json.dump(self._hashes, f)
+        os.replace(self._hashes_path + '.tmp', self._hashes_path)
+        return key
+
+    @staticmethod
+    def key(stage, parent, params):
+        """Key of the output of stage with params applied to the input of key parent."""
+        description = json.dumps({'stage': stage, 'parent': parent, 'params': params}, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._path(key), 'meta.json'))
+
+    def get(self, key):
+        """Memory map (copy-on-write) of the data of key and its metadata,
+        None if key is not in the cache."""
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            data = np.load(os.path.join(path, 'data.npy'), mmap_mode='c')
+        except (OSError, ValueError):
+            return None
+        # Last access for the eviction
+        os.utime(os.path.join(path, 'meta.json'))
+        return data, meta
+
+    def put(self, key, data, meta=None, files=None):
+        """Store data (array) with meta (json) and files ({name: writer(path)})."""
+        if key in self:
+            return
+        self.evict(data.nbytes)
+        tmp = self._path(key) + '.tmp-' + uuid.uuid4().hex
+        os.makedirs(tmp)
+        try:
+            np.save(os.path.join(tmp, 'data.npy'), data)
+            for name, writer in (files or {}).items():
+                writer(os.path.join(tmp, name))
+            # Written last: an entry without meta.json is not complete
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump(dict(meta or {}, created=time.time()), f)
+            os.rename(tmp, self._path(key))
+        except OSError:
+            # Another process stored the same key
+            shutil.rmtree(tmp, ignore_errors=True)
+            if key not in self:
+                raise
+
+    def entries(self):
+        """(last access, size in bytes, key) of the entries."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir() or '.tmp-' in entry.name:
+                continue
+            try:
+                access = os.stat(os.path.join(entry.path, 'meta.json')).st_mtime
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            except OSError:
+                continue
+            entries.append((access, size, entry.name))
+        return entries
+
+    def evict(self, incoming=0):
+        """Remove the least recently used entries until incoming bytes fit in max_bytes."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries) + incoming
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            # An entry still mapped by another process may not be removable (Windows)
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            if not os.path.exists(self._path(key)):
+                total -= size
+
+    def put_stream(self, key, stream, stage=None, params=None):
+        """Store the output of a stage (see _run_stage)."""
+        values, timestamps, chunks, markers, channels, sfreq = stream
+        self.put(key, values, meta={'stage': stage, 'params': params, 'channels': channels, 'sfreq': sfreq,
+                                    'markers': markers}, files={
+            'timestamps.npy': lambda path: np.save(path, timestamps),
+            'chunks.npy': lambda path: np.save(path, chunks),
+        })
+
+    def get_raw(self, key):
+        """RawArray of the entry key (in volts, with the markers as
+        annotations, as written by Save), None if absent."""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        data, meta = entry
+        timestamps = np.load(os.path.join(self._path(key), 'timestamps.npy'), mmap_mode='r')
+        info = mne.create_info(meta['channels'], meta['sfreq'], ch_types='eeg')
+        raw = mne.io.RawArray(data.T * 1e-6, info, verbose=False)
+        if len(timestamps):
+            raw.set_annotations(mne.Annotations(onset=[t - timestamps[0] for _, t, _ in meta['markers']],
+                                                duration=0, description=[str(v) for _, _, v in meta['markers']]))
+        return raw
+
+
+class StageReader(Node):
+    """Output of a cached stage: the chunks of the stage output,
+    chunks_per_update chunks per update, without waiting (as
+    offline.FastReader), and the markers of the recording on marker_output,
+    after the chunks that were sent before them."""
+
+    def __init__(self, cache, key, chunks_per_update=50):
+        Node.__init__(self, None)
+        entry = cache.get(key)
+        if entry is None:
+            raise KeyError('%s is not in the stage cache' % key)
+        self.key = key
+        self._values, meta = entry
+        self._timestamps = np.load(os.path.join(cache._path(key), 'timestamps.npy'), mmap_mode='r')
+        self._ends = np.cumsum(np.load(os.path.join(cache._path(key), 'chunks.npy')))
+        self._markers = meta['markers']
+        self._channels = meta['channels']
+        self._sampling_frequency = meta['sfreq']
+        self._n_times = len(self._values)
+        self.chunks_per_update = chunks_per_update
+        # Next chunk to send
+        self._chunk = 0
+
+        self.marker_output = Port()
+        self.marker_output.set_parameters(data_type='marker', channels=['marker'], sampling_frequency=0, meta='')
+        self.output.set_parameters(data_type='signal', channels=self._channels,
+                                   sampling_frequency=self._sampling_frequency, meta='')
+
+    @property
+    def finished(self):
+        return self._chunk >= len(self._ends)
+
+    def update(self):
+        if self.finished:
+            return
+        stop = min(self._chunk + self.chunks_per_update, len(self._ends))
+        for chunk in range(self._chunk, stop):
+            start = self._ends[chunk - 1] if chunk else 0
+            end = self._ends[chunk]
+            self.output.set(np.array(self._values[start:end]), np.array(self._timestamps[start:end]), self._channels)
+        self._chunk = stop
+        # Markers received after the samples sent
+        sent = self._ends[stop - 1] if not self.finished else np.inf
+        while self._markers and self._markers[0][0] <= sent:
+            _, timestamp, value = self._markers.pop(0)
+            self.marker_output.set([value], [timestamp])
+
+
+def _ga(input_port, start_marker='Response/R128', tr=0.8):
+    from neuxus.nodes import correct
+    return correct.GA(input_port, start_marker=start_marker, tr=tr)
+
+
+def _downsample(input_port, factor=20):
+    from neuxus.nodes import filter
+    return filter.DownSample(input_port, factor)
+
+
+def _cwl(input_port, time_delay=21e-3, window_duration=4, overlap=0.5, mode='window'):
+    from cwl_node import CWL
+    return CWL(input_port, time_delay=time_delay, window_duration=window_duration, overlap=overlap, mode=mode)
+
+
+# Nodes of the stages, as created by the pipelines
+STAGES = {'ga': _ga, 'downsample': _downsample, 'cwl': _cwl}
+
+
+def stage_params(name, params):
+    """All the parameters of the stage name, the defaults of the stage for
+    the ones not in params (same key whether a default is given or not)."""
+    arguments = inspect.signature(STAGES[name]).bind(None, **params)
+    arguments.apply_defaults()
+    return dict(list(arguments.arguments.items())[1:])
+
+
+def _value(value):
+    # Marker value stored in json
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _run_stage(source, name, params):
+    # Output of the node of the stage fed by source (FastReader or
+    # StageReader) until its end, in the loop of the NeuXus runner: the
+    # chunks and the markers of source with the samples sent before them
+    node = STAGES[name](source.output, **params)
+    values, timestamps, chunks, markers = [], [], [], []
+    n_times = 0
+    while True:
+        finished = source.finished
+        for port in [source.output, source.marker_output, node.output]:
+            port.clear()
+        source.update()
+        node.update()
+        for chunk in node.output:
+            if len(chunk):
+                values.append(chunk.values)
+                timestamps.append(chunk.index.values)
+                chunks.append(len(chunk))
+                n_times += len(chunk)
+        for marker in source.marker_output:
+            for timestamp, value in zip(marker.index.values, marker.values[:, 0]):
+                markers.append([n_times, float(timestamp), _value(value)])
+        if finished:
+            break
+    node.terminate()
+    channels = list(node.output.channels)
+    values = np.concatenate(values) if values else np.zeros((0, len(channels)))
+    timestamps = np.concatenate(timestamps) if timestamps else np.zeros(0)
+    return values, timestamps, np.array(chunks, dtype=np.int64), markers, channels, float(node.output.sampling_frequency)
+
+
+def cached_stages(cache, path, stages, chunk_size=100, block_size=5000):
+    """Key of the output of the chain of stages [(name, params)] applied to
+    the recording read in chunks of chunk_size samples, the stages that are
+    not cached are computed (from the last cached one)."""
+    from offline import FastReader
+    key = cache.key('read', cache.file_key(path), {'chunk_size': chunk_size})
+    first = True
+    for name, params in stages:
+        params = stage_params(name, params)
+        parent, key = key, cache.key(name, key, params)
+        if key not in cache:
+            if first:
+                source = FastReader(path, chunk_size, block_size)
+            else:
+                source = StageReader(cache, parent)
+            cache.put_stream(key, _run_stage(source, name, params), stage=name, params=params)
+            # The nodes of the stage are not updated by the pipeline
+            del source
+        first = False
+    return key
+
+
+def stage_reader(cache, path, stages, chunk_size=100, block_size=5000):
+    """StageReader of the output of the chain of stages, for the pipeline
+    scripts (in place of the Reader and the nodes of the stages)."""
+    return StageReader(cache, cached_stages(cache, path, stages, chunk_size, block_size))
+
+
+def correct_file(cache, path, stages, chunk_size=100):
+    """Output (Raw) of the chain of stages [(name, params)] applied to the
+    recording, every stage is loaded from the cache if it was computed before."""
+    return cache.get_raw(cached_stages(cache, path, stages, chunk_size))
@@ -0,0 +1,68 @@
+"""
+Tests of the BandPower node against mne psd_array_welch.
+
+python -m pytest test_band_power.py
+"""
+import numpy as np
+import pandas as pd
+from mne.time_frequency import psd_array_welch
+from neuxus.chunks import Port
+
+from band_power import BandPower, DEFAULT_BANDS
+
+
+def test_features_match_welch_with_offset():
+    sfreq, n_fft, n_overlap, n_segments = 250., 256, 128, 8
+    electrodes = []
+    for _, _, left, right in DEFAULT_BANDS:
+        electrodes += [e for e in left + right if e not in electrodes]
+    rng = np.random.default_rng(0)
+    n_times = n_fft + (n_segments - 1) * (n_fft - n_overlap)
+    # EEG with DC offsets of tens of millivolts (microvolts)
+    data = rng.standard_normal((n_times, len(electrodes))) * 10 + rng.uniform(-3e4, 3e4, len(electrodes))
+
+    source = Port()
+    source.set_parameters(data_type='signal', channels=electrodes, sampling_frequency=sfreq, meta='')
+    # An output at the last sample of every segment
+    node = BandPower(source, n_fft=n_fft, n_overlap=n_overlap, n_segments=n_segments, rate=sfreq / (n_fft - n_overlap))
+    source.set(data, np.arange(n_times) / sfreq, electrodes)
+    node.update()
+    output = node.output._data[-1]
+    assert output.index[-1] == (n_times - 1) / sfreq
+    features = output.values[-1]
+
+    psd, freqs = psd_array_welch(data.T, sfreq, n_fft=n_fft, n_overlap=n_overlap, n_per_seg=n_fft, verbose=False)
+    expected = []
+    for _, (fmin, fmax), left, right in DEFAULT_BANDS:
+        in_band = (freqs >= fmin) & (freqs <= fmax)
+        left_power = psd[[electrodes.index(e) for e in left]][:, in_band].mean()
+        right_power = psd[[electrodes.index(e) for e in right]][:, in_band].mean()
+        expected += [left_power, right_power, (left_power - right_power) / right_power * 100]
+    np.testing.assert_allclose(features, expected, rtol=1e-8)
+
+
+def test_outputs_do_not_depend_on_chunks():
+    sfreq = 250.
+    electrodes = []
+    for _, _, left, right in DEFAULT_BANDS:
+        electrodes += [e for e in left + right if e not in electrodes]
+    rng = np.random.default_rng(0)
+    n_times = 2000
+    data = rng.standard_normal((n_times, len(electrodes))) * 10
+
+    outputs = []
+    for chunk_sizes in [[n_times], [5] * (n_times // 5), [7, 300, 1, 1000, 692]]:
+        source = Port()
+        source.set_parameters(data_type='signal', channels=electrodes, sampling_frequency=sfreq, meta='')
+        node = BandPower(source)
+        first = 0
+        for size in chunk_sizes:
+            source.clear()
+            source.set(data[first:first + size], np.arange(first, first + size) / sfreq, electrodes)
+            first += size
+            node.update()
+        outputs.append(pd.concat(node.output._data))
+    for output in outputs[1:]:
+        pd.testing.assert_frame_equal(output, outputs[0])
+    # From the last sample of the first segment, at 4 Hz
+    np.testing.assert_allclose(outputs[0].index.values, (255 + np.floor(np.arange(len(outputs[0])) * 62.5)) / sfreq)
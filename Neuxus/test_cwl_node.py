@@ -0,0 +1,40 @@
+"""
+Tests of the CWL correction of whole recordings.
+
+python -m pytest test_cwl_node.py
+"""
+import numpy as np
+
+from cwl_lags import LagSelection
+from cwl_node import cwl_correction_data, cwl_correction_memmap
+
+
+def test_memmap_in_place_with_picks_of_the_node():
+    # The picks of the CWL node: the first CWL channel is also corrected as EEG
+    eeg_picks, cwl_picks = np.arange(0, 33), [32, 33, 34, 35]
+    sfreq, n_times = 500., 5000
+    rng = np.random.default_rng(0)
+    cwl = rng.standard_normal((4, n_times)).cumsum(axis=1)
+    eeg = rng.standard_normal((32, n_times)) * 10 + rng.standard_normal((32, 4)) @ cwl
+    data = np.vstack((eeg, cwl))
+
+    expected = cwl_correction_data(data, eeg_picks, cwl_picks, sfreq, window_duration=2)
+    out = data.copy()
+    cwl_correction_memmap(out, eeg_picks, cwl_picks, sfreq, out, window_duration=2)
+    np.testing.assert_allclose(out[eeg_picks], expected, rtol=1e-9, atol=1e-9 * np.abs(expected).max())
+    # The CWL channels that are not EEG are left as they are
+    np.testing.assert_array_equal(out[33:], data[33:])
+
+
+def test_lag_selection_without_artifact():
+    # Nothing for the CWL to remove (flat EEG at the start of the stream)
+    sfreq, n_times = 500., 1000
+    rng = np.random.default_rng(0)
+    data = np.vstack((np.zeros((32, n_times)), rng.standard_normal((4, n_times))))
+    sample_shift = int(np.ceil(21e-3 * sfreq))
+    selection = LagSelection(data[:32].T, data[32:].T, sample_shift)
+    np.testing.assert_array_equal(selection.regressors, np.arange(4 * (2 * sample_shift + 1)))
+    selection.report(sfreq)
+    corrected = cwl_correction_data(data, np.arange(32), [32, 33, 34, 35], sfreq, window_duration=1,
+                                    regressors=selection.regressors)
+    np.testing.assert_array_equal(corrected, 0)
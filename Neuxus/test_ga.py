@@ -0,0 +1,45 @@
+"""
+Tests of the SlidingGA node markers.
+
+python -m pytest test_ga.py
+"""
+import numpy as np
+import pandas as pd
+from neuxus.chunks import Port
+
+from ga import SlidingGA
+
+
+def run(marker_times, n_chunks=10, chunk_size=50, sfreq=1000.):
+    # Samples sent by SlidingGA for chunks of chunk_size samples, with the
+    # markers received with the first chunk
+    source, markers = Port(), Port()
+    source.set_parameters(data_type='signal', channels=['C1', 'C2'], sampling_frequency=sfreq, meta='')
+    markers.set_parameters(data_type='marker', channels=['marker'], sampling_frequency=0, meta='')
+    node = SlidingGA(source, markers, start_marker='R128', tr=0.1, n_volumes=3)
+    sent = []
+    for chunk in range(n_chunks):
+        for port in [source, markers, node.output]:
+            port.clear()
+        times = (chunk * chunk_size + np.arange(chunk_size)) / sfreq
+        source.set(np.ones((chunk_size, 2)), times, ['C1', 'C2'])
+        if chunk == 0:
+            markers._data.append(pd.DataFrame({'marker': ['R128'] * len(marker_times)}, index=marker_times))
+        node.update()
+        sent += [t for output in node.output for t in output.index.values]
+    return node, np.array(sent)
+
+
+def test_samples_sent_while_marker_ahead():
+    # The marker of the sample 450 arrives with the first chunk
+    node, sent = run([0.45])
+    # The samples before the volume are sent as they arrive, the volume one TR after it
+    assert len(sent) == 450
+    np.testing.assert_allclose(sent, np.arange(450) / 1000.)
+    assert node._volume_starts == [450]
+
+
+def test_marker_older_than_buffer_dropped():
+    node, sent = run([-1.])
+    assert node._volume_starts == [] and len(node.volumes) == 0
+    assert len(sent) == 500
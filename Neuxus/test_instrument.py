@@ -0,0 +1,20 @@
+"""
+Tests of the histograms of the instrumentation.
+
+python -m pytest test_instrument.py
+"""
+import json
+import numpy as np
+
+from instrument import Histogram
+
+
+def test_overflow_bin_bounded_by_max():
+    histogram = Histogram(1e-6, 10.)
+    for value in [2e-3] * 98 + [20., 50.]:
+        histogram.add(value)
+    summary = histogram.summary(*histogram.snapshot())
+    assert summary['p99'] == summary['max'] == 50.
+    assert 2e-3 <= summary['p50'] <= 2e-3 * 10 ** 0.1
+    # Valid JSON for the sinks (no Infinity)
+    json.loads(json.dumps(summary, allow_nan=False))
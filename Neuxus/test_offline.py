@@ -0,0 +1,50 @@
+"""
+Tests of the offline runner: the outputs do not depend on the block size.
+
+python -m pytest test_offline.py
+"""
+import gc
+import os
+import sys
+import mne
+import numpy as np
+import pytest
+
+import offline
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RDA'))
+from rda_writer import BrainVisionWriter
+
+PIPELINE = """
+from neuxus.nodes import read
+from cwl_node import CWL
+from save import Save
+signal = read.Reader(%r)
+cwl = CWL(signal.output, time_delay=21e-3, window_duration=2, mode=%r, refit_interval=0.5)
+save = Save(cwl.output, filename=%r, overwrite=True)
+"""
+
+
+@pytest.mark.parametrize('mode', ['window', 'incremental', 'multirate'])
+def test_block_sizes_same_output(tmp_path, mode):
+    # 32 EEG channels with an artifact of the 4 CWL channels (32 to 35)
+    sfreq, n_times = 1000., 6000
+    rng = np.random.default_rng(0)
+    cwl = rng.standard_normal((n_times, 4)).cumsum(axis=0)
+    eeg = rng.standard_normal((n_times, 32)) * 10 + cwl @ rng.standard_normal((4, 32))
+    ch_names = ['EEG%d' % c for c in range(32)] + ['CWL%d' % c for c in range(4)]
+    writer = BrainVisionWriter(str(tmp_path / 'rec.vhdr'), ch_names, sfreq)
+    writer.Write(np.hstack((eeg, cwl)))
+    writer.Close()
+
+    outputs = []
+    for block_size in [100, 1000]:
+        filename = str(tmp_path / ('%s-%d-raw.fif' % (mode, block_size)))
+        pipeline = tmp_path / ('%s-%d.py' % (mode, block_size))
+        pipeline.write_text(PIPELINE % (str(tmp_path / 'rec.vhdr'), mode, filename))
+        offline.run(str(pipeline), chunk_size=100, block_size=block_size)
+        # The nodes of this run are not updated by the next one
+        gc.collect()
+        outputs.append(mne.io.read_raw_fif(filename, preload=True, verbose=False).get_data())
+    assert outputs[0].shape == outputs[1].shape
+    np.testing.assert_array_equal(outputs[0], outputs[1])
@@ -0,0 +1,92 @@
+"""
+Tests of the stage cache: keys, and the outputs of the pipelines reading
+the cached stages.
+
+python -m pytest test_stage_cache.py
+"""
+import gc
+import os
+import sys
+import mne
+import numpy as np
+import pytest
+
+import offline
+from stage_cache import StageCache, stage_params, correct_file
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RDA'))
+from rda_writer import BrainVisionWriter
+
+PIPELINE = """
+from neuxus.nodes import read
+from cwl_node import CWL
+from save import Save
+signal = read.Reader(%(recording)r)
+signal_cwl = CWL(signal.output, time_delay=21e-3, window_duration=2, overlap=0.5)
+signal_cwl_1 = CWL(signal_cwl.output, time_delay=21e-3, window_duration=1, overlap=0.5)
+save = Save(signal_cwl.output, filename=%(filename)r, overwrite=True)
+save_1 = Save(signal_cwl_1.output, filename=%(filename)r.replace('-raw', '-1-raw'), overwrite=True)
+"""
+
+CACHED_PIPELINE = """
+from stage_cache import StageCache, stage_reader
+from cwl_node import CWL
+from save import Save
+cache = StageCache(%(cache)r)
+signal_cwl = stage_reader(cache, %(recording)r, [('cwl', {'window_duration': 2})])
+signal_cwl_1 = CWL(signal_cwl.output, time_delay=21e-3, window_duration=1, overlap=0.5)
+save = Save(signal_cwl.output, filename=%(filename)r, overwrite=True)
+save_1 = Save(signal_cwl_1.output, filename=%(filename)r.replace('-raw', '-1-raw'), overwrite=True)
+"""
+
+
+def test_default_params_same_key():
+    keys = [StageCache.key('cwl', 'recording', stage_params('cwl', params))
+            for params in [{}, {'overlap': 0.5}, {'time_delay': 21e-3, 'window_duration': 4, 'overlap': 0.5}]]
+    assert len(set(keys)) == 1
+    assert StageCache.key('cwl', 'recording', stage_params('cwl', {'overlap': 0.75})) != keys[0]
+    assert stage_params('ga', {}) == {'start_marker': 'Response/R128', 'tr': 0.8}
+
+
+def test_unknown_param_rejected():
+    with pytest.raises(TypeError):
+        stage_params('downsample', {'decimation': 20})
+
+
+def run(tmp_path, pipeline, name, **values):
+    filename = str(tmp_path / ('%s-raw.fif' % name))
+    script = tmp_path / ('%s.py' % name)
+    script.write_text(pipeline % dict(values, filename=filename))
+    offline.run(str(script), chunk_size=100, block_size=1000)
+    # The nodes of this run are not updated by the next one
+    gc.collect()
+    return [mne.io.read_raw_fif(f, preload=True, verbose=False).get_data()
+            for f in [filename, filename.replace('-raw', '-1-raw')]]
+
+
+def test_cached_stages_same_output(tmp_path):
+    # 32 EEG channels with an artifact of the 4 CWL channels (32 to 35)
+    sfreq, n_times = 1000., 8000
+    rng = np.random.default_rng(0)
+    cwl = rng.standard_normal((n_times, 4)).cumsum(axis=0)
+    eeg = rng.standard_normal((n_times, 32)) * 10 + cwl @ rng.standard_normal((4, 32))
+    ch_names = ['EEG%d' % c for c in range(32)] + ['CWL%d' % c for c in range(4)]
+    recording = str(tmp_path / 'rec.vhdr')
+    writer = BrainVisionWriter(recording, ch_names, sfreq)
+    writer.Write(np.hstack((eeg, cwl)))
+    writer.Close()
+    cache = str(tmp_path / 'cache')
+
+    expected = run(tmp_path, PIPELINE, 'nodes', recording=recording)
+    # CWL computed, then read from the cache, and the CWL node after it
+    for name in ['computed', 'cached']:
+        outputs = run(tmp_path, CACHED_PIPELINE, name, recording=recording, cache=cache)
+        for output, reference in zip(outputs, expected):
+            np.testing.assert_array_equal(output, reference)
+    assert len(StageCache(cache).entries()) == 1
+
+    # The second stage fed by the cached first one, as saved by Save (in float32)
+    raw = correct_file(StageCache(cache), recording, [('cwl', {'window_duration': 2}),
+                                                      ('cwl', {'window_duration': 1})])
+    np.testing.assert_allclose(raw.get_data(), expected[1], rtol=1e-6, atol=1e-6 * np.abs(expected[1]).max())
+    assert len(StageCache(cache).entries()) == 2
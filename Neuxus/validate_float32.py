@@ -0,0 +1,132 @@
+"""
+Validation of the float32 path (dtype=np.float32) against the float64 path.
+
+Each recording is run through the same chain in float64 and in float32:
+- the RDA decoding, with GetData scaling the raw values by the resolutions;
+- the down-sampling of the pipelines;
+- the CWL node (modes 'window' and 'incremental') in chunks as received online;
+- Save.
+The script prints the largest deviation of the float32 outputs from the
+float64 outputs relative to the RMS of the float64 output. For CWL, the
+float64 chain is also run on the input rounded to float32: the deviation of
+that chain from the float64 output comes from the rounding of the input
+(float32 in both paths, see below) and the conditioning of the regression,
+not from the float32 arithmetic. The float32 CWL output is therefore
+checked against the float64 output of the rounded input, and the deviation
+from the float64 output and the input rounding deviation are printed for
+information. The script fails (exit status 1) if a checked deviation is
+above --tolerance.
+
+python validate_float32.py P05_eyes_closed_mrion.vhdr P07_eyes_closed_mrion.vhdr
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from struct import pack
+import numpy as np
+import mne
+from scipy import signal
+from neuxus.chunks import Port
+
+from cwl_node import CWL
+from save import Save
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'RDA'))
+from rda_decoder import GetData
+
+
+def deviation(reference, values):
+    # Largest deviation relative to the RMS of the reference
+    return np.abs(values - reference).max() / np.sqrt(np.mean(reference ** 2))
+
+
+def decode(raw_values, resolutions, dtype, points=100):
+    # Samples of RDA data messages of points samples, scaled in dtype
+    blocks = []
+    for start in range(0, len(raw_values), points):
+        block = raw_values[start:start + points]
+        rawdata = pack('<LLL', start // points, len(block), 0) + block.tobytes()
+        blocks.append(GetData(rawdata, raw_values.shape[1], resolutions, dtype)[3])
+    return np.concatenate(blocks)
+
+
+def run_chain(data, ch_names, sfreq, dtype, mode, args, filename):
+    # CWL and Save nodes fed chunk by chunk, as by the NeuXus loop
+    source = Port()
+    source.set_parameters(data_type='signal', channels=ch_names, sampling_frequency=sfreq, meta='')
+    cwl = CWL(source, time_delay=args.time_delay, window_duration=args.window_duration, mode=mode, dtype=dtype)
+    save = Save(cwl.output, filename=filename, overwrite=True, dtype=dtype)
+    start = time.perf_counter()
+    for first in range(0, len(data), args.chunk_size):
+        for port in [source, cwl.output]:
+            port.clear()
+        chunk = data[first:first + args.chunk_size]
+        source.set(chunk, np.arange(first, first + len(chunk)) / sfreq, ch_names)
+        cwl.update()
+        save.update()
+    elapsed = time.perf_counter() - start
+    save.terminate()
+    return mne.io.read_raw_fif(filename, preload=True, verbose=False).get_data().T * 1e6, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recordings", nargs='+', help="Recordings with the CWL channels at 32-35")
+    parser.add_argument("--decimation", type=int, default=20,
+                        help="Down-sampling before CWL, as DownSample in the pipelines")
+    parser.add_argument("--chunk-size", type=int, default=5,
+                        help="Samples per chunk after down-sampling (one RDA block)")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds of each recording")
+    parser.add_argument("--time-delay", type=float, default=21e-3)
+    parser.add_argument("--window-duration", type=float, default=4.)
+    parser.add_argument("--tolerance", type=float, default=1e-4,
+                        help="Largest deviation allowed, relative to the RMS of the float64 output "
+                             "(of the rounded input for CWL)")
+    args = parser.parse_args()
+
+    failed = False
+    directory = tempfile.mkdtemp()
+    for recording in args.recordings:
+        raw = mne.io.read_raw(recording, preload=True, verbose=False)
+        if args.duration is not None:
+            raw.crop(0, args.duration)
+        # As sent by the Recorder: float32 values and the channel resolutions
+        resolutions = np.full(len(raw.ch_names), 0.1)
+        raw_values = (raw.get_data().T * 1e6 / resolutions).astype(np.float32)
+
+        results = []
+        decoded = {dtype: decode(raw_values, resolutions, dtype) for dtype in [np.float64, np.float32]}
+        results.append(('RDA decoding', deviation(decoded[np.float64], decoded[np.float32]), None, None, None))
+        # The data sent to the pipeline are float32 in both cases (LSL, shared memory)
+        data = {dtype: values.astype(np.float32).astype(dtype) for (dtype, values) in decoded.items()}
+        if args.decimation > 1:
+            data = {dtype: signal.decimate(values, args.decimation, ftype='fir', axis=0).astype(dtype)
+                    for (dtype, values) in data.items()}
+        sfreq = raw.info['sfreq'] / args.decimation
+
+        for mode in ['window', 'incremental']:
+            outputs = {}
+            for (name, dtype, values) in [('float64', np.float64, data[np.float64]),
+                                          ('rounded', np.float64, data[np.float32].astype(np.float64)),
+                                          ('float32', np.float32, data[np.float32])]:
+                filename = os.path.join(directory, '%s-%s-raw.fif' % (mode, name))
+                outputs[name] = run_chain(values, raw.ch_names, sfreq, dtype, mode, args, filename)
+            reference = outputs['float64'][0][:, :32]
+            results.append(('CWL %s + Save' % mode,
+                            deviation(outputs['rounded'][0][:, :32], outputs['float32'][0][:, :32]),
+                            deviation(reference, outputs['float32'][0][:, :32]),
+                            deviation(reference, outputs['rounded'][0][:, :32]),
+                            (outputs['float64'][1], outputs['float32'][1])))
+
+        print(os.path.basename(recording))
+        for name, value, total, rounding, times in results:
+            ok = value <= args.tolerance
+            failed |= not ok
+            details = ''
+            if times is not None:
+                details = '  (from float64 %.2e, input rounding %.2e, %.2f s float64, %.2f s float32)' % (
+                    (total, rounding) + times)
+            print('  %-24s %.2e %s%s' % (name, value, 'ok' if ok else 'FAILED', details))
+    sys.exit(1 if failed else 0)
@@ -11,101 +11,8 @@ www.brainproducts.com
 
 """
 
-# needs socket and struct library
-from socket import *
-from struct import *
 import numpy as np
-import mne
-from mne_lsl.lsl.stream_info import StreamInfo
-from mne_lsl.lsl.stream_outlet import StreamOutlet
-
-# Marker class for storing marker information
-class Marker:
-    def __init__(self):
-        self.position = 0
-        self.points = 0
-        self.channel = -1
-        self.type = ""
-        self.description = ""
-
-# Helper function for receiving whole message
-def RecvData(socket, requestedSize):
-    returnStream = b''
-    while len(returnStream) < requestedSize:
-        databytes = socket.recv(requestedSize - len(returnStream))
-        if databytes == '':
-            raise(RuntimeError, "connection broken")
-        returnStream += databytes
- 
-    return returnStream   
-
-    
-# Helper function for splitting a raw array of
-# zero terminated strings (C) into an array of python strings
-def SplitString(raw):
-    stringlist = []
-    s = ""
-    for i in range(len(raw)):
-        if raw[i] != '\x00':
-            s = s + str(raw[i])
-        else:
-            stringlist.append(s)
-            s = ""
-
-    return stringlist
-    
-
-# Helper function for extracting eeg properties from a raw data array
-# read from tcpip socket
-def GetProperties(rawdata):
-
-    # Extract numerical data
-    (channelCount, samplingInterval) = unpack('<Ld', rawdata[:12])
-
-    # Extract resolutions
-    resolutions = []
-    for c in range(channelCount):
-        index = 12 + c * 8
-        restuple = unpack('<d', rawdata[index:index+8])
-        resolutions.append(restuple[0])
-
-    # Extract channel names
-    channelNames = SplitString(rawdata[12 + 8 * channelCount:])
-
-    return (channelCount, samplingInterval, resolutions, channelNames)
-
-# Helper function for extracting eeg and marker data from a raw data array
-# read from tcpip socket       
-def GetData(rawdata, channelCount):
-
-    # Extract numerical data
-    (block, points, markerCount) = unpack('<LLL', rawdata[:12])
-
-    # Extract eeg data as array of floats
-    data = []
-    for i in range(points * channelCount):
-        index = 12 + 4 * i
-        value = unpack('<f', rawdata[index:index+4])
-        data.append(value[0])
-
-    # Extract markers
-    try:
-        markers = []
-        index = 12 + 4 * points * channelCount
-        for m in range(markerCount):
-            markersize = unpack('<L', rawdata[index:index+4])
-
-            ma = Marker()
-            (ma.position, ma.points, ma.channel) = unpack('<LLl', rawdata[index+4:index+16])
-            typedesc = SplitString(rawdata[index+16:index+markersize[0]])
-            ma.type = typedesc[0]
-            ma.description = typedesc[1]
-
-            markers.append(ma)
-            index = index + markersize[0]
-    except Exception as e:
-        pass
-    return (block, points, markerCount, data, markers)
+from rda_bridge import RDABridge
 
 
 ##############################################################################################
@@ -114,101 +21,41 @@ def GetData(rawdata, channelCount):
 #
 ##############################################################################################
 
-# Create a tcpip socket
-con = socket(AF_INET, SOCK_STREAM)
-
-print("Waiting for connection...")
-while True:
-    try:
-        # Create a tcpip socket
-        con.connect(("localhost", 51254))
-        break
-    except Exception as e:
-        continue
-        
-
-# Flag for main loop
-finish = False
-
-# data buffer for calculation, empty in beginning
-buffer = None
-
-# block counter to check overflows of tcpip buffer
-lastBlock = -1
-
-#### Main Loop ####
-while not finish:
-
-    # Get message header as raw array of chars
-    rawhdr = RecvData(con, 24)
-
-    # Split array into usefull information id1 to id4 are constants
-    (id1, id2, id3, id4, msgsize, msgtype) = unpack('<llllLL', rawhdr)
-
-    # Get data part of message, which is of variable size
-    rawdata = RecvData(con, msgsize - 24)
-
-    # Perform action dependend on the message type
-    if msgtype == 1:
-        # Start message, extract eeg properties and display them
-        # TODO: channel names not display
-        (channelCount, samplingInterval, resolutions, channelNames) = GetProperties(rawdata)
-        sfreq = 1 / samplingInterval * 1000
-        # reset block counter
-        lastBlock = -1
-
-        print("Start")
-        print("Number of channels: " + str(channelCount))
-        print("Sampling interval: " + str(samplingInterval))
-        print("Resolutions: " + str(resolutions))
-        print("Channel Names: " + str(channelNames))
-
-
-        # Create Raw Array
-        if channelNames == []:
-            ch_names = [str(i+1) for i in range(channelCount)]
-        else:
-            ch_names = channelNames
-        sfreq = 1 / samplingInterval * 1e6
-
-        print(sfreq)
-        
-        mne_info = mne.create_info(ch_names=ch_names,
-                            sfreq=sfreq,
-                            ch_types='eeg')
-
-        # Create LSL outlet
-        lsl_info = StreamInfo('RDA2LSL', 'EEG', channelCount, sfreq, "float32", "myuid34234")
-        
-        lsl_info.set_channel_info(mne_info)
-
-        outlet = StreamOutlet(lsl_info)
-
-        # Initialize buffer
-        buffer = np.empty((channelCount, 1))
-
-
-    elif msgtype == 4:
-        # Data message, extract data and markers
-        (block, points, markerCount, data, markers) = GetData(rawdata, channelCount)
-        data = np.array(data)
-        data = data.reshape(points, channelCount).T
-
-        # Check for overflow
-        if lastBlock != -1 and block > lastBlock + 1:
-            print("*** Overflow with " + str(block - lastBlock) + " datablocks ***")
-        lastBlock = block
-
-        outlet.push_chunk(data.T)
-
-
-    elif msgtype == 3:
-        # Stop message, terminate program
-        print("Stop")
-        finish = True
-
-
-# Close tcpip connection
-con.close()
-
-
+if __name__ == "__main__":
+    # Parse arguments
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Publish the RDA stream of Recorder on LSL, in microvolts (the values of "
+                    "Recorder multiplied by the channel resolutions, --raw-counts for the values as sent)")
+
+    parser.add_argument("--host", default="localhost", type=str)
+    parser.add_argument("--port", default=51254, type=int)
+    parser.add_argument("--queue-size", default=64, type=int,
+                        help="Number of data blocks buffered between the receive and the push stages")
+    parser.add_argument("--backpressure", default="block", choices=["block", "drop"],
+                        help="When the queue is full, wait for the push stage or drop the incoming blocks")
+    parser.add_argument("--report-interval", default=10., type=float,
+                        help="Period in seconds of the queue depth and lag report, 0 to disable")
+    parser.add_argument("--no-markers", action="store_true",
+                        help="Do not publish the RDA markers on the RDA2LSL-Markers outlet")
+    parser.add_argument("--shared-memory", default=None, type=str,
+                        help="Name of a shared memory ring for the pipelines on this computer (Python 3.8+)")
+    parser.add_argument("--ring-duration", default=10., type=float,
+                        help="Seconds of data held by the shared memory ring")
+    parser.add_argument("--no-lsl", action="store_true",
+                        help="Do not publish the LSL outlets (with --shared-memory)")
+    parser.add_argument("--float32", action="store_true",
+                        help="Scale the samples to microvolts in float32 instead of float64")
+    parser.add_argument("--raw-counts", action="store_true",
+                        help="Publish the values of Recorder without the resolutions applied, as before "
+                             "the microvolt scaling (not the unit assumed by the 1e-6 of Save)")
+    args = parser.parse_args()
+    if args.no_lsl and args.shared_memory is None:
+        parser.error("--no-lsl requires --shared-memory")
+
+    bridge = RDABridge(host=args.host, port=args.port, queueSize=args.queue_size,
+                       backpressure=args.backpressure, reportInterval=args.report_interval,
+                       markers=not args.no_markers, sharedMemory=args.shared_memory,
+                       ringDuration=args.ring_duration, lsl=not args.no_lsl,
+                       dtype=np.float32 if args.float32 else np.float64, rawCounts=args.raw_counts)
+    bridge.Run()
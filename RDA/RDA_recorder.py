@@ -11,101 +11,14 @@ www.brainproducts.com
 
 """
 
-# needs socket and struct library
-from socket import *
-from struct import *
+import os
 import numpy as np
 import mne
+from rda_decoder import GetProperties, GetData
+from rda_receiver import MessageReceiver, Connect
+from rda_writer import BrainVisionWriter, BrainVisionToFif
 
 
-# Marker class for storing marker information
-class Marker:
-    def __init__(self):
-        self.position = 0
-        self.points = 0
-        self.channel = -1
-        self.type = ""
-        self.description = ""
-
-# Helper function for receiving whole message
-def RecvData(socket, requestedSize):
-    returnStream = b''
-    while len(returnStream) < requestedSize:
-        databytes = socket.recv(requestedSize - len(returnStream))
-        if databytes == '':
-            raise(RuntimeError, "connection broken")
-        returnStream += databytes
- 
-    return returnStream   
-
-    
-# Helper function for splitting a raw array of
-# zero terminated strings (C) into an array of python strings
-def SplitString(raw):
-    stringlist = []
-    s = ""
-    for i in range(len(raw)):
-        if raw[i] != '\x00':
-            s = s + str(raw[i])
-        else:
-            stringlist.append(s)
-            s = ""
-
-    return stringlist
-    
-
-# Helper function for extracting eeg properties from a raw data array
-# read from tcpip socket
-def GetProperties(rawdata):
-
-    # Extract numerical data
-    (channelCount, samplingInterval) = unpack('<Ld', rawdata[:12])
-
-    # Extract resolutions
-    resolutions = []
-    for c in range(channelCount):
-        index = 12 + c * 8
-        restuple = unpack('<d', rawdata[index:index+8])
-        resolutions.append(restuple[0])
-
-    # Extract channel names
-    channelNames = SplitString(rawdata[12 + 8 * channelCount:])
-
-    return (channelCount, samplingInterval, resolutions, channelNames)
-
-# Helper function for extracting eeg and marker data from a raw data array
-# read from tcpip socket       
-def GetData(rawdata, channelCount):
-
-    # Extract numerical data
-    (block, points, markerCount) = unpack('<LLL', rawdata[:12])
-
-    # Extract eeg data as array of floats
-    data = []
-    for i in range(points * channelCount):
-        index = 12 + 4 * i
-        value = unpack('<f', rawdata[index:index+4])
-        data.append(value[0])
-
-    # Extract markers
-    try:
-        markers = []
-        index = 12 + 4 * points * channelCount
-        for m in range(markerCount):
-            markersize = unpack('<L', rawdata[index:index+4])
-
-            ma = Marker()
-            (ma.position, ma.points, ma.channel) = unpack('<LLl', rawdata[index+4:index+16])
-            typedesc = SplitString(rawdata[index+16:index+markersize[0]])
-            ma.type = typedesc[0]
-            ma.description = typedesc[1]
-
-            markers.append(ma)
-            index = index + markersize[0]
-    except Exception as e:
-        pass
-    return (block, points, markerCount, data, markers)
-
 
 ##############################################################################################
 #
@@ -120,51 +33,55 @@ if __name__ == "__main__":
 
     parser.add_argument("filename", help="The path of the file where to store the data",
                         type=str)
+    parser.add_argument("--stream", action="store_true",
+                        help="Append the blocks to a BrainVision file (.vhdr/.vmrk/.eeg) as they arrive "
+                             "instead of keeping the recording in memory. If filename is not a .vhdr, "
+                             "the BrainVision file is converted to it at Stop")
     args = parser.parse_args()
 
     filename = args.filename
-    # Create a tcpip socket
-    con = socket(AF_INET, SOCK_STREAM)
+    stream = args.stream
 
     print("Waiting for connection...")
-    while True:
-        try:
-            # Create a tcpip socket
-            con.connect(("localhost", 51254))
-            break
-        except Exception as e:
-            continue
-            
+    con = Connect("localhost", 51254)
 
     # Flag for main loop
     finish = False
 
-    # data buffer for calculation, empty in beginning
-    buffer = None
+    # data blocks, only kept in memory when not streaming
+    blocks = []
+    writer = None
+    # Nothing is written before a Start message (channels, sampling interval)
+    started = False
 
     # block counter to check overflows of tcpip buffer
     lastBlock = -1
 
+    # Receives whole messages into a reused buffer
+    receiver = MessageReceiver(con)
+
     #### Main Loop ####
     while not finish:
 
-        # Get message header as raw array of chars
-        rawhdr = RecvData(con, 24)
-
-        # Split array into usefull information id1 to id4 are constants
-        (id1, id2, id3, id4, msgsize, msgtype) = unpack('<llllLL', rawhdr)
-
-        # Get data part of message, which is of variable size
-        rawdata = RecvData(con, msgsize - 24)
+        # Get message type and data part of message, which is of variable size
+        try:
+            (msgtype, rawdata) = receiver.RecvMessage()
+        except ConnectionError:
+            print("Connection broken")
+            break
 
         # Perform action dependend on the message type
         if msgtype == 1:
             # Start message, extract eeg properties and display them
-            # TODO: channel names not display
             (channelCount, samplingInterval, resolutions, channelNames) = GetProperties(rawdata)
-            sfreq = 1 / samplingInterval * 1000
+            sfreq = 1 / samplingInterval * 1e6
+            if channelNames == []:
+                ch_names = [str(i+1) for i in range(channelCount)]
+            else:
+                ch_names = channelNames
             # reset block counter
             lastBlock = -1
+            started = True
 
             print("Start")
             print("Number of channels: " + str(channelCount))
@@ -172,14 +89,21 @@ if __name__ == "__main__":
             print("Resolutions: " + str(resolutions))
             print("Channel Names: " + str(channelNames))
 
-            buffer = np.empty((channelCount, 1))
+            if stream:
+                # Raw float32 values are written, the resolutions go in the header
+                vhdr = os.path.splitext(filename)[0] + '.vhdr'
+                writer = BrainVisionWriter(vhdr, ch_names, sfreq, resolutions)
+                print("Streaming to " + vhdr)
 
 
-        elif msgtype == 4:
-            # Data message, extract data and markers
-            (block, points, markerCount, data, markers) = GetData(rawdata, channelCount)
-            data = np.array(data)
-            data = data.reshape(points, channelCount).T
+        elif msgtype == 4 and started:
+            # Data message, extract data and markers (skipped before the Start message)
+            if stream:
+                (block, points, markerCount, data, markers) = GetData(rawdata, channelCount)
+                writer.Write(data, markers)
+            else:
+                (block, points, markerCount, data, markers) = GetData(rawdata, channelCount, resolutions)
+                blocks.append(data)
 
             # Check for overflow
             if lastBlock != -1 and block > lastBlock + 1:
@@ -187,14 +111,8 @@ if __name__ == "__main__":
             lastBlock = block
 
             # Print markers, if there are some in actual block
-            try:
-                if markerCount > 0:
-                    for m in range(markerCount):
-                        print("Marker " + markers[m].description + " of type " + markers[m].type)
-            except Exception as e:
-                pass
-                
-            buffer = np.hstack((buffer, data))
+            for marker in markers:
+                print("Marker " + marker.description + " of type " + marker.type)
 
 
         elif msgtype == 3:
@@ -206,19 +124,20 @@ if __name__ == "__main__":
     # Close tcpip connection
     con.close()
 
-    # Create Raw Array
-    if channelNames == []:
-        ch_names = [str(i+1) for i in range(channelCount)]
+    if not started:
+        print("No Start message received, nothing recorded")
+    elif stream:
+        writer.Close()
+        if os.path.splitext(filename)[1] != '.vhdr':
+            BrainVisionToFif(writer.vhdr, filename)
     else:
-        ch_names = channelNames
-    sfreq = 1 / samplingInterval * 1e6
-    info = mne.create_info(ch_names=ch_names,
-                        sfreq=sfreq,
-                        ch_types='eeg')
-
-    data = buffer * 1e-9
-    raw = mne.io.RawArray(data, info)
-    # Save
-    raw.save(filename, overwrite=True)
-
-
+        # Create Raw Array
+        info = mne.create_info(ch_names=ch_names,
+                            sfreq=sfreq,
+                            ch_types='eeg')
+
+        # Samples are in microvolts once the resolutions are applied
+        data = np.concatenate(blocks).T * 1e-6
+        raw = mne.io.RawArray(data, info)
+        # Save
+        raw.save(filename, overwrite=True)
@@ -0,0 +1,68 @@
+"""
+Micro-benchmark of the RDA data message decoder.
+
+Compares the former per-sample struct.unpack loop of GetData with the
+np.frombuffer decoder of rda_decoder.py on synthetic data messages and
+prints the number of decoded samples per second.
+
+python bench_decoder.py --channels 36 --points 100 --repeat 200
+"""
+
+import argparse
+from struct import pack, unpack
+from timeit import default_timer as timer
+import numpy as np
+
+from rda_decoder import GetData
+
+
+# Former implementation, kept here as the reference of the benchmark
+def LegacyGetData(rawdata, channelCount):
+    (block, points, markerCount) = unpack('<LLL', rawdata[:12])
+    data = []
+    for i in range(points * channelCount):
+        index = 12 + 4 * i
+        value = unpack('<f', rawdata[index:index+4])
+        data.append(value[0])
+    data = np.array(data).reshape(points, channelCount)
+    return (block, points, markerCount, data)
+
+
+# Build the data part of a type 4 message
+def MakeDataMessage(block, points, channelCount, markers=()):
+    samples = np.random.randn(points, channelCount).astype('<f4')
+    rawdata = pack('<LLL', block, points, len(markers)) + samples.tobytes()
+    for (position, typ, description) in markers:
+        typedesc = typ.encode() + b'\x00' + description.encode() + b'\x00'
+        rawdata += pack('<LLLl', 16 + len(typedesc), position, 1, -1) + typedesc
+    return rawdata
+
+
+def Measure(function, rawdata, channelCount, repeat):
+    start = timer()
+    for _ in range(repeat):
+        function(rawdata, channelCount)
+    return timer() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=36)
+    parser.add_argument("--points", type=int, default=100,
+                        help="Samples per data block (100 at 5 kHz for a 20 ms block)")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    rawdata = MakeDataMessage(1, args.points, args.channels,
+                              markers=[(10, 'Response', 'R128'), (50, 'Stimulus', 'S  1')])
+
+    # Both implementations must agree before being timed
+    legacy = LegacyGetData(rawdata, args.channels)[3]
+    vectorized = GetData(rawdata, args.channels)[3]
+    assert np.array_equal(legacy, vectorized)
+
+    n_samples = args.points * args.repeat
+    for name, function in [('struct.unpack loop', LegacyGetData), ('np.frombuffer', GetData)]:
+        elapsed = Measure(function, rawdata, args.channels, args.repeat)
+        print("%-20s %12.0f samples/s  (%.1f us per block)"
+              % (name, n_samples / elapsed, 1e6 * elapsed / args.repeat))
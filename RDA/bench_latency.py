@@ -0,0 +1,189 @@
+"""
+End-to-end latency benchmark of the RDA -> LSL -> NeuXus -> LSL chain.
+
+Replays a recording with the RDA server simulator (rda_server.py) in this
+process, runs RDA_lsl.py and optionally a NeuXus pipeline script as
+subprocesses, and reads the output LSL stream (RDA2LSL without pipeline).
+Every output sample is matched, by count, with the source sample it was
+computed from (the sampling rates may differ, e.g. with DownSample) and its
+latency is its reception time minus the sending time of the data block of
+the source sample, in the LSL clock shared by the processes.
+
+Reports the latency percentiles, the missing samples, the blocks dropped by
+the bridge (--backpressure drop) or lost by overflow, and the CPU time of
+each stage (server thread, bridge and pipeline processes, Linux only for the
+subprocesses).
+
+python bench_latency.py P05_eyes_closed_mrion.vhdr --duration 60
+python bench_latency.py P05_eyes_closed_mrion.vhdr --pipeline ../Neuxus/recview_pipeline.py --output-stream BrainAmpSeries-Dev_1
+python bench_latency.py P05_eyes_closed_mrion.vhdr --shared-memory rda
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from threading import Thread, Event
+import numpy as np
+from mne_lsl.lsl import StreamInlet, resolve_streams, local_clock
+
+from rda_server import ReplayServer
+
+
+def ResolveStream(name, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        streams = resolve_streams(timeout=0.5, name=name)
+        if streams:
+            return streams[0]
+    raise RuntimeError("LSL stream %s not found" % name)
+
+
+# User and system CPU time of a process in seconds, None if not available
+def ProcessCpuTime(pid):
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime are the fields 14 and 15 of the stat file
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+# Keep the output lines of a subprocess
+def CollectOutput(process, lines):
+    for line in process.stdout:
+        lines.append(line.rstrip())
+
+
+def StartProcess(command, cwd):
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               universal_newlines=True, bufsize=1)
+    lines = []
+    Thread(target=CollectOutput, args=(process, lines), daemon=True).start()
+    return process, lines
+
+
+def Percentiles(values):
+    return "p50 %.1f | p95 %.1f | p99 %.1f | max %.1f ms" % tuple(
+        1e3 * np.percentile(values, [50, 95, 99, 100]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", type=str)
+    parser.add_argument("--pipeline", type=str, default=None, help="NeuXus pipeline script")
+    parser.add_argument("--neuxus", type=str, default="neuxus", help="Command running a pipeline")
+    parser.add_argument("--output-stream", type=str, default=None,
+                        help="LSL stream to measure (RDA2LSL without pipeline)")
+    parser.add_argument("--port", type=int, default=51254)
+    parser.add_argument("--speed", type=float, default=1.)
+    parser.add_argument("--block-duration", type=float, default=0.02, help="seconds")
+    parser.add_argument("--duration", type=float, default=60., help="Replayed seconds")
+    parser.add_argument("--tr", type=float, default=None, help="Add an R128 marker every TR (seconds)")
+    parser.add_argument("--bridge-args", type=str, default="", help="Extra arguments of RDA_lsl.py")
+    parser.add_argument("--timeout", type=float, default=30., help="Stream resolution timeout (seconds)")
+    parser.add_argument("--shared-memory", type=str, default=None,
+                        help="Measure the shared memory ring of the bridge in place of an LSL stream (no pipeline)")
+    args = parser.parse_args()
+    outputStream = args.output_stream or ('RDA2LSL' if args.pipeline is None else 'BrainAmpSeries-Dev_1')
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    server = ReplayServer(args.filename, port=args.port, speed=args.speed, blockDuration=args.block_duration,
+                          tr=args.tr, duration=args.duration)
+    server.Listen()
+    ready = Event()
+    serverThread = Thread(target=server.Serve, args=(ready,), daemon=True)
+    serverThread.start()
+
+    processes = []
+    bridgeArgs = args.bridge_args.split()
+    if args.shared_memory is not None:
+        bridgeArgs += ['--shared-memory', args.shared_memory]
+    bridge, bridgeLines = StartProcess([sys.executable, os.path.join(here, 'RDA_lsl.py'), '--port', str(args.port),
+                                        '--report-interval', '1'] + bridgeArgs, here)
+    processes.append(('bridge', bridge))
+    # The bridge creates its outlet at the start message
+    ResolveStream('RDA2LSL', args.timeout)
+    if args.pipeline is not None:
+        pipeline, pipelineLines = StartProcess([args.neuxus, os.path.abspath(args.pipeline)],
+                                               os.path.dirname(os.path.abspath(args.pipeline)))
+        processes.append(('pipeline', pipeline))
+    if args.shared_memory is not None:
+        from shm_ring import SharedRingReader
+        # Created by the bridge right after its outlet
+        deadline = time.perf_counter() + args.timeout
+        while True:
+            try:
+                ring = SharedRingReader(args.shared_memory)
+                break
+            except FileNotFoundError:
+                if time.perf_counter() > deadline:
+                    raise
+                time.sleep(0.01)
+        outputStream = 'shared memory ' + args.shared_memory
+        outputSfreq = ring.sfreq
+    else:
+        inlet = StreamInlet(ResolveStream(outputStream, args.timeout))
+        inlet.open_stream(timeout=args.timeout)
+        outputSfreq = inlet.get_sinfo().sfreq
+    cpuStart = {name: ProcessCpuTime(process.pid) for name, process in processes}
+    wallStart = time.perf_counter()
+
+    # Replay and read the output until it stays empty for 2 s after the end of the replay
+    ready.set()
+    arrivals = []
+    lastData = time.perf_counter()
+    while serverThread.is_alive() or time.perf_counter() - lastData < 2.:
+        if args.shared_memory is not None:
+            (data, timestamps, _) = ring.Read()
+            if not len(timestamps):
+                time.sleep(0.0002)
+        else:
+            data, timestamps = inlet.pull_chunk(timeout=0.001)
+        now = local_clock()
+        if len(timestamps):
+            arrivals.append(np.full(len(timestamps), now))
+            lastData = time.perf_counter()
+    wall = time.perf_counter() - wallStart
+    cpu = {name: ProcessCpuTime(process.pid) for name, process in processes}
+    if args.shared_memory is not None:
+        ring.Close()
+    else:
+        inlet.close_stream()
+    for name, process in processes:
+        if process.poll() is None:
+            process.terminate()
+        process.wait()
+    server.Close()
+
+    # Latency of the output samples
+    arrivals = np.concatenate(arrivals) if arrivals else np.empty(0)
+    ratio = server.sfreq / outputSfreq
+    sources = np.floor((np.arange(len(arrivals)) + 1) * ratio).astype(int) - 1
+    sendTimes = np.asarray(server.sendTimes)
+    latencies = arrivals - sendTimes[np.minimum(sources // server.points, len(sendTimes) - 1)]
+    expected = int(server.nSamples / ratio)
+
+    print("%s, %d channels, %g Hz, %d samples replayed at speed %g, blocks of %d samples"
+          % (args.filename, len(server.raw.ch_names), server.sfreq, server.nSamples, args.speed, server.points))
+    print("output %s at %g Hz: %d samples received, %d expected, %d missing"
+          % (outputStream, outputSfreq, len(arrivals), expected, max(expected - len(arrivals), 0)))
+    if len(latencies):
+        print("latency  " + Percentiles(latencies))
+    # Last report line of the bridge: dropped and overflow blocks
+    matches = [re.search(r'dropped (\d+) \| overflow (\d+)', line) for line in bridgeLines]
+    matches = [match for match in matches if match is not None]
+    if matches:
+        print("bridge   %s dropped blocks, %s overflow blocks" % matches[-1].groups())
+    else:
+        print("bridge   no report line (exited before its first report?)")
+    print("server   %d late blocks" % server.lateBlocks)
+    print("cpu      server %.2f s" % server.cpuTime, end='')
+    for name, _ in processes:
+        if cpu[name] is not None and cpuStart[name] is not None:
+            used = cpu[name] - cpuStart[name]
+            print(" | %s %.2f s (%.0f %%)" % (name, used, 100 * used / wall), end='')
+    print()
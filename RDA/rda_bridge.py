@@ -0,0 +1,243 @@
+"""
+Pipelined RDA to LSL bridge.
+
+A receive thread drains the RDA socket continuously into a bounded queue,
+while the main thread decodes the messages and pushes them to LSL, so that
+a stall in the LSL push does not back up the tcpip buffer of the Recorder.
+Queue depth, queue lag (time between the reception and the decoding of a
+message) and push time are measured and reported periodically.
+
+The markers of the data blocks (R128 volume triggers, stimulus codes) are
+published on a second, irregular-rate string outlet, right after the chunk
+they belong to, with a timestamp computed from their position in the block.
+
+With sharedMemory, the samples, their timestamps and the markers are also
+written to a shared memory ring (shm_ring.py) read by the pipelines running
+on the same computer, without the LSL serialization and network stack; the
+LSL outlets can then be disabled (lsl=False).
+"""
+
+from threading import Thread
+from queue import Queue, Full
+import time
+import numpy as np
+import mne
+from mne_lsl.lsl.stream_info import StreamInfo
+from mne_lsl.lsl.stream_outlet import StreamOutlet
+from mne_lsl.lsl import local_clock
+
+from rda_decoder import GetProperties, GetData
+from rda_receiver import MessageReceiver, Connect
+
+
+# Running statistics of one stage of the bridge
+class StageMetrics:
+    def __init__(self):
+        self.Reset()
+
+    def Reset(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def Add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+
+class RDABridge:
+    # backpressure is 'block' (the receive thread waits for the decode stage,
+    # the tcpip buffer fills up) or 'drop' (data blocks arriving while the
+    # queue is full are dropped and counted)
+    # markers enables the marker outlet, named name + '-Markers'
+    # sharedMemory is the name of the shared memory ring (None for none),
+    # holding the last ringDuration seconds, lsl enables the LSL outlets
+    # dtype is the dtype in which the samples are scaled to microvolts (the
+    # outlets and the ring are float32, np.float32 avoids a float64 copy)
+    # rawCounts sends the values of the Recorder without the resolutions
+    # applied, as the bridge did before, instead of microvolts (the unit of
+    # the file readers, assumed by the 1e-6 of Save)
+    def __init__(self, host="localhost", port=51254, name='RDA2LSL', queueSize=64,
+                 backpressure='block', reportInterval=10., markers=True,
+                 sharedMemory=None, ringDuration=10., lsl=True, dtype=np.float64,
+                 rawCounts=False):
+        assert backpressure in ['block', 'drop']
+        self.host = host
+        self.port = port
+        self.name = name
+        self.backpressure = backpressure
+        self.reportInterval = reportInterval
+        self.dtype = dtype
+        self.rawCounts = rawCounts
+        self.queue = Queue(maxsize=queueSize)
+
+        # Metrics
+        self.queueLag = StageMetrics()
+        self.decodeTime = StageMetrics()
+        self.pushTime = StageMetrics()
+        self.maxQueueDepth = 0
+        self.droppedBlocks = 0
+        self.overflowBlocks = 0
+        self._lastReport = time.perf_counter()
+
+        self.markers = markers
+        self.lsl = lsl
+        self.outlet = None
+        self.markerOutlet = None
+        self.sharedMemory = sharedMemory
+        self.ringDuration = ringDuration
+        self.ring = None
+        self.started = False
+        self.finish = False
+
+    ##### Receive stage #####
+
+    def _ReceiveLoop(self, con):
+        # One slot per queued message, plus the one being decoded and the
+        # one being received, so that no queued view gets overwritten
+        receiver = MessageReceiver(con, slots=self.queue.maxsize + 2)
+        while True:
+            try:
+                (msgtype, rawdata) = receiver.RecvMessage()
+            except (ConnectionError, OSError):
+                self.queue.put((None, None, time.perf_counter()))
+                return
+            item = (msgtype, rawdata, time.perf_counter())
+            if self.backpressure == 'drop' and msgtype == 4:
+                try:
+                    self.queue.put_nowait(item)
+                except Full:
+                    self.droppedBlocks += 1
+                    # Otherwise the next messages would overwrite queued views
+                    receiver.Release()
+            else:
+                self.queue.put(item)
+            if msgtype == 3:
+                return
+
+    ##### Decode and push stage #####
+
+    def _Start(self, rawdata):
+        (self.channelCount, samplingInterval, self.resolutions, channelNames) = GetProperties(rawdata)
+        self.lastBlock = -1
+
+        if channelNames == []:
+            ch_names = [str(i+1) for i in range(self.channelCount)]
+        else:
+            ch_names = channelNames
+        self.sfreq = 1 / samplingInterval * 1e6
+
+        print("Start")
+        print("Number of channels: " + str(self.channelCount))
+        print("Sampling frequency: " + str(self.sfreq))
+        print("Channel Names: " + str(ch_names))
+
+        mne_info = mne.create_info(ch_names=ch_names, sfreq=self.sfreq, ch_types='eeg')
+
+        if self.lsl:
+            # Create LSL outlet
+            lsl_info = StreamInfo(self.name, 'EEG', self.channelCount, self.sfreq, "float32", "myuid34234")
+            lsl_info.set_channel_info(mne_info)
+            self.outlet = StreamOutlet(lsl_info)
+
+            # Create LSL marker outlet
+            if self.markers:
+                marker_info = StreamInfo(self.name + '-Markers', 'Markers', 1, 0., "string", "myuid34234-markers")
+                self.markerOutlet = StreamOutlet(marker_info)
+
+        # Create the shared memory ring, kept on reconnection if the channels did not change
+        if self.sharedMemory is not None:
+            from shm_ring import SharedRingWriter
+            if self.ring is not None and not self.ring.Matches(ch_names, self.sfreq):
+                self.ring.Close()
+                self.ring = None
+            if self.ring is None:
+                self.ring = SharedRingWriter(self.sharedMemory, ch_names, self.sfreq,
+                                             int(self.ringDuration * self.sfreq))
+        self.started = True
+
+    def _Data(self, rawdata):
+        t0 = time.perf_counter()
+        resolutions = None if self.rawCounts else self.resolutions
+        (block, points, markerCount, data, markers) = GetData(rawdata, self.channelCount, resolutions, self.dtype)
+        data = data.astype(np.float32, copy=False)
+        t1 = time.perf_counter()
+
+        # Check for overflow
+        if self.lastBlock != -1 and block > self.lastBlock + 1:
+            print("*** Overflow with " + str(block - self.lastBlock) + " datablocks ***")
+            self.overflowBlocks += block - self.lastBlock - 1
+        self.lastBlock = block
+
+        # The timestamp of a chunk is the one of its last sample
+        timestamp = local_clock()
+        markerTimestamps = [timestamp - (points - 1 - marker.position) / self.sfreq for marker in markers]
+        if self.ring is not None:
+            timestamps = timestamp - np.arange(points - 1, -1, -1) / self.sfreq
+            self.ring.Write(data, timestamps, [(t, marker.description) for (t, marker) in zip(markerTimestamps, markers)])
+        if self.outlet is not None:
+            self.outlet.push_chunk(data, timestamp=timestamp)
+        if self.markerOutlet is not None:
+            for (markerTimestamp, marker) in zip(markerTimestamps, markers):
+                self.markerOutlet.push_sample([marker.description], timestamp=markerTimestamp)
+        self.decodeTime.Add(t1 - t0)
+        self.pushTime.Add(time.perf_counter() - t1)
+
+    def Report(self):
+        print("queue depth %d (max %d) | queue lag %.2f ms (max %.2f) | decode %.2f ms | "
+              "push %.2f ms (max %.2f) | dropped %d | overflow %d"
+              % (self.queue.qsize(), self.maxQueueDepth,
+                 1e3 * self.queueLag.mean, 1e3 * self.queueLag.max,
+                 1e3 * self.decodeTime.mean,
+                 1e3 * self.pushTime.mean, 1e3 * self.pushTime.max,
+                 self.droppedBlocks, self.overflowBlocks))
+        for metrics in [self.queueLag, self.decodeTime, self.pushTime]:
+            metrics.Reset()
+        self.maxQueueDepth = 0
+
+    # Serve one connection, return False if it was closed before a Stop message
+    def _Serve(self, con):
+        receiveThread = Thread(target=self._ReceiveLoop, args=(con,), daemon=True)
+        receiveThread.start()
+        while True:
+            depth = self.queue.qsize()
+            if depth > self.maxQueueDepth:
+                self.maxQueueDepth = depth
+            (msgtype, rawdata, received) = self.queue.get()
+            self.queueLag.Add(time.perf_counter() - received)
+
+            if msgtype is None:
+                print("Connection broken")
+                return False
+            elif msgtype == 1:
+                self._Start(rawdata)
+            elif msgtype == 4 and self.started:
+                self._Data(rawdata)
+            elif msgtype == 3:
+                print("Stop")
+                return True
+
+            if self.reportInterval and time.perf_counter() - self._lastReport > self.reportInterval:
+                self.Report()
+                self._lastReport = time.perf_counter()
+
+    # Run until the Recorder sends a Stop message, reconnecting if the
+    # connection is lost in between
+    def Run(self):
+        while not self.finish:
+            print("Waiting for connection...")
+            con = Connect(self.host, self.port)
+            try:
+                self.finish = self._Serve(con)
+            finally:
+                con.close()
+        if self.ring is not None:
+            self.ring.Close()
+            self.ring = None
+        self.Report()
@@ -0,0 +1,94 @@
+"""
+Decoder for the messages of the RDA tcpip interface of the BrainVision Recorder.
+Shared by RDA_lsl.py and RDA_recorder.py.
+
+The data part of a data message (type 4) is viewed as a float32 array with
+np.frombuffer, so no Python object is created per sample, and the markers
+are read with a single pass over their byte offsets.
+"""
+
+from struct import unpack_from
+import numpy as np
+
+
+# Marker class for storing marker information
+class Marker:
+    def __init__(self):
+        self.position = 0
+        self.points = 0
+        self.channel = -1
+        self.type = ""
+        self.description = ""
+
+    def __repr__(self):
+        return "Marker(%s, %s, position=%d)" % (self.type, self.description, self.position)
+
+
+# Helper function for splitting a raw array of
+# zero terminated strings (C) into an array of python strings
+def SplitString(raw):
+    strings = bytes(raw).split(b'\x00')
+    # The last element is what follows the final terminator
+    return [s.decode('utf-8', errors='replace') for s in strings[:-1]]
+
+
+# Helper function for extracting eeg properties from a raw data array
+# read from tcpip socket
+def GetProperties(rawdata):
+
+    # Extract numerical data
+    (channelCount, samplingInterval) = unpack_from('<Ld', rawdata, 0)
+
+    # Extract resolutions, one float64 per channel
+    resolutions = np.frombuffer(rawdata, dtype='<f8', count=channelCount, offset=12).copy()
+
+    # Extract channel names
+    channelNames = SplitString(rawdata[12 + 8 * channelCount:])
+
+    return (channelCount, samplingInterval, resolutions, channelNames)
+
+
+# Helper function for extracting markers from a raw data array,
+# starting at byte offset index
+def GetMarkers(rawdata, index, markerCount):
+    markers = []
+    for m in range(markerCount):
+        (markersize, position, points, channel) = unpack_from('<LLLl', rawdata, index)
+
+        ma = Marker()
+        ma.position = position
+        ma.points = points
+        ma.channel = channel
+        typedesc = SplitString(rawdata[index + 16:index + markersize])
+        if len(typedesc) > 0:
+            ma.type = typedesc[0]
+        if len(typedesc) > 1:
+            ma.description = typedesc[1]
+
+        markers.append(ma)
+        index = index + markersize
+
+    return markers
+
+
+# Helper function for extracting eeg and marker data from a raw data array
+# read from tcpip socket.
+# data is a (points, channelCount) array. Without resolutions it is a
+# read-only float32 view on rawdata (no copy), with resolutions the values
+# are scaled to microvolts, in dtype (np.float32 keeps the samples in
+# float32, without a float64 copy).
+def GetData(rawdata, channelCount, resolutions=None, dtype=np.float64):
+
+    # Extract numerical data
+    (block, points, markerCount) = unpack_from('<LLL', rawdata, 0)
+
+    # View eeg data as a float32 array
+    data = np.frombuffer(rawdata, dtype='<f4', count=points * channelCount, offset=12)
+    data = data.reshape(points, channelCount)
+    if resolutions is not None:
+        data = data * np.asarray(resolutions, dtype=dtype)
+
+    # Extract markers
+    markers = GetMarkers(rawdata, 12 + 4 * points * channelCount, markerCount)
+
+    return (block, points, markerCount, data, markers)
@@ -0,0 +1,73 @@
+"""
+Receive layer for the RDA tcpip interface of the BrainVision Recorder.
+
+Messages are read with socket.recv_into into a ring of preallocated
+bytearrays that is reused from one message to the next, and handed out as
+memoryviews (no copy). The view of a message stays valid until its slot is
+reused, i.e. for the next `slots - 1` messages.
+"""
+
+from socket import socket, AF_INET, SOCK_STREAM
+from struct import unpack_from
+import time
+
+
+# Size of the message header: id1 to id4, msgsize and msgtype
+HEADER_SIZE = 24
+
+
+class MessageReceiver:
+    def __init__(self, sock, slots=1, size=1 << 16):
+        self.socket = sock
+        self._header = bytearray(HEADER_SIZE)
+        self._slots = [bytearray(size) for _ in range(slots)]
+        self._index = 0
+
+    # Fill the whole view from the socket
+    def _RecvInto(self, view):
+        received = 0
+        while received < len(view):
+            nbytes = self.socket.recv_into(view[received:])
+            if nbytes == 0:
+                # recv_into returns 0 only when the peer closed the connection
+                raise ConnectionError("connection broken")
+            received += nbytes
+
+    # Receive the next message, return its type and a view of its data part
+    def RecvMessage(self):
+        self._RecvInto(memoryview(self._header))
+
+        # Split array into usefull information id1 to id4 are constants
+        (id1, id2, id3, id4, msgsize, msgtype) = unpack_from('<llllLL', self._header)
+        size = msgsize - HEADER_SIZE
+
+        # Grow the slot by doubling if the message does not fit
+        slot = self._slots[self._index]
+        if len(slot) < size:
+            slot = bytearray(max(size, 2 * len(slot)))
+            self._slots[self._index] = slot
+        self._index = (self._index + 1) % len(self._slots)
+
+        rawdata = memoryview(slot)[:size]
+        self._RecvInto(rawdata)
+        return (msgtype, rawdata)
+
+    # The last message is not kept (e.g. dropped): its slot is reused for the
+    # next message instead of the slot of the oldest message still held
+    def Release(self):
+        self._index = (self._index - 1) % len(self._slots)
+
+
+# Connect to the RDA server, retrying with an exponential backoff delay
+# while the Recorder is not started
+def Connect(host, port, retryDelay=0.1, maxRetryDelay=2.0):
+    delay = retryDelay
+    while True:
+        con = socket(AF_INET, SOCK_STREAM)
+        try:
+            con.connect((host, port))
+            return con
+        except OSError:
+            con.close()
+            time.sleep(delay)
+            delay = min(2 * delay, maxRetryDelay)
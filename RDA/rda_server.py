@@ -0,0 +1,171 @@
+"""
+RDA server simulator: replays a recording (.vhdr, .fif, any file read by
+mne.io.read_raw) over the tcpip RDA interface of the BrainVision Recorder.
+
+It sends a type 1 start message, type 4 float32 data blocks with the markers
+of the recording (Response/R128 is sent as type Response, description
+R128, as the Recorder does) and a type 3 stop message, at real-time rate or
+at `speed` times real time (0 for as fast as possible), so that RDA_lsl.py
+and the NeuXus pipelines can be run without the Recorder and a scanner.
+
+python rda_server.py P05_eyes_closed_mrion.vhdr
+python rda_server.py P05_eyes_closed_mrion-raw.fif --speed 2 --tr 0.8
+"""
+
+import argparse
+import socket
+import time
+import uuid
+from struct import pack
+import numpy as np
+import mne
+
+from rda_receiver import HEADER_SIZE
+
+
+# GUID of the RDA messages (id1 to id4 of the header)
+RDA_GUID = uuid.UUID('{4358458E-C996-4C86-AF4A-98BBF6C91450}').bytes_le
+
+
+def MakeMessage(msgtype, rawdata=b''):
+    return RDA_GUID + pack('<LL', HEADER_SIZE + len(rawdata), msgtype) + rawdata
+
+
+# Data part of a type 1 message, resolutions convert the float32 values to microvolts
+def MakeStartMessage(channelNames, sfreq, resolutions):
+    rawdata = pack('<Ld', len(channelNames), 1e6 / sfreq)
+    rawdata += np.asarray(resolutions, dtype='<f8').tobytes()
+    rawdata += b''.join(name.encode('utf-8') + b'\x00' for name in channelNames)
+    return rawdata
+
+
+# Data part of a type 4 message, data is (points, channelCount) and markers
+# are (position in the block, type, description)
+def MakeDataMessage(block, data, markers=()):
+    rawdata = pack('<LLL', block, len(data), len(markers)) + np.ascontiguousarray(data, dtype='<f4').tobytes()
+    for (position, typ, description) in markers:
+        typedesc = typ.encode('utf-8') + b'\x00' + description.encode('utf-8') + b'\x00'
+        rawdata += pack('<LLLl', 16 + len(typedesc), position, 1, -1) + typedesc
+    return rawdata
+
+
+class ReplayServer:
+    # speed is the replay rate relative to real time (0 sends as fast as possible),
+    # tr adds a Response/R128 marker every tr seconds (recordings without volume
+    # markers), duration replays the first seconds only
+    def __init__(self, filename, host="localhost", port=51254, speed=1., blockDuration=0.02,
+                 tr=None, duration=None):
+        self.raw = mne.io.read_raw(filename, preload=False, verbose=False)
+        if duration is not None:
+            self.raw.crop(0, min(duration, self.raw.times[-1]))
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.sfreq = self.raw.info['sfreq']
+        self.points = max(int(round(blockDuration * self.sfreq)), 1)
+        self.nSamples = self.raw.n_times
+        self.markers = self._Markers(tr)
+
+        # local_clock of the sending of every block (same clock as LSL on this machine)
+        self.sendTimes = []
+        self.lateBlocks = 0
+        self.cpuTime = 0.
+        self._listener = None
+
+    def _Markers(self, tr):
+        # Sample positions, types and descriptions of the markers
+        annotations = self.raw.annotations
+        positions = list(self.raw.time_as_index(annotations.onset, use_rounding=True))
+        markers = []
+        for description in annotations.description:
+            (typ, _, desc) = description.rpartition('/')
+            markers.append((typ or 'Comment', desc))
+        if tr is not None:
+            volumes = np.arange(0, self.nSamples, tr * self.sfreq).round().astype(int)
+            positions += list(volumes)
+            markers += [('Response', 'R128')] * len(volumes)
+        order = np.argsort(positions, kind='stable')
+        return np.asarray(positions, dtype=int)[order], [markers[i] for i in order]
+
+    def Listen(self):
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((self.host, self.port))
+        self._listener.listen(1)
+
+    def Close(self):
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+    # Accept one client and replay the recording to it. The data blocks are
+    # sent once ready is set (after the start message), if ready is given
+    def Serve(self, ready=None):
+        from mne_lsl.lsl import local_clock
+        if self._listener is None:
+            self.Listen()
+        con, _ = self._listener.accept()
+        con.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        cpuStart = time.thread_time()
+        try:
+            # The values are sent in microvolts
+            resolutions = np.ones(len(self.raw.ch_names))
+            con.sendall(MakeMessage(1, MakeStartMessage(self.raw.ch_names, self.sfreq, resolutions)))
+            if ready is not None:
+                ready.wait()
+
+            (positions, markers) = self.markers
+            batch = int(self.sfreq)
+            start = time.perf_counter()
+            block = 0
+            for first in range(0, self.nSamples, batch):
+                # Read one second at a time
+                data = (self.raw.get_data(start=first, stop=min(first + batch, self.nSamples)) * 1e6).T.astype('<f4')
+                for offset in range(0, len(data), self.points):
+                    index = first + offset
+                    points = min(self.points, len(data) - offset)
+                    if self.speed:
+                        # Send time of the block: once its last sample is acquired
+                        deadline = start + (index + points) / self.sfreq / self.speed
+                        delay = deadline - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                        elif -delay > self.points / self.sfreq / self.speed:
+                            self.lateBlocks += 1
+                    low, high = np.searchsorted(positions, [index, index + points])
+                    blockMarkers = [(positions[i] - index,) + markers[i] for i in range(low, high)]
+                    con.sendall(MakeMessage(4, MakeDataMessage(block, data[offset:offset + points], blockMarkers)))
+                    self.sendTimes.append(local_clock())
+                    block += 1
+            con.sendall(MakeMessage(3))
+        finally:
+            self.cpuTime += time.thread_time() - cpuStart
+            con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", type=str)
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--port", type=int, default=51254)
+    parser.add_argument("--speed", type=float, default=1., help="Replay rate, 0 for as fast as possible")
+    parser.add_argument("--block-duration", type=float, default=0.02, help="seconds")
+    parser.add_argument("--tr", type=float, default=None, help="Add an R128 marker every TR (seconds)")
+    parser.add_argument("--duration", type=float, default=None, help="Replay the first seconds only")
+    parser.add_argument("--loop", action='store_true', help="Serve the next client after the Stop message")
+    args = parser.parse_args()
+
+    server = ReplayServer(args.filename, args.host, args.port, args.speed, args.block_duration,
+                          args.tr, args.duration)
+    server.Listen()
+    print("Serving %s (%d channels, %g Hz, %d samples) on %s:%d"
+          % (args.filename, len(server.raw.ch_names), server.sfreq, server.nSamples, args.host, args.port))
+    try:
+        while True:
+            server.Serve()
+            print("Stop (%d blocks sent, %d late)" % (len(server.sendTimes), server.lateBlocks))
+            server.sendTimes = []
+            if not args.loop:
+                break
+    finally:
+        server.Close()
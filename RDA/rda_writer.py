@@ -0,0 +1,102 @@
+"""
+Streaming writer of BrainVision files (.vhdr, .vmrk and .eeg).
+
+The header and marker files are written when the writer is opened and the
+float32 data blocks are appended to the .eeg file as they arrive, so the
+recording is never held in memory and the files on disk are a valid
+BrainVision set at any time, even if the process dies mid-session.
+"""
+
+import os
+import numpy as np
+
+
+# Escape commas, which separate the fields of the BrainVision files
+def _Escape(string):
+    return str(string).replace(',', r'\1')
+
+
+class BrainVisionWriter:
+    # filename is the path of the .vhdr file, resolutions are the factors
+    # converting the stored values to microvolts
+    def __init__(self, filename, ch_names, sfreq, resolutions=None):
+        base = os.path.splitext(filename)[0]
+        self.vhdr = base + '.vhdr'
+        self.vmrk = base + '.vmrk'
+        self.eeg = base + '.eeg'
+        self.channelCount = len(ch_names)
+        if resolutions is None:
+            resolutions = np.ones(self.channelCount)
+
+        self.nSamples = 0
+        self.nMarkers = 0
+
+        datafile = os.path.basename(self.eeg)
+        with open(self.vhdr, 'w', encoding='utf-8') as f:
+            f.write("Brain Vision Data Exchange Header File Version 1.0\n\n")
+            f.write("[Common Infos]\n")
+            f.write("Codepage=UTF-8\n")
+            f.write("DataFile=%s\n" % datafile)
+            f.write("MarkerFile=%s\n" % os.path.basename(self.vmrk))
+            f.write("DataFormat=BINARY\n")
+            f.write("DataOrientation=MULTIPLEXED\n")
+            f.write("NumberOfChannels=%d\n" % self.channelCount)
+            # Sampling interval in microseconds
+            f.write("SamplingInterval=%r\n\n" % (1e6 / sfreq))
+            f.write("[Binary Infos]\n")
+            f.write("BinaryFormat=IEEE_FLOAT_32\n\n")
+            f.write("[Channel Infos]\n")
+            for c, (name, resolution) in enumerate(zip(ch_names, resolutions)):
+                f.write("Ch%d=%s,,%r,µV\n" % (c + 1, _Escape(name), float(resolution)))
+
+        self._markerFile = open(self.vmrk, 'w', encoding='utf-8')
+        self._markerFile.write("Brain Vision Data Exchange Marker File, Version 1.0\n\n")
+        self._markerFile.write("[Common Infos]\n")
+        self._markerFile.write("Codepage=UTF-8\n")
+        self._markerFile.write("DataFile=%s\n\n" % datafile)
+        self._markerFile.write("[Marker Infos]\n")
+        self._markerFile.flush()
+
+        self._dataFile = open(self.eeg, 'wb')
+
+    # Append a (points, channelCount) block and the markers found in it,
+    # marker positions are relative to the start of the block
+    def Write(self, data, markers=()):
+        self._dataFile.write(np.ascontiguousarray(data, dtype='<f4').data)
+        self._dataFile.flush()
+
+        for marker in markers:
+            self.WriteMarker(marker.type, marker.description, self.nSamples + marker.position,
+                             max(marker.points, 1), marker.channel, flush=False)
+        if markers:
+            self._markerFile.flush()
+
+        self.nSamples += len(data)
+
+    # Append a marker at the 0-based sample position, channel -1 means all channels
+    def WriteMarker(self, type, description, position, points=1, channel=-1, flush=True):
+        self.nMarkers += 1
+        # BrainVision positions are 1-based, channel 0 means all channels
+        self._markerFile.write("Mk%d=%s,%s,%d,%d,%d\n" % (
+            self.nMarkers, _Escape(type), _Escape(description), position + 1, points, channel + 1))
+        if flush:
+            self._markerFile.flush()
+
+    def Close(self):
+        self._dataFile.close()
+        self._markerFile.close()
+
+
+# Convert a BrainVision set to FIF. The data are read in buffers by
+# raw.save, so the recording is never loaded in memory as a whole.
+# With ignoreMarkerTypes the annotations are the marker descriptions only,
+# instead of type/description.
+def BrainVisionToFif(vhdr, filename, overwrite=True, ignoreMarkerTypes=False):
+    import mne
+    raw = mne.io.read_raw_brainvision(vhdr, preload=False)
+    if ignoreMarkerTypes:
+        annotations = raw.annotations
+        descriptions = [d.split('/', 1)[-1] for d in annotations.description]
+        raw.set_annotations(mne.Annotations(annotations.onset, annotations.duration, descriptions,
+                                            orig_time=annotations.orig_time))
+    raw.save(filename, overwrite=overwrite)
@@ -0,0 +1,197 @@
+"""
+Shared memory ring of float32 samples, timestamps and markers, between the
+RDA bridge and the NeuXus pipelines running on the same computer.
+
+One writer (RDA_lsl.py --shared-memory NAME) and any number of readers
+(SharedRingReader, the SharedMemoryReceive node of NeuXus). There is no
+lock: the writer copies a block into the ring and then publishes it by
+incrementing the write index, a reader copies the samples between its own
+read index and the write index and checks afterwards that the writer did
+not overwrite them meanwhile (overrun, the overwritten samples are dropped
+and counted). Readers start at the current write index, as an LSL inlet.
+
+Requires Python 3.8 or later (multiprocessing.shared_memory).
+"""
+
+import os
+import numpy as np
+from multiprocessing import shared_memory
+
+MAGIC = 0x52444153484d5231  # 'RDASHMR1'
+NAME_SIZE = 64
+DESCRIPTION_SIZE = 64
+
+# Fields of the header (uint64). The writer sets _RESERVE to the end of the
+# block it is about to write, and _WRITE once the block is written, and the
+# same for the markers with _MARKER_RESERVE and _MARKER_WRITE
+(_MAGIC, _CHANNELS, _CAPACITY, _MARKER_CAPACITY, _WRITE, _RESERVE, _MARKER_WRITE, _CLOSED, _SFREQ,
+ _MARKER_RESERVE) = range(10)
+HEADER_SIZE = 128
+
+# Rings created by this process
+_created = set()
+
+
+# Offsets of the fields of the shared memory buffer and its size
+def _Layout(channelCount, capacity, markerCapacity):
+    offset = HEADER_SIZE
+    fields = []
+    for (key, dtype, shape) in [('names', 'S%d' % NAME_SIZE, (channelCount,)),
+                                ('data', np.float32, (capacity, channelCount)),
+                                ('timestamps', np.float64, (capacity,)),
+                                ('markerTimestamps', np.float64, (markerCapacity,)),
+                                ('markerDescriptions', 'S%d' % DESCRIPTION_SIZE, (markerCapacity,))]:
+        fields.append((key, dtype, shape, offset))
+        # Keep the next field 8 bytes aligned
+        offset += -(-np.dtype(dtype).itemsize * int(np.prod(shape)) // 8) * 8
+    return fields, offset
+
+
+def _Views(buf, fields):
+    views = {'header': np.ndarray(HEADER_SIZE // 8, dtype=np.uint64, buffer=buf)}
+    for (key, dtype, shape, offset) in fields:
+        views[key] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+    return views
+
+
+def _Attach(name):
+    try:
+        # Python 3.13
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix' and name not in _created:
+            # Otherwise the resource tracker of the reader process unlinks the
+            # segment at its exit
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedRingWriter:
+    # capacity is in samples, markerCapacity in markers
+    def __init__(self, name, channelNames, sfreq, capacity, markerCapacity=1024):
+        self.name = name
+        self.channelNames = list(channelNames)
+        self.sfreq = sfreq
+        self.capacity = capacity
+        self.markerCapacity = markerCapacity
+        fields, size = _Layout(len(channelNames), capacity, markerCapacity)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left by a bridge that was killed
+            stale = _Attach(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _created.add(name)
+        self.views = _Views(self.shm.buf, fields)
+        header = self.views['header']
+        header[:] = 0
+        header[_CHANNELS] = len(channelNames)
+        header[_CAPACITY] = capacity
+        header[_MARKER_CAPACITY] = markerCapacity
+        header[_SFREQ:_SFREQ + 1].view(np.float64)[0] = sfreq
+        self.views['names'][:] = [name.encode('utf-8')[:NAME_SIZE] for name in self.channelNames]
+        # Written last: the readers wait for it
+        header[_MAGIC] = MAGIC
+
+    def Matches(self, channelNames, sfreq):
+        return list(channelNames) == self.channelNames and sfreq == self.sfreq
+
+    # data is (points, channelCount), timestamps (points) and markers are
+    # (timestamp, description)
+    def Write(self, data, timestamps, markers=()):
+        header = self.views['header']
+        write = int(header[_WRITE])
+        points = len(data)
+        if points > self.capacity:
+            # Only the last capacity samples can be read
+            write += points - self.capacity
+            data, timestamps = data[-self.capacity:], timestamps[-self.capacity:]
+            points = self.capacity
+        header[_RESERVE] = write + points
+        first = write % self.capacity
+        head = min(points, self.capacity - first)
+        self.views['data'][first:first + head] = data[:head]
+        self.views['data'][:points - head] = data[head:]
+        self.views['timestamps'][first:first + head] = timestamps[:head]
+        self.views['timestamps'][:points - head] = timestamps[head:]
+
+        markerWrite = int(header[_MARKER_WRITE])
+        header[_MARKER_RESERVE] = markerWrite + len(markers)
+        for (timestamp, description) in markers:
+            slot = markerWrite % self.markerCapacity
+            self.views['markerTimestamps'][slot] = timestamp
+            self.views['markerDescriptions'][slot] = description.encode('utf-8')[:DESCRIPTION_SIZE]
+            markerWrite += 1
+        # Publish the block once it is in the ring
+        header[_WRITE] = write + points
+        header[_MARKER_WRITE] = markerWrite
+
+    def Close(self):
+        self.views['header'][_CLOSED] = 1
+        self.views = None
+        self.shm.close()
+        self.shm.unlink()
+        _created.discard(self.name)
+
+
+class SharedRingReader:
+    def __init__(self, name):
+        self.shm = _Attach(name)
+        header = np.ndarray(HEADER_SIZE // 8, dtype=np.uint64, buffer=self.shm.buf)
+        if header[_MAGIC] != MAGIC:
+            raise RuntimeError("%s is not an RDA shared memory ring" % name)
+        self.capacity = int(header[_CAPACITY])
+        self.markerCapacity = int(header[_MARKER_CAPACITY])
+        self.views = _Views(self.shm.buf, _Layout(int(header[_CHANNELS]), self.capacity, self.markerCapacity)[0])
+        self.channelNames = [name.decode('utf-8') for name in self.views['names']]
+        self.sfreq = float(header[_SFREQ:_SFREQ + 1].view(np.float64)[0])
+        # Start with the next samples
+        self.readIndex = int(header[_WRITE])
+        self.markerReadIndex = int(header[_MARKER_WRITE])
+        self.overruns = 0
+
+    @property
+    def closed(self):
+        return bool(self.views['header'][_CLOSED])
+
+    # Copy of the samples [start, stop) of the ring
+    def _Copy(self, key, start, stop):
+        indices = np.arange(start, stop) % len(self.views[key])
+        return self.views[key][indices]
+
+    # New samples (points, channelCount), their timestamps and the new
+    # markers as (timestamp, description)
+    def Read(self):
+        header = self.views['header']
+        write = int(header[_WRITE])
+        start = max(self.readIndex, write - self.capacity)
+        self.overruns += start - self.readIndex
+        data = self._Copy('data', start, write)
+        timestamps = self._Copy('timestamps', start, write)
+        # Samples overwritten by the writer during the copy
+        overwritten = int(header[_RESERVE]) - self.capacity - start
+        if overwritten > 0:
+            data, timestamps = data[overwritten:], timestamps[overwritten:]
+            self.overruns += min(overwritten, write - start)
+        self.readIndex = write
+
+        markerWrite = int(header[_MARKER_WRITE])
+        markerStart = max(self.markerReadIndex, markerWrite - self.markerCapacity)
+        markerTimestamps = self._Copy('markerTimestamps', markerStart, markerWrite)
+        descriptions = self._Copy('markerDescriptions', markerStart, markerWrite)
+        # Markers overwritten by the writer during the copy, including the
+        # ones of a block being written
+        overwritten = int(header[_MARKER_RESERVE]) - self.markerCapacity - markerStart
+        if overwritten > 0:
+            markerTimestamps, descriptions = markerTimestamps[overwritten:], descriptions[overwritten:]
+        self.markerReadIndex = markerWrite
+        markers = [(t, d.decode('utf-8')) for (t, d) in zip(markerTimestamps, descriptions)]
+        return data, timestamps, markers
+
+    def Close(self):
+        self.views = None
+        self.shm.close()
@@ -0,0 +1,62 @@
+"""
+Tests of the RDA bridge receive stage.
+
+python -m pytest test_rda_bridge.py
+"""
+
+import socket
+import time
+from struct import pack
+from threading import Thread
+import numpy as np
+
+from rda_bridge import RDABridge
+from rda_decoder import GetData
+from rda_receiver import HEADER_SIZE
+
+
+# Data message (type 4) of block whose samples are all equal to block
+def DataMessage(block, points=10, channelCount=4):
+    samples = np.full((points, channelCount), block, dtype='<f4')
+    body = pack('<LLL', block, points, 0) + samples.tobytes()
+    return pack('<llllLL', 0, 0, 0, 0, HEADER_SIZE + len(body), 4) + body
+
+
+def test_drop_keeps_queued_blocks():
+    # The pipeline does not read the queue while 20 blocks arrive: the first
+    # queueSize blocks are queued intact and the next ones are dropped
+    bridge = RDABridge(queueSize=4, backpressure='drop', reportInterval=0)
+    sender, receiver = socket.socketpair()
+    thread = Thread(target=bridge._ReceiveLoop, args=(receiver,), daemon=True)
+    thread.start()
+    for block in range(20):
+        sender.sendall(DataMessage(block))
+    deadline = time.time() + 5
+    while bridge.droppedBlocks < 16 and time.time() < deadline:
+        time.sleep(0.01)
+    assert bridge.droppedBlocks == 16
+
+    for block in range(4):
+        (msgtype, rawdata, _) = bridge.queue.get_nowait()
+        assert msgtype == 4
+        (number, points, markerCount, data, markers) = GetData(rawdata, 4)
+        assert number == block
+        assert np.all(data == block)
+    sender.close()
+    thread.join(5)
+    receiver.close()
+
+
+class Outlet:
+    def push_chunk(self, data, timestamp):
+        self.data = data
+
+
+def test_data_in_microvolts_or_raw_counts():
+    # Blocks of 3 from a Recorder with a resolution of 0.1 µV
+    for (rawCounts, expected) in [(False, 0.3), (True, 3.)]:
+        bridge = RDABridge(reportInterval=0, markers=False, lsl=False, rawCounts=rawCounts)
+        (bridge.channelCount, bridge.resolutions, bridge.sfreq, bridge.lastBlock) = (4, np.full(4, 0.1), 1000., -1)
+        bridge.outlet = Outlet()
+        bridge._Data(DataMessage(3)[HEADER_SIZE:])
+        np.testing.assert_allclose(bridge.outlet.data, expected, rtol=1e-6)
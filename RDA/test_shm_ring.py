@@ -0,0 +1,35 @@
+"""
+Tests of the shared memory ring.
+
+python -m pytest test_shm_ring.py
+"""
+
+import os
+import numpy as np
+
+from shm_ring import SharedRingWriter, SharedRingReader, _MARKER_RESERVE, DESCRIPTION_SIZE
+
+
+def test_markers_overwritten_during_copy_dropped():
+    writer = SharedRingWriter('test_shm_ring_%d' % os.getpid(), ['C1'], 1000., capacity=16, markerCapacity=4)
+    reader = SharedRingReader(writer.name)
+    try:
+        writer.Write(np.zeros((4, 1)), np.arange(4.), [(float(i), 'a%d' % i) for i in range(4)])
+        copy = reader._Copy
+
+        # The writer of the next block writes 2 markers in the slots of the
+        # first ones while the reader copies them, before publishing them
+        def _Copy(key, start, stop):
+            if key == 'markerDescriptions':
+                writer.views['header'][_MARKER_RESERVE] = 6
+                for slot in range(2):
+                    writer.views['markerTimestamps'][slot] = 4. + slot
+                    writer.views['markerDescriptions'][slot] = ('b%d' % slot).encode('utf-8')[:DESCRIPTION_SIZE]
+            return copy(key, start, stop)
+        reader._Copy = _Copy
+
+        (data, timestamps, markers) = reader.Read()
+        assert markers == [(2., 'a2'), (3., 'a3')]
+    finally:
+        reader.Close()
+        writer.Close()